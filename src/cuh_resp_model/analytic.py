@@ -0,0 +1,113 @@
+"""Analytic approximation of the Step 4 bed occupancy forecasts.
+
+Bed capacity is unlimited, so patients do not affect each other, and the number of occupied
+beds at any time is a sum of independent indicators, one per patient, of whether that patient
+is in a bed. Its mean and variance on each day are convolutions of the daily numbers of
+arrivals with the probability of a patient still being in a bed a given number of days after
+arriving. These are computed here by FFT, in milliseconds rather than the seconds or minutes
+taken by the stochastic engines in `simulation`.
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+from scipy import signal, stats
+
+from .simulation import GROUPS, JITTER, QUANTILES, n_days
+
+N_TIME_OF_DAY = 64
+"""Number of quadrature points over the time of day at which patients arrive."""
+
+N_EVAL = 5
+"""Number of times of day at which occupancy is evaluated. The simulation reports the daily
+maximum occupancy, which is approximated by the evaluation time with the largest mean."""
+
+N_SF_GRID = 256
+"""Number of points at which each LoS survival function is evaluated before interpolating.
+Some `scipy.stats` distributions compute it by numerical integration, which is slow."""
+
+GROUP_BANDS = {
+    'total': ('paeds', 'adult', 'senior'),
+    'adult': ('adult', 'senior'),
+    'paeds': ('paeds',),
+}
+"""Age bands whose patients occupy the beds of each bed group."""
+
+
+def expected_occupancy(
+        df_arr: pd.DataFrame,
+        until: pd.Timestamp,
+        patient_params: dict,
+        quantiles=QUANTILES,
+        **_
+) -> dict[str, pd.DataFrame]:
+    """Mean and approximate quantiles of the daily bed occupancy in the simulation model.
+
+    Takes the same arguments as `simulation.simulate`, ignoring any others; in particular,
+    bootstrapped LoS distributions are not used. Returns a DataFrame per bed group in `GROUPS`,
+    indexed by date, with a `'mean'` column and a column for each of `quantiles`.
+
+    The quantiles use a normal approximation with the exact variance of the model. Note that
+    the number of arrivals on each day is fixed up to a small jitter, rather than Poisson, so
+    occupancy is much less variable than a Poisson distribution with the same mean.
+    """
+    days = n_days(df_arr, until)
+    n_arr = np.zeros(days)
+    n = np.asarray(df_arr.n_arr, dtype=float)[:days]
+    n_arr[:len(n)] = n
+
+    index = pd.date_range(pd.Timestamp(df_arr.date[0]), periods=days, freq='D', name='t')
+    z = stats.norm.ppf(quantiles)
+    age_dist = patient_params['age_dist']
+    in_bed = {
+        band: stay_probability(patient_params[f'dist_{band}'], days)
+        for band in ('paeds', 'adult', 'senior')
+    }
+    ret = {}
+    for group in GROUPS:
+        mean, var = occupancy_moments(
+            n_arr,
+            sum(age_dist[band] * in_bed[band] for band in GROUP_BANDS[group])
+        )
+        sd = np.sqrt(var)
+        ret[group] = pd.DataFrame(
+            {'mean': mean} | {q: np.maximum(mean + zq * sd, 0) for q, zq in zip(quantiles, z)},
+            index=index
+        )
+    return ret
+
+
+def stay_probability(dist, days: int) -> np.ndarray:
+    """Probability that a patient with LoS distribution `dist` is in a bed, for each of `days`
+    whole days after the day of arrival and each of `N_EVAL` times of day.
+
+    Returns an array of shape `(N_EVAL, days)`, averaged over the time of day of arrival."""
+    grid = (days + 1) * np.linspace(0, 1, N_SF_GRID) ** 2  # denser at short stays
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        sf = np.nan_to_num(dist.sf(grid))
+    u = (np.arange(N_TIME_OF_DAY) + 0.5) / N_TIME_OF_DAY
+    f = np.linspace(0, 1, N_EVAL)
+    lag = np.arange(days)[None, :, None] + f[:, None, None] - u  # time since arrival
+    return np.where(lag < 0, 0, np.interp(lag, grid, sf)).mean(axis=-1)
+
+
+def occupancy_moments(n_arr: np.ndarray, p: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Mean and variance of the maximum daily occupancy of a bed group.
+
+    `n_arr` is the number of arrivals on each day, and `p` is the probability that a patient
+    is in a bed of the group, in the format returned by `stay_probability`."""
+    means = np.array([convolve(n_arr, p_f) for p_f in p])
+    variances = np.array([
+        convolve(n_arr, p_f * (1 - p_f)) + convolve((JITTER * n_arr) ** 2, p_f ** 2)
+        for p_f in p
+    ])
+    i = np.argmax(means, axis=0)
+    cols = np.arange(len(n_arr))
+    return means[i, cols], variances[i, cols]
+
+
+def convolve(x: np.ndarray, kernel: np.ndarray) -> np.ndarray:
+    """Causal convolution of two non-negative series of equal length, by FFT."""
+    return np.maximum(signal.fftconvolve(x, kernel)[:len(x)], 0)
@@ -0,0 +1,70 @@
+"""Daily arrival curves, as fitted in Step 2.
+
+A scenario's daily arrivals follow a normal curve with its peak at a given date, plus a constant
+baseline. This module has no dependency on the Dash app.
+"""
+
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import curve_fit
+from scipy.stats import norm
+
+
+def norm_curve(x, x_scale, y_max):
+    """Compute a normal curve with horizontal scale `x_scale` and maximum `y_max`."""
+    y_scale = y_max / norm.pdf(0, loc=0, scale=x_scale)
+    return norm.pdf(x, loc=0, scale=x_scale) * y_scale
+
+
+def norm_curve2(x, x_scale, y_max, y_min):
+    """Same as `norm_curve` but with a y-offset."""
+    return norm_curve(x, x_scale, y_max - y_min) + y_min
+
+
+def norm_curve3(x, loc, x_scale, y_max):
+    """Compute a normal curve with mean `loc`, horizontal scale `x_scale`, and maximum `y_max`."""
+    y_scale = y_max / norm.pdf(loc, loc=loc, scale=x_scale)
+    return norm.pdf(x, loc=loc, scale=x_scale) * y_scale
+
+
+def norm_curve4(x, loc, x_scale, y_max, y_min):
+    """Same as `norm_curve3` but with a y-offset."""
+    return norm_curve3(x, loc, x_scale, y_max - y_min) + y_min
+
+
+def days(x: date, loc: date) -> float:
+    """Returns the number of days from `loc`."""
+    return (x - loc) / timedelta(days=1)
+
+
+def arrivals_frame(arr_data: dict) -> pd.DataFrame:
+    """Daily arrival counts and 7-day average from the Step 1 app data, indexed by date."""
+    arr_df = pd.DataFrame.from_dict(arr_data, orient='tight')
+    arr_df.index = pd.to_datetime(arr_df.index)
+    return arr_df
+
+
+def fit_arrival_curve(arr_df: pd.DataFrame) -> tuple[pd.Timestamp, float, float, float]:
+    """Fit a Poisson curve (see `norm_curve4`) to the daily arrivals in `arr_df`, returning the
+    peak date, horizontal scale, peak value and minimum value of the curve.
+
+    The 7-day average is used for the initial guess, and the curve is first fitted without
+    the y-offset. Raises `RuntimeError` or `ValueError` if the fit fails."""
+    xs = (arr_df.index - arr_df.index[0]) / pd.Timedelta(days=1)
+    avg = pd.Series(arr_df['7 day avg.'].to_numpy(), index=xs)
+
+    x_max = avg.idxmax()
+    y_max = avg.max()
+    y_min = avg.min()
+
+    x_scale0 = 10  # Initial guess
+
+    p_opt, _ = curve_fit(norm_curve3, xs, arr_df.Count, p0=[x_max, x_scale0, y_max])
+    p_opt, _ = curve_fit(norm_curve4, xs, arr_df.Count, p0=[*p_opt, y_min])
+
+    loc, x_scale, y_max, y_min = p_opt
+    if not np.all(np.isfinite(p_opt)):
+        raise ValueError('Poisson curve fit did not converge')
+    return arr_df.index[0] + pd.Timedelta(days=loc), abs(x_scale), y_max, y_min
@@ -0,0 +1,254 @@
+"""Backtesting of occupancy forecasts against the historical occupancy data uploaded in Step 1.
+
+For each forecast origin, the arrival curve is fitted to the daily arrivals in the weeks before
+the origin (see `arrivals.fit_arrival_curve`), and occupancy is forecast by the vectorized
+simulation engine, with the observed arrivals before the origin simulated as a warm-up. The
+patients in the ward at the origin are then resampled so that their number matches the last
+observed occupancy (see `_forecast`). The forecast distribution of total occupancy on each
+following day is scored against the observed occupancy, i.e. the sum of the `Critical Care` and
+`Non Critical Care` columns, by the coverage of its central intervals and its continuous ranked
+probability score (CRPS). Origins are simulated in parallel.
+
+The LoS distributions from Step 3 are used for every origin, so they are fitted to all uploaded
+stays, including those after the origin. The forecast intervals only allow for the randomness
+of the simulation, not for the uncertainty of the fitted arrival curve, which is extrapolated
+from a few weeks of data. Where the arrivals do not follow the curve, e.g. a wave with a long
+tail or a second wave, the forecasts are biased (see the `bias` of `backtest_summary`), and the
+coverage falls short of the nominal level beyond the first week of lead time. This module has
+no dependency on the Dash app.
+"""
+
+import warnings
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from .arrivals import arrivals_frame, fit_arrival_curve, norm_curve2
+from .simulation import QUANTILES
+from .simulation import occupancy as simulated_occupancy
+from .simulation import scenario_from_config, vectorized_patients
+from .utils import max_workers
+
+HORIZON_DAYS = 28
+"""Number of days forecast from each origin."""
+
+LOOKBACK_DAYS = 56
+"""Number of days of arrivals before each origin used to fit the arrival curve."""
+
+WARMUP_DAYS = 60
+"""Number of days of observed arrivals simulated before each origin, so that the forecasts
+include patients admitted before the origin."""
+
+BACKTEST_REPS = 200
+"""Default number of simulation replications per origin."""
+
+INTERVALS = ((0.25, 0.75), (0.1, 0.9))
+"""Central forecast intervals whose coverage is scored, as pairs of quantiles."""
+
+
+def occupancy_series(config: dict) -> pd.Series:
+    """Total observed bed occupancy from the Step 1 app data (or a downloaded config file),
+    indexed by date."""
+    occ = pd.DataFrame.from_dict(config['step_1']['occupancy_data'], orient='tight')
+    occ.index = pd.to_datetime(occ.index)
+    return occ[['Critical Care', 'Non Critical Care']].sum(axis=1, min_count=1) \
+        .rename('occupancy')
+
+
+def default_origins(arr_df: pd.DataFrame, occupancy: pd.Series, every: int = 7,
+                    horizon: int = HORIZON_DAYS, lookback: int = LOOKBACK_DAYS,
+                    warmup: int = WARMUP_DAYS, start=None, end=None) -> pd.DatetimeIndex:
+    """Forecast origins every `every` days, between `start` and `end` if given, such that the
+    arrivals before each origin and the occupancy over the forecast horizon are observed."""
+    first = max(arr_df.index[0] + pd.Timedelta(days=max(lookback, warmup)), occupancy.index[0])
+    last = min(arr_df.index[-1] + pd.Timedelta(days=1),
+               occupancy.index[-1] - pd.Timedelta(days=horizon - 1))
+    if start is not None:
+        first = max(first, pd.Timestamp(start))
+    if end is not None:
+        last = min(last, pd.Timestamp(end))
+    return pd.date_range(first, last, freq=f'{every}D')
+
+
+def origin_arrivals(arr_df: pd.DataFrame, origin: pd.Timestamp, horizon: int = HORIZON_DAYS,
+                    lookback: int = LOOKBACK_DAYS,
+                    warmup: int = WARMUP_DAYS) -> pd.DataFrame | None:
+    """Daily arrivals for a forecast from `origin`, in the format of the `df_arr` argument of
+    `simulate`: the observed arrivals for the `warmup` days before the origin, then the arrival
+    curve fitted to the `lookback` days before the origin for the `horizon` days from it.
+
+    Returns None if the arrival curve cannot be fitted."""
+    one_day = pd.Timedelta(days=1)
+    fit_df = arr_df.loc[origin - lookback * one_day:origin - one_day]
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            loc, x_scale, y_max, y_min = fit_arrival_curve(fit_df)
+    except (RuntimeError, ValueError, TypeError):
+        return None
+
+    past = pd.date_range(origin - warmup * one_day, periods=warmup)
+    future = pd.date_range(origin, periods=horizon)
+    curve = norm_curve2((future - loc) / one_day, x_scale, y_max, y_min)
+    return pd.DataFrame({
+        'date': past.append(future),
+        'n_arr': np.concatenate([
+            arr_df.Count.reindex(past).fillna(0).to_numpy(dtype=float),
+            np.maximum(curve, 0)
+        ])
+    })
+
+
+def _forecast(df_arr: pd.DataFrame, patient_params: dict, dist_samples: dict[str, list],
+              horizon: int, n_reps: int, seed: np.random.SeedSequence,
+              initial: float = np.nan) -> np.ndarray:
+    """Simulated total occupancy over the last `horizon` days of `df_arr`, as an array of shape
+    `(n_reps, horizon)`.
+
+    If `initial`, the occupancy observed on the day before the first of these days, is given,
+    the patients admitted earlier who are still in the ward at the start of that first day are
+    resampled in each replication, keeping the remaining stays of the simulated patients. Their
+    number is chosen so that the simulated occupancy of the day before would have matched
+    `initial`, i.e. `initial` less the difference between the simulated daily maximum of that
+    day and the number in the ward at its end. Otherwise, the forecast would start from the
+    occupancy expected from the arrivals data, which need not match the observed occupancy."""
+    patients_seed, ward_seed = seed.spawn(2)
+    rep, t_arr, _, los = vectorized_patients(df_arr, patient_params, dist_samples, n_reps,
+                                             patients_seed)
+    origin = len(df_arr) - horizon
+    if np.isfinite(initial) and origin > 0:
+        rng = np.random.default_rng(ward_seed)
+        in_ward = (t_arr < origin) & (t_arr + los > origin)
+        n_in_ward = np.bincount(rep[in_ward], minlength=n_reps)
+        last_max = simulated_occupancy(rep, t_arr, los, n_reps, origin)[:, -1]
+        sizes = np.maximum(np.round(initial - (last_max - n_in_ward)), 0).astype(int)
+        keep = [np.flatnonzero(t_arr >= origin)]
+        for r, size in enumerate(sizes):
+            idx = np.flatnonzero(in_ward & (rep == r))
+            keep.append(rng.choice(idx, size, replace=size > len(idx)) if idx.size > 0 else idx)
+        idx = np.concatenate(keep)
+        rep, t_arr, los = rep[idx], t_arr[idx], los[idx]
+    return simulated_occupancy(rep, t_arr, los, n_reps, len(df_arr))[:, -horizon:]
+
+
+def crps_ensemble(ensemble: np.ndarray, observed: np.ndarray) -> np.ndarray:
+    """Continuous ranked probability score of the forecast distribution given by the
+    `ensemble` members along its first axis, for the `observed` values (of the shape of the
+    remaining axes). Lower is better; for a single member, this is the absolute error.
+
+    Uses the order statistics of the ensemble, i.e. `E|X - y| - E|X - X'| / 2` with the second
+    term computed from the sorted members in linear time."""
+    x = np.sort(ensemble, axis=0)
+    n = len(x)
+    weights = (2 * np.arange(1, n + 1) - n - 1) / n**2
+    return np.abs(x - observed).mean(axis=0) - np.tensordot(weights, x, axes=(0, 0))
+
+
+def backtest(
+        config: dict,
+        origins=None,
+        every: int = 7,
+        start=None,
+        end=None,
+        horizon: int = HORIZON_DAYS,
+        lookback: int = LOOKBACK_DAYS,
+        warmup: int = WARMUP_DAYS,
+        n_reps: int = BACKTEST_REPS,
+        seed=None,
+        n_workers: int | None = None,
+        progress: Callable[[int, int], None] | None = None
+) -> pd.DataFrame:
+    """Backtest occupancy forecasts from the given `origins` (dates), or by default from every
+    `every` days between `start` and `end` (see `default_origins`), using the LoS distributions
+    and age distribution in the app data (or a downloaded config file) `config`.
+
+    Returns a DataFrame indexed by origin and lead time (1 for the origin itself) with the
+    forecast date, the `observed` occupancy, the forecast `mean` and `QUANTILES`, whether the
+    observed value lies in each of the central `INTERVALS`, the `crps` of the forecast, and the
+    CRPS of a persistence forecast (the last occupancy observed before the origin) for
+    comparison. Days without an observed occupancy, and origins where the arrival curve could
+    not be fitted, are omitted. Use `backtest_summary` to aggregate the scores.
+
+    Each forecast starts from the occupancy observed on the day before the origin, if any (see
+    `_forecast`).
+
+    Each origin uses an independent random stream spawned from `seed`. If given,
+    `progress(n_done, n_total)` is called as each origin finishes."""
+    scenario = scenario_from_config(config)
+    arr_df = arrivals_frame(config['step_1']['arr_data'])
+    occupancy = occupancy_series(config)
+    if origins is None:
+        origins = default_origins(arr_df, occupancy, every, horizon, lookback, warmup,
+                                  start, end)
+    origins = pd.DatetimeIndex(origins)
+
+    forecasts: dict[pd.Timestamp, np.ndarray] = {}
+    seeds = np.random.SeedSequence(seed).spawn(len(origins))
+    initial = occupancy.reindex(origins - pd.Timedelta(days=1)).to_numpy()
+    with ProcessPoolExecutor(n_workers or max_workers()) as executor:
+        futures = {}
+        for origin, s, y0 in zip(origins, seeds, initial):
+            df_arr = origin_arrivals(arr_df, origin, horizon, lookback, warmup)
+            if df_arr is not None:
+                futures[executor.submit(
+                    _forecast, df_arr, scenario['patient_params'], scenario['dist_samples'],
+                    horizon, n_reps, s, y0
+                )] = origin
+        for n_done, future in enumerate(as_completed(futures), 1):
+            forecasts[futures[future]] = future.result()
+            if progress:
+                progress(n_done, len(futures))
+
+    # Score all origins at once, with arrays of shape (n_origins, n_reps, horizon)
+    fitted = [origin for origin in origins if origin in forecasts]
+    if not fitted:
+        return pd.DataFrame()
+    ensemble = np.stack([forecasts[origin] for origin in fitted])
+    dates = np.array([pd.date_range(origin, periods=horizon) for origin in fitted])
+    observed = occupancy.reindex(dates.ravel()).to_numpy().reshape(dates.shape)
+    last_observed = pd.Series(initial, index=origins).loc[fitted].to_numpy()
+    quantiles = np.quantile(ensemble, QUANTILES, axis=1)
+
+    scores = {
+        't': dates.ravel(),
+        'observed': observed.ravel(),
+        'mean': ensemble.mean(axis=1).ravel(),
+        **{q: x.ravel() for q, x in zip(QUANTILES, quantiles)},
+    }
+    for lo, hi in INTERVALS:
+        lower, upper = np.quantile(ensemble, [lo, hi], axis=1)
+        scores[f'in {hi - lo:.0%}'] = ((lower <= observed) & (observed <= upper)).ravel()
+    scores['crps'] = crps_ensemble(np.moveaxis(ensemble, 1, 0), observed).ravel()
+    scores['crps (persistence)'] = np.abs(observed - last_observed[:, None]).ravel()
+
+    index = pd.MultiIndex.from_product([fitted, range(1, horizon + 1)],
+                                       names=['origin', 'lead'])
+    df = pd.DataFrame(scores, index=index)
+    return df.loc[df.observed.notna()]
+
+
+def backtest_summary(scores: pd.DataFrame) -> pd.DataFrame:
+    """Aggregate the output of `backtest` by the week of the lead time, and over all lead
+    times: the number of scored days, the mean `bias` of the forecasts (forecast mean minus
+    observed occupancy), the coverage of each interval, the mean CRPS of the forecasts and of
+    the persistence forecast, and the CRPS skill score relative to persistence (positive if the
+    forecasts are better)."""
+    coverage = [c for c in scores.columns if str(c).startswith('in ')]
+
+    def summarise_group(df: pd.DataFrame) -> pd.Series:
+        crps, crps_persistence = df['crps'].mean(), df['crps (persistence)'].mean()
+        return pd.Series({
+            'n': len(df),
+            'bias': (df['mean'] - df['observed']).mean(),
+            **{f'coverage {c[3:]}': df[c].mean() for c in coverage},
+            'crps': crps,
+            'crps (persistence)': crps_persistence,
+            'skill': 1 - crps / crps_persistence if crps_persistence > 0 else np.nan
+        })
+
+    week = (scores.index.get_level_values('lead') - 1) // 7 + 1
+    by_week = scores.groupby(week.rename('lead week')).apply(summarise_group)
+    by_week.index = [f'week {w}' for w in by_week.index]
+    return pd.concat([by_week, summarise_group(scores).to_frame('all').T])
@@ -1,7 +1,40 @@
-"""Cache for background tasks."""
+"""Caches for background tasks and simulation results."""
+
+import os
+from pathlib import Path
 
 import diskcache
 from dash import DiskcacheManager
 
-cache = diskcache.Cache('./cache')
+CACHE_DIR = Path(
+    os.environ.get('CUH_RESP_CACHE_DIR', Path(__file__).resolve().parent.parent / 'cache')
+)
+"""Directory holding the caches: the environment variable `CUH_RESP_CACHE_DIR` if set,
+otherwise `cache` next to the package (`src/cache` in a source checkout), independent of the
+working directory the app was started from."""
+
+cache = diskcache.Cache(CACHE_DIR)
 bg_manager = DiskcacheManager(cache)
+
+RESULTS_CACHE_SIZE = 2 ** 30
+"""Maximum size of the simulation results cache, in bytes."""
+
+results_cache = diskcache.Cache(
+    CACHE_DIR / 'results',
+    size_limit=RESULTS_CACHE_SIZE,
+    eviction_policy='least-recently-used'
+)
+"""Summarised simulation results and analytic expected occupancy, keyed by
+`simulation.scenario_key`. The least recently used results are evicted once the cache is
+full."""
+
+SERIES_CACHE_SIZE = 2 ** 28
+"""Maximum size of the time series cache, in bytes."""
+
+series_cache = diskcache.Cache(
+    CACHE_DIR / 'series',
+    size_limit=SERIES_CACHE_SIZE,
+    eviction_policy='least-recently-used'
+)
+"""Full-resolution data of time-series charts drawn downsampled (see `figures.downsample`),
+keyed by a random ID stored with the chart, for redrawing the visible range when zoomed."""
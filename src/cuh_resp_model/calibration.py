@@ -0,0 +1,141 @@
+"""Calibration of the arrival curve of a scenario against observed bed occupancy.
+
+Finds the parameters of the Step 2 arrival curve (see `arrivals.norm_curve2`), and optionally a
+factor scaling all LoS values, for which the expected total occupancy best matches the observed
+occupancy over a past period, in the least-squares sense. The analytic approximation in
+`analytic` is used as a fast surrogate for the simulation inside the optimiser, and the
+calibrated parameters are then checked by running the stochastic simulation.
+
+This module has no dependency on the Dash app.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import least_squares
+
+from .analytic import occupancy_moments, stay_probability
+from .arrivals import norm_curve2
+from .backtest import WARMUP_DAYS
+from .distributions import tabulate_ppf
+from .simulation import AGE_BANDS, ENGINE_VECTORIZED, N_REPS, simulate
+
+LOS_SCALE_BOUNDS = (0.25, 4.0)
+"""Bounds of the LoS scale factor, if calibrated."""
+
+MAX_X_SCALE = 120.0
+"""Upper bound of the horizontal scale of the arrival curve, in days."""
+
+
+def calibrate(
+        occupancy: pd.Series,
+        start,
+        end,
+        patient_params: dict,
+        fit_los_scale: bool = False,
+        warmup: int = WARMUP_DAYS,
+        n_reps: int = N_REPS,
+        seed=None,
+        engine: str = ENGINE_VECTORIZED,
+        n_workers: int | None = None
+) -> dict:
+    """Calibrate the arrival curve to the observed total `occupancy` (indexed by date, e.g.
+    from `backtest.occupancy_series`) between the dates `start` and `end`.
+
+    `patient_params` gives the LoS distributions and age distribution, as for `simulate`.
+    Arrivals are modelled from `warmup` days before `start`, so that patients admitted before
+    the calibration period are included. If `fit_los_scale` is True, all LoS values are also
+    multiplied by a calibrated factor within `LOS_SCALE_BOUNDS`.
+
+    Returns a dict containing the calibrated `peak_date`, `x_scale`, `peak` and `min` of the
+    arrival curve, and the `los_scale` (1 if not calibrated); the root-mean-square error in beds
+    of the surrogate (`rmse`) and of the mean of `n_reps` replications of the simulation
+    (`rmse_sim`); the fraction of days on which the observed occupancy lies in the simulated
+    80% interval (`coverage`); and a DataFrame `fit`, indexed by date, of the `observed`,
+    `expected` (surrogate) and simulated (`mean`, `0.1`, `0.9`) total occupancy.
+
+    Raises `ValueError` if there are fewer than 4 days of observed occupancy in the period."""
+    one_day = pd.Timedelta(days=1)
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    observed = occupancy.loc[start:end].dropna()
+    if len(observed) < 4:
+        raise ValueError('Not enough occupancy data in the calibration period')
+
+    dates = pd.date_range(start - warmup * one_day, end)
+    t = (dates - start) / one_day
+    obs_idx = dates.get_indexer(observed.index)
+    y = observed.to_numpy(dtype=float)
+
+    # Tabulated LoS distributions, so that the survival functions are fast to evaluate and can
+    # be rescaled (see `EmpiricalDist.scaled`)
+    age_dist = patient_params['age_dist']
+    base = {band: tabulate_ppf(patient_params[f'dist_{band}']) for band in AGE_BANDS}
+
+    def in_bed(los_scale: float) -> np.ndarray:
+        return sum(
+            age_dist[band] * stay_probability(
+                base[band].scaled(los_scale), len(dates)
+            )
+            for band in AGE_BANDS
+        )
+
+    in_bed_fixed = in_bed(1.0)
+
+    def expected(params) -> np.ndarray:
+        loc, x_scale, height, y_min, *log_scale = params
+        n_arr = norm_curve2(t - loc, x_scale, y_min + height, y_min)
+        p = in_bed(np.exp(log_scale[0])) if log_scale else in_bed_fixed
+        return occupancy_moments(n_arr, p)[0]
+
+    # Initial guess from Little's law: occupancy is about the arrival rate times the mean LoS
+    mean_los = sum(age_dist[band] * base[band].mean() for band in AGE_BANDS)
+    span = (end - start) / one_day
+    x0 = [
+        min(max((observed.idxmax() - start) / one_day - mean_los / 2, -warmup), span + warmup),
+        min(max(span / 4, 1.0), MAX_X_SCALE),
+        max(y.max() - y.min(), 1.0) / mean_los,
+        y.min() / mean_los
+    ]
+    lower = [-warmup, 1.0, 0.0, 0.0]
+    upper = [span + warmup, MAX_X_SCALE, np.inf, np.inf]
+    if fit_los_scale:
+        x0.append(0.0)
+        lower.append(np.log(LOS_SCALE_BOUNDS[0]))
+        upper.append(np.log(LOS_SCALE_BOUNDS[1]))
+
+    fit = least_squares(lambda params: expected(params)[obs_idx] - y, x0,
+                        bounds=(lower, upper), x_scale='jac')
+    loc, x_scale, height, y_min, *log_scale = fit.x
+    los_scale = float(np.exp(log_scale[0])) if log_scale else 1.0
+
+    # Confirm with the stochastic simulation
+    sim_params = patient_params
+    if fit_los_scale:
+        sim_params = patient_params | {
+            f'dist_{band}': base[band].scaled(los_scale)
+            for band in AGE_BANDS
+        }
+    df_arr = pd.DataFrame({
+        'date': dates,
+        'n_arr': norm_curve2(t - loc, x_scale, y_min + height, y_min)
+    })
+    results = simulate(df_arr, end + one_day, sim_params, n_reps=n_reps, seed=seed,
+                       engine=engine, n_workers=n_workers)[:, obs_idx, 0]
+    lo, hi = np.quantile(results, [0.1, 0.9], axis=0)
+
+    return {
+        'peak_date': start + pd.Timedelta(days=float(loc)),
+        'x_scale': float(x_scale),
+        'peak': float(y_min + height),
+        'min': float(y_min),
+        'los_scale': los_scale,
+        'rmse': float(np.sqrt(np.mean(fit.fun ** 2))),
+        'rmse_sim': float(np.sqrt(np.mean((results.mean(axis=0) - y) ** 2))),
+        'coverage': float(np.mean((lo <= y) & (y <= hi))),
+        'fit': pd.DataFrame({
+            'observed': y,
+            'expected': expected(fit.x)[obs_idx],
+            'mean': results.mean(axis=0),
+            0.1: lo,
+            0.9: hi
+        }, index=observed.index)
+    }
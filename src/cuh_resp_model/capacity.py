@@ -0,0 +1,149 @@
+"""Simulation with a finite number of beds.
+
+The `simulate` engines model an unlimited bed base, so that their results are the demand for
+beds. Here, each bed group (`BED_GROUPS`) has a fixed number of beds, and patients who arrive
+when all beds of their group are occupied board (e.g. in the emergency department or escalation
+beds) until a bed becomes free, in order of arrival. A patient's LoS starts when they get a
+bed.
+
+Patients are sampled as arrays as by `simulate_vectorized`, and each bed group of each
+replication is then simulated by an event loop over the patients in order of arrival, with a
+priority queue of the times at which each bed next becomes free. Replications in which demand
+never exceeds the capacity skip the event loop. This module has no dependency on the Dash app.
+"""
+
+import heapq
+from collections.abc import Callable
+
+import numpy as np
+import pandas as pd
+
+from .simulation import (GROUPS, N_REPS, QUANTILES, n_days, occupancy, tabulate_dists,
+                         vectorized_patients)
+
+BED_GROUPS = ('adult', 'paeds')
+"""Bed groups with a separate capacity. Adult beds are used by the adult and senior age
+bands."""
+
+
+def bed_starts(t_arr: np.ndarray, los: np.ndarray, capacity: int,
+               busy: np.ndarray | None = None) -> np.ndarray:
+    """Times at which patients arriving at the sorted times `t_arr`, with LoS `los`, get one of
+    `capacity` beds, served in order of arrival. `busy` optionally gives the times at which
+    the stays of earlier patients end. Patients who never get a bed have a start time of
+    infinity."""
+    if capacity <= 0:
+        return np.full(len(t_arr), np.inf)
+    # Heap of the times at which each bed next becomes free. Only the latest `capacity` earlier
+    # stays can still be in progress.
+    busy = np.sort(busy)[-capacity:].tolist() if busy is not None and len(busy) else []
+    free = [0.0] * (capacity - len(busy)) + busy
+    start = np.empty(len(t_arr))
+    for i, (t, stay) in enumerate(zip(t_arr.tolist(), los.tolist())):
+        s = t if t >= free[0] else free[0]
+        heapq.heapreplace(free, s + stay)
+        start[i] = s
+    return start
+
+
+def simulate_capacity(
+        df_arr: pd.DataFrame,
+        until: pd.Timestamp,
+        patient_params: dict,
+        capacity: dict[str, int | None],
+        dist_samples: dict[str, list] | None = None,
+        n_reps: int = N_REPS,
+        seed=None,
+        first_rep: int = 0,
+        crn: bool = False
+) -> dict[str, np.ndarray]:
+    """Simulate the scenario with the given number of beds in each of the `BED_GROUPS`
+    (unlimited if missing or None). The other arguments are as for `simulate_vectorized`, and
+    the same patients are simulated for the same `seed`.
+
+    Returns a dict of arrays of shape `(n_reps, n_days, len(GROUPS))`, in the format returned
+    by `simulate`: the daily maximum number of occupied beds (`occupancy`) and of boarding
+    patients (`boarding`), and the number of patients arriving each day who had to board
+    (`overflow`). With unlimited capacity, `occupancy` is the same as the output of
+    `simulate_vectorized`. If `crn` is True, the LoS distributions are first tabulated as by
+    `simulate`, so that the patients are the same as for `simulate` with common random numbers.
+
+    Raises `ValueError` if `capacity` has any keys other than `BED_GROUPS`."""
+    if unknown := set(capacity) - set(BED_GROUPS):
+        raise ValueError(f'Unknown bed groups: {", ".join(sorted(unknown))}')
+    if crn:
+        patient_params, dist_samples = tabulate_dists(patient_params, dist_samples,
+                                                      first_rep + n_reps)
+    days = n_days(df_arr, until)
+    rep, t_arr, group, los = vectorized_patients(df_arr, patient_params, dist_samples, n_reps,
+                                                 seed, first_rep, crn)
+    order = np.argsort(rep * days + t_arr, kind='stable')  # By replication then arrival time
+    rep, t_arr, group, los = rep[order], t_arr[order], group[order], los[order]
+    is_paeds = group == 0
+    masks = (np.ones(len(rep), dtype=bool), ~is_paeds, is_paeds)  # Patients in each of GROUPS
+
+    def stack(values: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        """Stack the output of `values(mask)` for the patients in each of the `GROUPS`."""
+        return np.stack([values(m) for m in masks], axis=-1)
+
+    # Occupancy with unlimited capacity, i.e. the demand for beds
+    demand = stack(lambda m: occupancy(rep[m], t_arr[m], los[m], n_reps, days))
+
+    start = t_arr.copy()
+    for j, bed_group in enumerate(GROUPS):
+        beds = capacity.get(bed_group)
+        if beds is None:
+            continue
+        # Only replications in which demand exceeds the capacity need the event loop, from the
+        # first day over capacity. The patients are sorted by replication then arrival time,
+        # so each replication's patients are a slice.
+        idx = np.flatnonzero(masks[j])
+        bounds = np.searchsorted(rep[idx], np.arange(n_reps + 1))
+        over = demand[:, :, j] > beds
+        for r in np.flatnonzero(over.any(axis=1)):
+            i = idx[bounds[r]:bounds[r + 1]]
+            first = np.searchsorted(t_arr[i], over[r].argmax())
+            before, after = i[:first], i[first:]
+            start[after] = bed_starts(t_arr[after], los[after], beds,
+                                      busy=t_arr[before] + los[before])
+
+    # Recompute occupancy only for the replications in which any patients boarded
+    waited = start > t_arr
+    occ = demand.copy()
+    affected = np.unique(rep[waited])
+    if affected.size > 0:
+        sel = np.isin(rep, affected)
+        r_sel = np.searchsorted(affected, rep[sel])
+        for j, m in enumerate(masks):
+            m = m[sel]
+            occ[affected, :, j] = occupancy(r_sel[m], start[sel][m], los[sel][m],
+                                            len(affected), days, late=waited[sel][m])
+
+    overflow_days = np.floor(t_arr).astype(int)
+    return {
+        'occupancy': occ,
+        'boarding': stack(lambda m: occupancy(rep[m & waited], t_arr[m & waited],
+                                              (start - t_arr)[m & waited], n_reps, days)),
+        'overflow': stack(lambda m: np.bincount(
+            rep[m & waited] * days + overflow_days[m & waited], minlength=n_reps * days
+        ).reshape(n_reps, days).astype(float)),
+    }
+
+
+def capacity_summary(results: dict[str, np.ndarray], quantiles=QUANTILES) -> pd.DataFrame:
+    """Summarise the output of `simulate_capacity` over the replications, returning a
+    DataFrame indexed by bed group and measure, with the `mean` and `quantiles` of each
+    measure: the number of days on which any patients were boarding (`days over capacity`),
+    the number of patients who had to board, and the peak number boarding at once."""
+    measures = {
+        'days over capacity': (results['boarding'] > 0).sum(axis=1),
+        'patients boarded': results['overflow'].sum(axis=1),
+        'peak boarding': results['boarding'].max(axis=1)
+    }
+    rows = {
+        (group, measure): [values[:, j].mean(), *np.quantile(values[:, j], quantiles)]
+        for j, group in enumerate(GROUPS)
+        for measure, values in measures.items()
+    }
+    return pd.DataFrame(list(rows.values()), columns=['mean', *quantiles],
+                        index=pd.MultiIndex.from_tuples(rows, names=['group', 'measure']))
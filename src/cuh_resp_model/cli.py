@@ -0,0 +1,311 @@
+"""Headless command-line interface for running the Step 4 simulation on downloaded config files.
+
+Only the simulation modules are imported, not Dash or the UI, so that batches of scenarios can
+be run quickly on a compute server. Example:
+
+    cuh-resp-sim test/config.json -n 1000 --engine vectorized -o results/
+    cuh-resp-sim test/config.json -n 1000 --adult-beds 120 --paeds-beds 10 -o results/
+    cuh-resp-backtest test/config.json --every 14 -o backtest.csv
+    cuh-resp-sensitivity test/config.json --sobol 256 -o sensitivity.csv
+"""
+
+import argparse
+import importlib.util
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .backtest import (BACKTEST_REPS, HORIZON_DAYS, LOOKBACK_DAYS, WARMUP_DAYS, backtest,
+                       backtest_summary)
+from .capacity import capacity_summary, simulate_capacity
+from .ensemble import simulate_ensemble
+from .sensitivity import sobol_indices, tornado
+from .simulation import (ENGINE_SALABIM, ENGINES, GROUPS, N_REPS, child_seed,
+                         paired_differences, scenario_from_config, simulate, summarise)
+
+FORMATS = ('npz', 'parquet')
+"""Output file formats. Parquet output requires `pyarrow` or `fastparquet` to be installed."""
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parse the command-line arguments."""
+    parser = argparse.ArgumentParser(
+        prog='cuh-resp-sim',
+        description='Run the respiratory disease model simulation on config files downloaded '
+                    'from Step 4 of the app.'
+    )
+    parser.add_argument('configs', nargs='+', type=Path, help='config.json file(s)')
+    parser.add_argument('-o', '--output', type=Path, default=Path('.'),
+                        help='output directory (default: current directory)')
+    parser.add_argument('-f', '--format', choices=FORMATS, default='npz',
+                        help='output file format (default: npz)')
+    parser.add_argument('-n', '--reps', type=int, default=N_REPS,
+                        help=f'number of replications, or the maximum if --tolerance is given '
+                             f'(default: {N_REPS})')
+    parser.add_argument('-t', '--tolerance', type=float, default=None,
+                        help='stop once the confidence intervals of the quantiles are narrower '
+                             'than this many beds')
+    parser.add_argument('-e', '--engine', choices=list(ENGINES), default=ENGINE_SALABIM,
+                        help=f'simulation engine (default: {ENGINE_SALABIM})')
+    parser.add_argument('-s', '--seed', type=int, default=None,
+                        help='random seed (default: random, saved in the output)')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='number of worker processes (default: all CPUs, or '
+                             'CUH_RESP_MAX_WORKERS)')
+    parser.add_argument('--store', type=Path, default=None,
+                        help='simulate all configs into one memory-mapped ensemble file (.npy) '
+                             'instead of writing separate outputs, for very large ensembles')
+    parser.add_argument('--crn', action='store_true',
+                        help='use common random numbers, and compare each scenario with the '
+                             'first')
+    parser.add_argument('--adult-beds', type=int, default=None,
+                        help='number of adult beds (default: unlimited); patients board when '
+                             'all are occupied')
+    parser.add_argument('--paeds-beds', type=int, default=None,
+                        help='number of paeds beds (default: unlimited)')
+    args = parser.parse_args(argv)
+    args.capacity = {
+        group: beds for group, beds in (('adult', args.adult_beds), ('paeds', args.paeds_beds))
+        if beds is not None
+    }
+    if args.capacity and (args.store or args.tolerance is not None):
+        parser.error('--adult-beds and --paeds-beds cannot be used with --store or --tolerance')
+    if args.format == 'parquet' and not any(
+        importlib.util.find_spec(engine) for engine in ('pyarrow', 'fastparquet')
+    ):
+        parser.error('Parquet output requires pyarrow or fastparquet to be installed')
+    return args
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Entry point of the `cuh-resp-sim` command."""
+    args = parse_args(argv)
+    args.output.mkdir(parents=True, exist_ok=True)
+    seed = np.random.SeedSequence(args.seed)
+    if args.store:
+        return main_store(args, seed)
+
+    baseline = None
+    for i, path in enumerate(args.configs):
+        with open(path, encoding='utf-8') as f:
+            scenario = scenario_from_config(json.load(f))
+        # Each config has its own stream, as in `simulate_ensemble`, unless they share one for
+        # common random numbers
+        config_seed = seed if args.crn else child_seed(seed, i)
+
+        start_time = time.perf_counter()
+        extra = {}
+        if args.capacity:
+            # Finite capacity is only simulated by its own engine, always vectorized
+            extra = simulate_capacity(**scenario, capacity=args.capacity, n_reps=args.reps,
+                                      seed=config_seed, crn=args.crn)
+            results = extra.pop('occupancy')
+        else:
+            results = simulate(
+                **scenario, n_reps=args.reps, seed=config_seed, n_workers=args.workers,
+                engine=args.engine, tolerance=args.tolerance, crn=args.crn
+            )
+        elapsed = time.perf_counter() - start_time
+
+        start = scenario['df_arr'].date[0]
+        summary = summarise(results, start)
+        out = write_results(args.output / path.stem, args.format, summary, config_seed, extra)
+        peak = np.median(results.max(axis=1), axis=0)
+        print(f'{path}: {len(results)} replications in {elapsed:.1f}s, median peak '
+              + ', '.join(f'{group} {p:g}' for group, p in zip(GROUPS, peak))
+              + f' -> {out}')
+        if extra:
+            print(capacity_summary(extra | {'occupancy': results}).round(1).to_string())
+
+        if args.crn:
+            if baseline is None:
+                baseline = path, results
+            elif baseline[1].shape == results.shape:
+                print(f'Paired differences, {path} - {baseline[0]}:')
+                print(paired_differences(baseline[1], results).round(2).to_string())
+            else:
+                print(f'{path}: cannot compare with {baseline[0]} (different days or '
+                      'replications)', file=sys.stderr)
+    return 0
+
+
+def main_store(args: argparse.Namespace, seed: np.random.SeedSequence) -> int:
+    """Simulate all configs into an ensemble store (see `ensemble.simulate_ensemble`)."""
+    scenarios = {}
+    for path in args.configs:
+        with open(path, encoding='utf-8') as f:
+            scenarios[path.stem] = scenario_from_config(json.load(f))
+
+    start_time = time.perf_counter()
+    store = simulate_ensemble(
+        args.output / args.store, scenarios, n_reps=args.reps, seed=seed,
+        n_workers=args.workers, engine=args.engine, crn=args.crn
+    )
+    print(f'{len(scenarios)} scenarios x {args.reps} replications in '
+          f'{time.perf_counter() - start_time:.1f}s -> {store.path}')
+    for name in scenarios:
+        peak = np.median(store.peaks(name), axis=0)
+        print(f'{name}: median peak '
+              + ', '.join(f'{group} {p:g}' for group, p in zip(GROUPS, peak)))
+    return 0
+
+
+def write_results(stem: Path, fmt: str, summary: dict, seed: np.random.SeedSequence,
+                  extra: dict[str, np.ndarray] | None = None) -> Path:
+    """Write the simulation results and quantiles in `summary` (see `summarise`) to files
+    beginning with `stem`, returning the path written (or the first, for Parquet). `extra`
+    optionally gives more arrays of the shape of the results, e.g. the `boarding` and
+    `overflow` from `simulate_capacity`, which are written alongside the results.
+
+    NPZ output is a single file containing the `results` array of shape
+    `(n_reps, n_days, len(GROUPS))`, the `quantiles` array of shape
+    `(len(quantile_levels), n_days, len(GROUPS))`, and the `dates`, `groups`,
+    `quantile_levels`, `seed` (entropy) and `spawn_key` needed to interpret and reproduce them,
+    the latter as `np.random.SeedSequence(int(seed), spawn_key=tuple(spawn_key))`. Parquet
+    output is two long-format tables, `<stem>_results.parquet` and
+    `<stem>_quantiles.parquet`."""
+    results = summary['results']
+    frames = summary['quantiles']
+    dates = frames[GROUPS[0]].index
+    levels = list(frames[GROUPS[0]].columns)
+
+    if fmt == 'npz':
+        path = stem.with_suffix('.npz')
+        np.savez_compressed(
+            path,
+            results=results,
+            quantiles=summary['quantile_values'],
+            quantile_levels=np.asarray(levels, dtype=float),
+            dates=dates.to_numpy(),
+            groups=np.asarray(GROUPS),
+            seed=np.asarray(str(seed.entropy)),
+            spawn_key=np.asarray(seed.spawn_key, dtype=int),
+            **(extra or {})
+        )
+        return path
+
+    n_reps, _, _ = results.shape
+    index = pd.MultiIndex.from_product(
+        [range(n_reps), dates, GROUPS], names=['rep', 't', 'group']
+    )
+    path = stem.with_name(f'{stem.name}_results.parquet')
+    columns = {'beds': results} | (extra or {})
+    pd.DataFrame({k: v.ravel() for k, v in columns.items()}, index=index).reset_index() \
+        .to_parquet(path)
+    pd.concat(
+        {group: df.rename(columns=str) for group, df in frames.items()}, names=['group']
+    ).reset_index().to_parquet(stem.with_name(f'{stem.name}_quantiles.parquet'))
+    return path
+
+
+def backtest_main(argv: list[str] | None = None) -> int:
+    """Entry point of the `cuh-resp-backtest` command, which backtests occupancy forecasts
+    against the occupancy data in a config file (see `backtest.backtest`)."""
+    parser = argparse.ArgumentParser(
+        prog='cuh-resp-backtest',
+        description='Backtest occupancy forecasts against the historical occupancy data in a '
+                    'config file downloaded from Step 4 of the app.'
+    )
+    parser.add_argument('config', type=Path, help='config.json file')
+    parser.add_argument('-o', '--output', type=Path, default=None,
+                        help='CSV file for the scores of each origin and lead time')
+    parser.add_argument('--start', default=None, help='first forecast origin (YYYY-MM-DD)')
+    parser.add_argument('--end', default=None, help='last forecast origin (YYYY-MM-DD)')
+    parser.add_argument('--every', type=int, default=7,
+                        help='days between forecast origins (default: 7)')
+    parser.add_argument('--horizon', type=int, default=HORIZON_DAYS,
+                        help=f'days forecast from each origin (default: {HORIZON_DAYS})')
+    parser.add_argument('--lookback', type=int, default=LOOKBACK_DAYS,
+                        help=f'days of arrivals used to fit the arrival curve at each origin '
+                             f'(default: {LOOKBACK_DAYS})')
+    parser.add_argument('--warmup', type=int, default=WARMUP_DAYS,
+                        help=f'days of observed arrivals simulated before each origin '
+                             f'(default: {WARMUP_DAYS})')
+    parser.add_argument('-n', '--reps', type=int, default=BACKTEST_REPS,
+                        help=f'replications per origin (default: {BACKTEST_REPS})')
+    parser.add_argument('-s', '--seed', type=int, default=None, help='random seed')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='number of worker processes (default: all CPUs, or '
+                             'CUH_RESP_MAX_WORKERS)')
+    args = parser.parse_args(argv)
+
+    with open(args.config, encoding='utf-8') as f:
+        config = json.load(f)
+    if not config.get('step_1', {}).get('occupancy_data'):
+        parser.error(f'{args.config} contains no occupancy data')
+
+    start_time = time.perf_counter()
+    scores = backtest(
+        config, every=args.every, start=args.start, end=args.end, horizon=args.horizon,
+        lookback=args.lookback, warmup=args.warmup, n_reps=args.reps, seed=args.seed,
+        n_workers=args.workers
+    )
+    if scores.empty:
+        print('No origins could be backtested', file=sys.stderr)
+        return 1
+    n_origins = scores.index.get_level_values('origin').nunique()
+    print(f'{args.config}: {n_origins} origins in {time.perf_counter() - start_time:.1f}s')
+    print(backtest_summary(scores).round(3).to_string())
+    if args.output:
+        scores.to_csv(args.output)
+    return 0
+
+
+def sensitivity_main(argv: list[str] | None = None) -> int:
+    """Entry point of the `cuh-resp-sensitivity` command, which reports the sensitivity of the
+    peak occupancy and the days above a threshold to the scenario parameters (see
+    `sensitivity`)."""
+    parser = argparse.ArgumentParser(
+        prog='cuh-resp-sensitivity',
+        description='Sensitivity analysis of the scenario in a config file downloaded from '
+                    'Step 4 of the app.'
+    )
+    parser.add_argument('config', type=Path, help='config.json file')
+    parser.add_argument('-o', '--output', type=Path, default=None,
+                        help='CSV file for the sensitivity table(s)')
+    parser.add_argument('--threshold', type=float, default=None,
+                        help='occupancy threshold in beds (default: 80%% of the baseline peak)')
+    parser.add_argument('-n', '--reps', type=int, default=200,
+                        help='replications per parameter set for the one-at-a-time analysis '
+                             '(default: 200)')
+    parser.add_argument('--sobol', type=int, default=None, metavar='N',
+                        help='also estimate Sobol indices from N base samples (a power of 2)')
+    parser.add_argument('--sobol-reps', type=int, default=10,
+                        help='replications per parameter set for the Sobol indices '
+                             '(default: 10)')
+    parser.add_argument('-s', '--seed', type=int, default=None, help='random seed')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='number of worker processes (default: all CPUs, or '
+                             'CUH_RESP_MAX_WORKERS)')
+    args = parser.parse_args(argv)
+
+    with open(args.config, encoding='utf-8') as f:
+        config = json.load(f)
+
+    start_time = time.perf_counter()
+    oat = tornado(config, threshold=args.threshold, n_reps=args.reps, seed=args.seed,
+                  n_workers=args.workers)
+    threshold = oat.attrs['threshold']
+    print(f'{args.config}: one-at-a-time analysis in {time.perf_counter() - start_time:.1f}s, '
+          f'threshold {threshold:g} beds')
+    print(oat.round(3).to_string())
+    tables = {'tornado': oat}
+
+    if args.sobol:
+        start_time = time.perf_counter()
+        sobol = sobol_indices(config, threshold=threshold, n_base=args.sobol,
+                              n_reps=args.sobol_reps, seed=args.seed, n_workers=args.workers)
+        print(f'Sobol indices in {time.perf_counter() - start_time:.1f}s')
+        print(sobol.round(3).to_string())
+        tables['sobol'] = sobol
+    if args.output:
+        pd.concat(tables, names=['analysis']).to_csv(args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,9 +15,19 @@ ID_STEPPER_BTN_4_TO_3 = "stepper-btn-4-to-3"
 ID_STEPPER_BTN_3_TO_2 = "stepper-btn-3-to-2"
 ID_STEPPER_BTN_2_TO_1 = "stepper-btn-2-to-1"
 
+# Location component of `dash.page_container`, whose pathname changes on leaving the page
+ID_PAGES_LOCATION = "_pages_location"
+
 # Main data store for app
 ID_STORE_APPDATA = "store-appdata"
 
+# Uploaded patient LoS data, kept apart from the main store as it is not part of the config
+ID_STORE_LOS_DATA = "store-los-data"
+
+# Outputs of Steps 2 and 3, kept apart from the uploaded data in the main store
+ID_STORE_STEP_2 = "store-step-2"
+ID_STORE_STEP_3 = "store-step-3"
+
 # Step 1 form inputs
 ID_INPUT_RESP_NAME = "step1-input-resp-name"
 ID_PATIENT_FILE_UPLOAD = "step1-input-patient-file"
@@ -27,6 +37,7 @@ ID_OCCUPANCY_FILE_PROMPT = "step1-input-occupancy-file-prompt"
 
 # Step 2 display components
 ID_GRAPH_ARR = {'themed_graph': True, 'name': 'step2-graph-arr'}
+ID_STORE_ARR_SERIES = 'step2-store-arr-series'
 ID_POISSON_DATEPICKER = 'step2-datepicker-poisson-fitter'
 ID_POISSON_BUTTON_FIT = 'step2-btn-fit-poisson'
 ID_POISSON_PEAK_DATE = 'step2-datepicker-poisson-offset'
@@ -34,12 +45,18 @@ ID_POISSON_PEAK = 'step2-numinput-arr-peak'
 ID_POISSON_XSCALE = 'step2-numinput-arr-xscale'
 ID_POISSON_MIN = 'step2-numinput-arr-min'
 ID_SCENARIO_DATES = 'step2-datepicker-scenario-dates'
+ID_CALIBRATE_BTN = 'step2-btn-calibrate'
+ID_CALIBRATE_TEXT = 'step2-text-calibrate'
 
 # Step 3 display components
 ID_GRAPH_PAEDS = {'themed_graph': True, 'name': 'step3-graph-paeds'}
 ID_GRAPH_ADULT = {'themed_graph': True, 'name': 'step3-graph-adult'}
 ID_GRAPH_SENIOR = {'themed_graph': True, 'name': 'step3-graph-senior'}
 
+ID_GRAPH_PAEDS_GOF = {'themed_graph': True, 'name': 'step3-graph-paeds-gof'}
+ID_GRAPH_ADULT_GOF = {'themed_graph': True, 'name': 'step3-graph-adult-gof'}
+ID_GRAPH_SENIOR_GOF = {'themed_graph': True, 'name': 'step3-graph-senior-gof'}
+
 ID_OVERLAY_PAEDS_FIT = 'step3-overlay-paeds-fit'
 ID_OVERLAY_ADULT_FIT = 'step3-overlay-adult-fit'
 ID_OVERLAY_SENIOR_FIT = 'step3-overlay-senior-fit'
@@ -56,8 +73,52 @@ ID_STORE_PAEDS_FIT = "step3-store-paeds-fit"
 ID_STORE_ADULT_FIT = "step3-store-adult-fit"
 ID_STORE_SENIOR_FIT = "step3-store-senior-fit"
 
+ID_STORE_PAEDS_GOF = "step3-store-paeds-gof"
+ID_STORE_ADULT_GOF = "step3-store-adult-gof"
+ID_STORE_SENIOR_GOF = "step3-store-senior-gof"
+
+ID_STORE_AGE_DIST = "step3-store-age-dist"
+
+ID_PROGRESS_PAEDS_FIT = "step3-progress-paeds-fit"
+ID_PROGRESS_ADULT_FIT = "step3-progress-adult-fit"
+ID_PROGRESS_SENIOR_FIT = "step3-progress-senior-fit"
+
+ID_PROGRESS_BAR_PAEDS_FIT = "step3-progress-bar-paeds-fit"
+ID_PROGRESS_BAR_ADULT_FIT = "step3-progress-bar-adult-fit"
+ID_PROGRESS_BAR_SENIOR_FIT = "step3-progress-bar-senior-fit"
+
+ID_PROGRESS_TEXT_PAEDS_FIT = "step3-progress-text-paeds-fit"
+ID_PROGRESS_TEXT_ADULT_FIT = "step3-progress-text-adult-fit"
+ID_PROGRESS_TEXT_SENIOR_FIT = "step3-progress-text-senior-fit"
+
+ID_BOOTSTRAP_N = "step3-numinput-bootstrap-n"
+ID_BOOTSTRAP_BTN = "step3-btn-bootstrap"
+ID_BOOTSTRAP_USE = "step3-checkbox-bootstrap-use"
+ID_TABLE_BOOTSTRAP = "step3-table-bootstrap"
+ID_STORE_BOOTSTRAP = "step3-store-bootstrap"
+ID_PROGRESS_BOOTSTRAP = "step3-progress-bootstrap"
+ID_PROGRESS_BAR_BOOTSTRAP = "step3-progress-bar-bootstrap"
+ID_PROGRESS_TEXT_BOOTSTRAP = "step3-progress-text-bootstrap"
+
 # Step 4 Simulate!
 ID_CONFIG_DOWNLOAD_BTN = 'step4-btn-sim-config'
 ID_CONFIG_DOWNLOAD = 'step4-download-sim-config'
+ID_SIM_ENGINE = 'step4-select-sim-engine'
+ID_SIM_TOLERANCE = 'step4-numinput-sim-tolerance'
+ID_SIM_MAX_REPS = 'step4-numinput-sim-max-reps'
 ID_SIM_RESULTS = 'step4-stack-results'
-ID_OVERLAY_SIM_RESULTS = 'step4-overlay-results'
+ID_SIM_SUMMARY = 'step4-text-results-summary'
+ID_SIM_STOP_BTN = 'step4-btn-sim-stop'
+ID_GRAPH_SIM_TOTAL = {'themed_graph': True, 'name': 'step4-graph-sim-total'}
+ID_GRAPH_SIM_ADULT = {'themed_graph': True, 'name': 'step4-graph-sim-adult'}
+ID_GRAPH_SIM_PAEDS = {'themed_graph': True, 'name': 'step4-graph-sim-paeds'}
+ID_STORE_SIM_TOTAL = 'step4-store-sim-total'
+ID_STORE_SIM_ADULT = 'step4-store-sim-adult'
+ID_STORE_SIM_PAEDS = 'step4-store-sim-paeds'
+ID_PROGRESS_SIM_RESULTS = 'step4-progress-results'
+ID_PROGRESS_BAR_SIM_RESULTS = 'step4-progress-bar-results'
+ID_PROGRESS_TEXT_SIM_RESULTS = 'step4-progress-text-results'
+ID_SENS_THRESHOLD = 'step4-numinput-sens-threshold'
+ID_SENS_BTN = 'step4-btn-sens'
+ID_SENS_TEXT = 'step4-text-sens'
+ID_GRAPH_SENS = {'themed_graph': True, 'name': 'step4-graph-sens'}
@@ -0,0 +1,28 @@
+(selected, gof, figure) => {
+    // Histogram + PDF overlay (left) and QQ plot (right) for the selected distribution.
+    // All values were computed alongside the distribution fit, so no server round trip is needed.
+    // The arrays are typed array specs, which Plotly decodes.
+    if (!selected || !gof || !gof.qq[selected]) {
+        return window.dash_clientside.no_update;
+    }
+    const data = [{
+        type: 'bar', x: gof.x, y: gof.hist, name: 'Data',
+        marker: {color: '#aa55aa', opacity: 0.5}, hoverinfo: 'skip'
+    }];
+    if (gof.pdf[selected]) {
+        data.push({
+            type: 'scatter', x: gof.x, y: gof.pdf[selected], mode: 'lines',
+            name: selected + ' PDF', line: {color: 'red'}
+        });
+    }
+    data.push({
+        type: 'scatter', x: gof.qq[selected], y: gof.qq_data, mode: 'markers',
+        name: 'QQ', xaxis: 'x2', yaxis: 'y2', marker: {size: 4, color: '#aa00aa'}
+    });
+    const qMax = gof.qq_max;
+    data.push({
+        type: 'scatter', x: [0, qMax], y: [0, qMax], mode: 'lines', xaxis: 'x2', yaxis: 'y2',
+        line: {color: 'grey', dash: 'dash'}, hoverinfo: 'skip', showlegend: false
+    });
+    return {...figure, data: data};
+}
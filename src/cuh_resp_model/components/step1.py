@@ -68,6 +68,9 @@ def stack():
 @callback(
     Output(ID_STEPPER, 'active', allow_duplicate=True),
     Output(ID_STORE_APPDATA, 'data', allow_duplicate=True),
+    Output(ID_STORE_LOS_DATA, 'data', allow_duplicate=True),
+    Output(ID_STORE_STEP_2, 'data', allow_duplicate=True),
+    Output(ID_STORE_STEP_3, 'data', allow_duplicate=True),
     Input(ID_STEPPER_BTN_1_TO_2, 'n_clicks'),
     State(ID_INPUT_RESP_NAME, 'value'),
     State(ID_PATIENT_FILE_UPLOAD, 'contents'),
@@ -88,7 +91,6 @@ def stepper_next(_,
         "completed": 1,
         "step_1": {
             "disease_name": disease_name,
-            "los_data": los_data,
             "arr_data": arr_data,
             "occupancy_data": occupancy_data
         }
@@ -96,10 +98,11 @@ def stepper_next(_,
 
     # Validate inputs
     if not disease_name:
-        return dash.no_update, dash.no_update
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
 
-    # Go to next step in Stepper (subtract 1 as 0-based) and save computed data so far
-    return 1, new_data
+    # Go to next step in Stepper (subtract 1 as 0-based) and save computed data so far,
+    # clearing the outputs of later steps from any previous uploads
+    return 1, new_data, los_data, None, None
 
 
 # Disable the "Next button if any inputs are missing."
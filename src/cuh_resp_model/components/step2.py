@@ -1,7 +1,7 @@
 """Module for the Daily Arrivals tab of Step 2: Patient Arrival Modelling"""
 
-from copy import deepcopy
-from datetime import date, timedelta
+from datetime import date
+from uuid import uuid4
 
 import dash_mantine_components as dmc
 import pandas as pd
@@ -9,12 +9,18 @@ from dash import Input, Output, Patch, State, callback, clientside_callback, dcc
 from dash_compose import composition
 from dash_iconify import DashIconify
 from plotly import graph_objects as go
-from scipy.optimize import curve_fit
-from scipy.stats import norm
 
+from cuh_resp_model.cache import bg_manager, series_cache
 from cuh_resp_model.components.ids import *
 
+from ..arrivals import arrivals_frame, days, fit_arrival_curve, norm_curve2
+from ..backtest import occupancy_series
+from ..calibration import calibrate
 from ..components.back_next import back_next
+from ..distributions import EMPIRICAL_SMOOTH, empirical_params, make_dist
+from ..figures import MAX_POINTS, downsample, scatter, x_range
+from ..simulation import AGE_BANDS, scenario_from_config
+from .step3 import age_distribution, get_group, load_los
 
 
 @composition
@@ -54,11 +60,13 @@ def arr():
                     'xaxis': {'tickfont': {'size': 14}},
                     'yaxis': {'tickfont': {'size': 14}},
                     'title_font_weight': 900,
-                    'hovermode': 'x unified'
+                    'hovermode': 'x unified',
+                    'uirevision': 'arr'  # Keep the zoom when the traces are redrawn
                 }
             ),
             # config={'displayModeBar': False}
         )
+        yield dcc.Store(id=ID_STORE_ARR_SERIES)
     return ret
 
 
@@ -81,11 +89,18 @@ def poisson_fitter():
                 'Fit Poisson curve',
                 id=ID_POISSON_BUTTON_FIT
             )
+            yield dmc.Button(
+                'Calibrate to occupancy',
+                id=ID_CALIBRATE_BTN,
+                variant='light'
+            )
             with dmc.Group(gap=0):
                 yield DashIconify(icon="material-symbols:warning-rounded", width=24,
                                   color=dmc.DEFAULT_THEME["colors"]["yellow"][5])
                 yield dmc.Text(' Note: This will replace the horizontal scale and minimum '
-                               'value parameters below.')
+                               'value parameters below (and the peak daily arrivals, if '
+                               'calibrating).')
+        yield dmc.Text(id=ID_CALIBRATE_TEXT, size='sm')
     return ret
 
 
@@ -156,8 +171,8 @@ clientside_callback(
 @callback(
     Output(ID_STEPPER, "active", allow_duplicate=True),
     Output(ID_STORE_APPDATA, "data", allow_duplicate=True),
+    Output(ID_STORE_STEP_2, "data", allow_duplicate=True),
     Input(ID_STEPPER_BTN_2_TO_3, "n_clicks"),
-    State(ID_STORE_APPDATA, "data"),
     State(ID_STEPPER, "active"),
     State(ID_SCENARIO_DATES, 'value'),
     State(ID_POISSON_PEAK_DATE, 'value'),
@@ -166,22 +181,24 @@ clientside_callback(
     State(ID_POISSON_MIN, 'value'),
     prevent_initial_call=True
 )
-def stepper_next(_, data, curr_state, scenario_dates, loc, x_scale, y_max, y_min):
-    """Process app data for Step 2 and proceed to Step 3."""
+def stepper_next(_, curr_state, scenario_dates, loc, x_scale, y_max, y_min):
+    """Process app data for Step 2 and proceed to Step 3.
+
+    The main store is only patched, so the uploaded data is not sent back to the browser."""
 
     # Error handling -- this should not trigger, so just return no_update and
     # don't worry about showing error messages
     if not scenario_dates or not loc:
-        return no_update, no_update
+        return no_update, no_update, no_update
 
     try:
         x_scale = float(x_scale)
         y_max = float(y_max)
         y_min = float(y_min)
         if x_scale <= 0:
-            return no_update, no_update
+            return no_update, no_update, no_update
     except BaseException:
-        return no_update, no_update
+        return no_update, no_update, no_update
 
     xs = [x.date() for x in pd.date_range(*scenario_dates)]
     ys = [norm_curve2(days(x, date.fromisoformat(loc)), x_scale, y_max, y_min) for x in xs]
@@ -197,15 +214,15 @@ def stepper_next(_, data, curr_state, scenario_dates, loc, x_scale, y_max, y_min
         'ys': [float(y) for y in ys]
     }
 
-    new_data = deepcopy(data)
-    new_data['completed'] = 2
-    new_data['step_2'] = step2_data
+    patched_data = Patch()
+    patched_data['completed'] = 2
 
-    return curr_state + 1, new_data
+    return curr_state + 1, patched_data, step2_data
 
 
 @callback(
     Output(ID_GRAPH_ARR, 'figure', allow_duplicate=True),
+    Output(ID_STORE_ARR_SERIES, 'data'),
     Input(ID_STEPPER, 'active'),
     Input(ID_SCENARIO_DATES, 'value'),
     Input(ID_POISSON_PEAK_DATE, 'value'),
@@ -213,57 +230,67 @@ def stepper_next(_, data, curr_state, scenario_dates, loc, x_scale, y_max, y_min
     Input(ID_POISSON_PEAK, 'value'),
     Input(ID_POISSON_MIN, 'value'),
     State(ID_STORE_APPDATA, 'data'),
+    State(ID_GRAPH_ARR, 'relayoutData'),
     prevent_initial_call=True
 )
 def render_patient_arr_graph(active_step, scenario_dates, loc, x_scale, y_max, y_min,
-                             app_data: dict):
+                             app_data: dict, relayout_data):
     """Render the patient arrivals graph when the current step is loaded,
-    or when the Poisson fitting controls have changed input."""
+    or when the Poisson fitting controls have changed input.
+
+    If the series are longer than `MAX_POINTS`, they are drawn downsampled for the visible
+    range, and kept in the `series_cache` for redrawing when the graph is zoomed."""
     if active_step != 1:  # Step 2
-        return no_update
+        return no_update, no_update
 
     if not scenario_dates or not loc:
-        return no_update
+        return no_update, no_update
 
     try:
         x_scale = float(x_scale)
         y_max = float(y_max)
         y_min = float(y_min)
         if x_scale <= 0:
-            return no_update
+            return no_update, no_update
     except BaseException:
-        return no_update
+        return no_update, no_update
 
     disease_name = app_data['step_1']['disease_name']
-    arr_df = pd.DataFrame.from_dict(app_data['step_1']['arr_data'], orient='tight')
+    arr_df = arrivals_frame(app_data['step_1']['arr_data'])
 
-    patched_fig = Patch()
+    # Scenario curve
+    # get date range from start and end dates
+    xs = pd.date_range(*scenario_dates)
+    scenario = pd.Series(
+        norm_curve2((xs - pd.Timestamp(loc)) / pd.Timedelta(days=1), x_scale, y_max, y_min),
+        index=xs
+    )
+
+    series_key = None
+    if max(len(arr_df), len(scenario)) > MAX_POINTS:
+        series_key = uuid4().hex
+        series_cache.set(series_key, (arr_df, scenario))
 
+    patched_fig = Patch()
     patched_fig['layout']['title']['text'] = f'{disease_name} cases by first positive test'
-    patched_fig['data'] = []
-
-    patched_fig['data'].append(go.Scatter(
-        x=arr_df.index,
-        y=arr_df['Count'],
-        name='Count',
-        line={'width': 0.5}
-    ))
-    patched_fig['data'].append(go.Scatter(
-        x=arr_df.index,
-        y=arr_df['7 day avg.'],
-        name='7-day rolling avg.'
-    ))
+    patched_fig['data'] = arrival_traces(arr_df, scenario, x_range(relayout_data) or (None, None))
+    return patched_fig, series_key
 
-    # Scenario curve
-    # get date range from start and end dates
-    xs = [x.date() for x in pd.date_range(*scenario_dates)]
-    ys = [norm_curve2(days(x, date.fromisoformat(loc)), x_scale, y_max, y_min) for x in xs]
-    patched_fig['data'].append(go.Scatter(
-        x=xs,
-        y=ys,
-        name='Scenario'
-    ))
 
+@callback(
+    Output(ID_GRAPH_ARR, 'figure', allow_duplicate=True),
+    Input(ID_GRAPH_ARR, 'relayoutData'),
+    State(ID_STORE_ARR_SERIES, 'data'),
+    prevent_initial_call=True
+)
+def zoom_patient_arr_graph(relayout_data, series_key):
+    """Redraw the patient arrivals graph for the visible range when it is zoomed or panned, if
+    its series were downsampled."""
+    bounds = x_range(relayout_data)
+    if bounds is None or series_key is None or (series := series_cache.get(series_key)) is None:
+        return no_update
+    patched_fig = Patch()
+    patched_fig['data'] = arrival_traces(*series, bounds)
     return patched_fig
 
 
@@ -281,35 +308,59 @@ def fit_curve(_, fit_range, app_data):
 
     fit_start = pd.Timestamp(fit_range[0])
     fit_end = pd.Timestamp(fit_range[1])
-    arr_df = pd.DataFrame.from_dict(app_data['step_1']['arr_data'], orient='tight')
-    arr_df.index = pd.to_datetime(arr_df.index)
+    arr_df = arrivals_frame(app_data['step_1']['arr_data'])
     arr_df = arr_df.loc[
         (arr_df.index >= fit_start) & (arr_df.index <= fit_end)
     ]
     if len(arr_df) == 0:
         return no_update, no_update
 
-    xs = (arr_df.index - arr_df.index[0]) / pd.Timedelta(days=1)
-    arr_df['xs'] = xs
-    arr_df = arr_df.reset_index(drop=False).set_index('xs', drop=True)
-
-    x_max = arr_df['7 day avg.'].idxmax()
-    y_max = arr_df['7 day avg.'].max()
-    y_min = arr_df['7 day avg.'].min()
+    _, x_scale, _, y_min = fit_arrival_curve(arr_df)
 
-    x_scale0 = 10  # Initial guess
+    return round(x_scale, 3), round(y_min, 3)
 
-    p_opt, _ = curve_fit(norm_curve3, arr_df.index, arr_df.Count, p0=[x_max, x_scale0, y_max])
-    p_opt, _ = curve_fit(norm_curve4, arr_df.index, arr_df.Count, p0=[*p_opt, y_min])
 
-    _, x_scale, y_max, y_min = p_opt
+@callback(
+    Output(ID_POISSON_PEAK, 'value'),
+    Output(ID_POISSON_XSCALE, 'value', allow_duplicate=True),
+    Output(ID_POISSON_MIN, 'value', allow_duplicate=True),
+    Output(ID_CALIBRATE_TEXT, 'children'),
+    Input(ID_CALIBRATE_BTN, 'n_clicks'),
+    State(ID_POISSON_DATEPICKER, 'value'),
+    State(ID_STORE_APPDATA, 'data'),
+    State(ID_STORE_LOS_DATA, 'data'),
+    State(ID_STORE_STEP_2, 'data'),
+    State(ID_STORE_STEP_3, 'data'),
+    prevent_initial_call=True,
+    background=True,
+    manager=bg_manager,
+    running=[(Output(ID_CALIBRATE_BTN, 'loading'), True, False)],
+    cancel=[Input(ID_STEPPER_BTN_2_TO_1, 'n_clicks')]
+)
+def calibrate_curve(_, fit_range, app_data, los_data, step_2, step_3):
+    """Calibrate the peak, horizontal scale and minimum value of the scenario to the
+    historical occupancy data in the selected date range (see `calibration.calibrate`)."""
+    try:
+        result = calibrate(
+            occupancy_series(app_data), fit_range[0], fit_range[1],
+            los_params(los_data, step_2, step_3)
+        )
+    except ValueError as e:
+        return no_update, no_update, no_update, str(e)
 
-    return round(x_scale, 3), round(y_min, 3)
+    text = (
+        f"Calibrated to occupancy with a peak of {result['peak']:.1f} arrivals/day on "
+        f"{result['peak_date']:%Y-%m-%d}. Error: {result['rmse']:.1f} beds (analytic), "
+        f"{result['rmse_sim']:.1f} beds (simulated); the simulated 80% interval covers "
+        f"{result['coverage']:.0%} of days."
+    )
+    return round(result['peak'], 3), round(result['x_scale'], 3), round(result['min'], 3), text
 
 
 @callback(
     Output(ID_POISSON_DATEPICKER, 'error'),
     Output(ID_POISSON_BUTTON_FIT, 'disabled'),
+    Output(ID_CALIBRATE_BTN, 'disabled'),
     Input(ID_POISSON_DATEPICKER, 'value'),
     State(ID_STORE_APPDATA, 'data'),
     prevent_initial_call=True
@@ -322,17 +373,16 @@ def validate_fit_range(fit_range, app_data):
 
     # Fields may be none if user is in the middle of changing the dates
     if pd.isnull(fit_start) or pd.isnull(fit_end):
-        return None, True
+        return None, True, True
 
-    arr_df = pd.DataFrame.from_dict(app_data['step_1']['arr_data'], orient='tight')
-    arr_df.index = pd.to_datetime(arr_df.index)
+    arr_df = arrivals_frame(app_data['step_1']['arr_data'])
     arr_df = arr_df.loc[
         (arr_df.index >= fit_start) & (arr_df.index <= fit_end)
     ]
     if len(arr_df) == 0:
-        return 'No data in selected range.', True
+        return 'No data in selected range.', True, True
 
-    return None, False
+    return None, False, False
 
 
 @callback(
@@ -369,30 +419,31 @@ def validate_inputs(y_max, x_scale, y_min, sc_range):
 
 # region helper functions
 #
-def norm_curve(x, x_scale, y_max):
-    """Compute a normal curve with horizontal scale `x_scale` and maximum `y_max`."""
-    y_scale = y_max / norm.pdf(0, loc=0, scale=x_scale)
-    return norm.pdf(x, loc=0, scale=x_scale) * y_scale
-
-
-def norm_curve2(x, x_scale, y_max, y_min):
-    """Same as `norm_curve` but with a y-offset."""
-    return norm_curve(x, x_scale, y_max - y_min) + y_min
-
-
-def norm_curve3(x, loc, x_scale, y_max):
-    """Compute a normal curve with mean `loc`, horizontal scale `x_scale`, and maximum `y_max`."""
-    y_scale = y_max / norm.pdf(loc, loc=loc, scale=x_scale)
-    return norm.pdf(x, loc=loc, scale=x_scale) * y_scale
-
-
-def norm_curve4(x, loc, x_scale, y_max, y_min):
-    """Same as `norm_curve3` but with a y-offset."""
-    return norm_curve3(x, loc, x_scale, y_max - y_min) + y_min
+def arrival_traces(arr_df: pd.DataFrame, scenario: pd.Series, bounds: tuple) -> list:
+    """Traces for the patient arrivals graph: the daily and 7-day average arrivals in
+    `arr_df`, and the `scenario` curve, downsampled (see `downsample`) for an x-axis spanning
+    `bounds`."""
+    x, ys = downsample(arr_df.index, {'Count': arr_df['Count'], 'avg': arr_df['7 day avg.']},
+                       bounds)
+    xs, ys_scenario = downsample(scenario.index, {'Scenario': scenario}, bounds)
+    return [
+        scatter(x, ys['Count'], name='Count', line={'width': 0.5}),
+        scatter(x, ys['avg'], name='7-day rolling avg.'),
+        scatter(xs, ys_scenario['Scenario'], name='Scenario')
+    ]
 
 
-def days(x: date, loc: date) -> float:
-    """Returns the number of days from `loc`."""
-    return (x - loc) / timedelta(days=1)
+def los_params(los_data: dict, step_2: dict | None, step_3: dict | None) -> dict:
+    """LoS distributions and age distribution for calibration: those selected in Step 3 if it
+    has been completed, or else the smoothed empirical distributions of the Step 1 data."""
+    if step_3:
+        return scenario_from_config({'step_2': step_2, 'step_3': step_3})['patient_params']
+    los_df = load_los(los_data)
+    return {
+        f'dist_{band}': make_dist(
+            EMPIRICAL_SMOOTH, empirical_params(get_group(los_df, band), smooth=True)
+        )
+        for band in AGE_BANDS
+    } | {'age_dist': age_distribution(los_df)}
 #
 # endregion
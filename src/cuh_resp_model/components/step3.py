@@ -1,6 +1,7 @@
 """Module for the Daily Arrivals tab of Step 3: Patient Length-of-Stay Modelling"""
 
-from copy import deepcopy
+from collections.abc import Callable
+from pathlib import Path
 
 import dash
 import dash_mantine_components as dmc
@@ -8,68 +9,81 @@ import numpy as np
 import pandas as pd
 from dash import Input, Output, Patch, State, callback, clientside_callback, dcc
 from dash_compose import composition
-from fitter import Fitter
+from fitter import get_distributions
 from plotly import graph_objects as go
-from scipy import stats
 from scipy.stats import zscore
 
 from cuh_resp_model.cache import bg_manager
 from cuh_resp_model.components.ids import *
+from cuh_resp_model.distributions import (EMPIRICAL_DISTS, EMPIRICAL_SMOOTH, bootstrap,
+                                          bootstrap_summary, empirical_params, fit_families,
+                                          get_params, goodness_of_fit)
+from cuh_resp_model.figures import VIOLIN_YAXIS, typed_array, violin_traces
+from cuh_resp_model.utils import JSCode, max_workers, read_file
 
 from ..components.back_next import back_next
 
 DAY = pd.Timedelta(days=1)
 
-GO_OPTS = {
-    'spanmode': 'hard',
-    'box_visible': True,
-    'box_fillcolor': '#aa55aa',
-    'box_line_color': '#aa00aa',
-    'points': 'all',
-    'meanline_visible': True,
-    'meanline_color': 'red',
-    'marker_size': 2,
-    'marker_opacity': 0.5,
-    'y0': 'LoS [days]',
-    'orientation': 'h',
-    'hoverinfo': 'skip'
-}
+CANCEL_INPUTS = [
+    Input(ID_STEPPER_BTN_3_TO_2, 'n_clicks'),
+    Input(ID_PATIENT_FILE_UPLOAD, 'contents'),
+    Input(ID_PAGES_LOCATION, 'pathname')
+]
+"""Inputs cancelling the Step 3 background jobs: going back to Step 2, uploading new patient
+data, or leaving the page."""
 
 PLACEHOLDER_TABLE_DATA = {
     "head": ["Placeholder"],
     "body": [[0]]
 }
 
+GO_LAYOUT = {
+    'width': 1000,
+    'height': 300,
+    'title': 'Length of stay [days]',
+    'legend_y': 0.5,
+    'legend_font_size': 14,
+    'title_font_size': 20,
+    'xaxis': {'tickfont': {'size': 14}},
+    'yaxis': {'tickfont': {'size': 14}},
+    'title_font_weight': 900,
+    'hovermode': 'x unified'
+}
+
+TABLE_OPTS = {
+    'striped': True,
+    'highlightOnHover': True,
+    'withTableBorder': True,
+    'withColumnBorders': True
+}
+
+GOF_LAYOUT = {
+    'width': 1000,
+    'height': 300,
+    'title': 'Goodness of fit of selected distribution',
+    'title_font_size': 16,
+    'xaxis': {'domain': [0, 0.45], 'title': 'LoS [days]'},
+    'yaxis': {'title': 'Density'},
+    'xaxis2': {'domain': [0.55, 1], 'anchor': 'y2', 'title': 'Model quantile [days]'},
+    'yaxis2': {'anchor': 'x2', 'title': 'Data quantile [days]'},
+    'bargap': 0,
+    'legend_y': 0.5
+}
+
+SELECT_OPTS = {
+    'label': 'Select distribution type',
+    'description': 'The chosen distribution will be used for the final '
+    'simulation step',
+    'placeholder': 'Choose distribution type',
+    'allowDeselect': False,
+    'w': 400
+}
+
 
 @composition
 def stepper_step():
     """The contents for the Stepper Step 3 in the app."""
-    go_layout = {
-        'width': 1000,
-        'height': 300,
-        'title': 'Length of stay [days]',
-        'legend_y': 0.5,
-        'legend_font_size': 14,
-        'title_font_size': 20,
-        'xaxis': {'tickfont': {'size': 14}},
-        'yaxis': {'tickfont': {'size': 14}},
-        'title_font_weight': 900,
-        'hovermode': 'x unified'
-    }
-    table_opts = {
-        'striped': True,
-        'highlightOnHover': True,
-        'withTableBorder': True,
-        'withColumnBorders': True
-    }
-    select_opts = {
-        'label': 'Select distribution type',
-        'description': 'The chosen distribution will be used for the final '
-        'simulation step',
-        'placeholder': 'Choose distribution type',
-        'allowDeselect': False,
-        'w': 400
-    }
     with dmc.StepperStep(
         None,
         label="LoS Modelling",
@@ -80,84 +94,108 @@ def stepper_step():
             with dmc.Stack(gap="xl"):
                 yield dmc.Text("Step 3: Patient Length-of-Stay Modelling", ta="center", size="xl")
                 yield dcc.Store(id=ID_STORE_PAEDS_FIT)
+                yield dcc.Store(id=ID_STORE_PAEDS_GOF)
                 yield dcc.Store(id=ID_STORE_ADULT_FIT)
+                yield dcc.Store(id=ID_STORE_ADULT_GOF)
                 yield dcc.Store(id=ID_STORE_SENIOR_FIT)
-                with dmc.Card(withBorder=True):
-                    yield dmc.Text('0-15 Age group', size='xl', fw=700)
-                    with dmc.Stack():
-                        yield dcc.Graph(
-                            id=ID_GRAPH_PAEDS,
-                            figure=go.Figure(layout=go_layout)
-                        )
-                        yield dmc.Text('Distribution fitting results', fw=700)
-                        with dmc.Stack(id='id-paeds-fit', pos="relative"):
-                            yield dmc.LoadingOverlay(
-                                id=ID_OVERLAY_PAEDS_FIT,
-                                visible=True,
-                                overlayProps={"radius": "sm", "blur": 2}
-                            )
-                            yield dmc.Table(
-                                id=ID_TABLE_PAEDS_FIT,
-                                **table_opts,
-                                data=PLACEHOLDER_TABLE_DATA
-                            )
-                            yield dmc.Select(
-                                id=ID_SELECT_PAEDS_FIT,
-                                **select_opts,
-                                data=['Placeholder'],
-                            )
-                with dmc.Card(withBorder=True):
-                    yield dmc.Text('16-64 Age group', size='xl', fw=700)
-                    with dmc.Stack():
-                        yield dcc.Graph(
-                            id=ID_GRAPH_ADULT,
-                            figure=go.Figure(layout=go_layout)
-                        )
-                        yield dmc.Text('Distribution fitting results', fw=700)
-                        with dmc.Stack(id='id-adult-fit', pos="relative"):
-                            yield dmc.LoadingOverlay(
-                                id=ID_OVERLAY_ADULT_FIT,
-                                visible=True,
-                                overlayProps={"radius": "sm", "blur": 2}
-                            )
-                            yield dmc.Table(
-                                id=ID_TABLE_ADULT_FIT,
-                                **table_opts,
-                                data=PLACEHOLDER_TABLE_DATA
-                            )
-                            yield dmc.Select(
-                                id=ID_SELECT_ADULT_FIT,
-                                **select_opts,
-                                data=['Placeholder'],
-                            )
-                with dmc.Card(withBorder=True):
-                    yield dmc.Text('65+ Age group', size='xl', fw=700)
-                    with dmc.Stack():
-                        yield dcc.Graph(
-                            id=ID_GRAPH_SENIOR,
-                            figure=go.Figure(layout=go_layout)
-                        )
-                        yield dmc.Text('Distribution fitting results', fw=700)
-                        with dmc.Stack(id='id-senior-fit', pos="relative"):
-                            yield dmc.LoadingOverlay(
-                                id=ID_OVERLAY_SENIOR_FIT,
-                                visible=True,
-                                overlayProps={"radius": "sm", "blur": 2}
-                            )
-                            yield dmc.Table(
-                                id=ID_TABLE_SENIOR_FIT,
-                                **table_opts,
-                                data=PLACEHOLDER_TABLE_DATA
-                            )
-                            yield dmc.Select(
-                                id=ID_SELECT_SENIOR_FIT,
-                                **select_opts,
-                                data=['Placeholder'],
-                            )
+                yield dcc.Store(id=ID_STORE_SENIOR_GOF)
+                yield dcc.Store(id=ID_STORE_AGE_DIST)
+                yield age_group_card(
+                    '0-15 Age group', ID_GRAPH_PAEDS, 'id-paeds-fit', ID_OVERLAY_PAEDS_FIT,
+                    ID_PROGRESS_PAEDS_FIT, ID_PROGRESS_BAR_PAEDS_FIT, ID_PROGRESS_TEXT_PAEDS_FIT,
+                    ID_TABLE_PAEDS_FIT, ID_SELECT_PAEDS_FIT, ID_GRAPH_PAEDS_GOF
+                )
+                yield age_group_card(
+                    '16-64 Age group', ID_GRAPH_ADULT, 'id-adult-fit', ID_OVERLAY_ADULT_FIT,
+                    ID_PROGRESS_ADULT_FIT, ID_PROGRESS_BAR_ADULT_FIT, ID_PROGRESS_TEXT_ADULT_FIT,
+                    ID_TABLE_ADULT_FIT, ID_SELECT_ADULT_FIT, ID_GRAPH_ADULT_GOF
+                )
+                yield age_group_card(
+                    '65+ Age group', ID_GRAPH_SENIOR, 'id-senior-fit', ID_OVERLAY_SENIOR_FIT,
+                    ID_PROGRESS_SENIOR_FIT, ID_PROGRESS_BAR_SENIOR_FIT, ID_PROGRESS_TEXT_SENIOR_FIT,
+                    ID_TABLE_SENIOR_FIT, ID_SELECT_SENIOR_FIT, ID_GRAPH_SENIOR_GOF
+                )
+                yield bootstrap_card()
                 yield back_next(ID_STEPPER_BTN_3_TO_2, ID_STEPPER_BTN_3_TO_4)
     return ret
 
 
+@composition
+def age_group_card(title, graph_id, stack_id, overlay_id,
+                   progress_id, progress_bar_id, progress_text_id,
+                   table_id, select_id, gof_graph_id):
+    """dmc.Card showing the LoS data and distribution fitting results for one age group."""
+    with dmc.Card(withBorder=True) as ret:
+        yield dmc.Text(title, size='xl', fw=700)
+        with dmc.Stack():
+            yield dcc.Graph(
+                id=graph_id,
+                figure=go.Figure(layout=GO_LAYOUT)
+            )
+            yield dmc.Text('Distribution fitting results', fw=700)
+            with dmc.Group(id=progress_id, display='none', gap='md'):
+                yield dmc.Progress(id=progress_bar_id, value=0, w=300, animated=True)
+                yield dmc.Text(id=progress_text_id, size='sm')
+            with dmc.Stack(id=stack_id, pos="relative"):
+                yield dmc.LoadingOverlay(
+                    id=overlay_id,
+                    visible=True,
+                    overlayProps={"radius": "sm", "blur": 2}
+                )
+                yield dmc.Table(
+                    id=table_id,
+                    **TABLE_OPTS,
+                    data=PLACEHOLDER_TABLE_DATA
+                )
+                yield dmc.Select(
+                    id=select_id,
+                    **SELECT_OPTS,
+                    data=['Placeholder'],
+                )
+                yield dcc.Graph(
+                    id=gof_graph_id,
+                    figure=go.Figure(layout=GOF_LAYOUT)
+                )
+    return ret
+
+
+@composition
+def bootstrap_card():
+    """dmc.Card for estimating the uncertainty in the selected LoS distributions by
+    bootstrapping."""
+    with dmc.Card(withBorder=True) as ret:
+        yield dmc.Text('Parameter uncertainty (bootstrap)', size='xl', fw=700)
+        with dmc.Stack():
+            yield dmc.Text(
+                'Refit the selected distribution for each age group to resamples of the data, '
+                'to obtain confidence intervals for its parameters and mean length of stay.',
+                size='sm'
+            )
+            yield dcc.Store(id=ID_STORE_BOOTSTRAP)
+            with dmc.Group(gap='md', align='flex-end'):
+                yield dmc.NumberInput(
+                    id=ID_BOOTSTRAP_N,
+                    label='Number of resamples',
+                    value=100,
+                    min=10,
+                    max=1000,
+                    allowNegative=False,
+                    allowDecimal=False,
+                    w=200
+                )
+                yield dmc.Button('Run bootstrap', id=ID_BOOTSTRAP_BTN, disabled=True)
+                yield dmc.Checkbox(
+                    id=ID_BOOTSTRAP_USE,
+                    label='Sample parameter sets from the bootstrap in the simulation',
+                    checked=True
+                )
+            with dmc.Group(id=ID_PROGRESS_BOOTSTRAP, display='none', gap='md'):
+                yield dmc.Progress(id=ID_PROGRESS_BAR_BOOTSTRAP, value=0, w=300, animated=True)
+                yield dmc.Text(id=ID_PROGRESS_TEXT_BOOTSTRAP, size='sm')
+            yield dmc.Table(id=ID_TABLE_BOOTSTRAP, **TABLE_OPTS)
+    return ret
+
+
 # region callbacks
 #
 
@@ -174,8 +212,9 @@ clientside_callback(
 @callback(
     Output(ID_STEPPER, "active", allow_duplicate=True),
     Output(ID_STORE_APPDATA, "data", allow_duplicate=True),
+    Output(ID_STORE_STEP_3, "data", allow_duplicate=True),
     Input(ID_STEPPER_BTN_3_TO_4, "n_clicks"),
-    State(ID_STORE_APPDATA, "data"),
+    State(ID_STORE_AGE_DIST, "data"),
     State(ID_STEPPER, "active"),
     State(ID_SELECT_PAEDS_FIT, 'value'),
     State(ID_SELECT_ADULT_FIT, 'value'),
@@ -183,29 +222,28 @@ clientside_callback(
     State(ID_STORE_PAEDS_FIT, 'data'),
     State(ID_STORE_ADULT_FIT, 'data'),
     State(ID_STORE_SENIOR_FIT, 'data'),
+    State(ID_STORE_BOOTSTRAP, 'data'),
+    State(ID_BOOTSTRAP_USE, 'checked'),
     prevent_initial_call=True
 )
-def stepper_next(_, data, curr_state,
+def stepper_next(_, age_dist, curr_state,
                  seleted_dist_paeds, selected_dist_adult, selected_dist_senior,
-                 dists_paeds, dists_adult, dists_senior):
-    """Process app data for Step 2 and proceed to Step 3."""
+                 dists_paeds, dists_adult, dists_senior,
+                 bootstrap_data, use_bootstrap):
+    """Process app data for Step 3 and proceed to Step 4.
+
+    The main store is only patched, so the uploaded data is not sent back to the browser."""
 
     # Error handling -- this should not trigger, so just return no_update and
     # don't worry about showing error messages
-    if not seleted_dist_paeds or not selected_dist_adult or not selected_dist_senior:
-        return dash.no_update, dash.no_update
-
-    new_data = deepcopy(data)
-    new_data['completed'] = 3
+    if not seleted_dist_paeds or not selected_dist_adult or not selected_dist_senior \
+            or not age_dist:
+        return dash.no_update, dash.no_update, dash.no_update
 
-    los_df = load_los(data['step_1']['los_data'])
-    age_dist = {
-        'paeds': np.mean(los_df.Age < 16),
-        'adult': np.mean((los_df.Age >= 16) & (los_df.Age < 65)),
-        'senior': np.mean(los_df.Age >= 65),
-    }
+    patched_data = Patch()
+    patched_data['completed'] = 3
 
-    new_data['step_3'] = {
+    step3_data = {
         'selected_dists': {
             'paeds': seleted_dist_paeds,
             'adult': selected_dist_adult,
@@ -219,7 +257,16 @@ def stepper_next(_, data, curr_state,
         'age_dist': age_dist
     }
 
-    return curr_state + 1, new_data
+    # Only keep bootstrap results that match the selected distributions, as fitted to the
+    # current data (the fits are redone when Step 3 is entered, e.g. after a new upload)
+    if use_bootstrap and bootstrap_data:
+        step3_data['bootstrap'] = {
+            group: b for group, b in bootstrap_data.items()
+            if b['dist'] == step3_data['selected_dists'][group]
+            and b.get('estimate') == step3_data['dists'][group][b['dist']]
+        }
+
+    return curr_state + 1, patched_data, step3_data
 
 
 # Disable the "Next button if any inputs are missing."
@@ -232,21 +279,51 @@ clientside_callback(
 )
 
 
+# Disable the bootstrap button until a distribution is selected for each age group.
+clientside_callback(
+    """(v1, v2, v3) => (!v1 || !v2 || !v3)""",
+    Output(ID_BOOTSTRAP_BTN, 'disabled'),
+    Input(ID_SELECT_PAEDS_FIT, 'value'),
+    Input(ID_SELECT_ADULT_FIT, 'value'),
+    Input(ID_SELECT_SENIOR_FIT, 'value'),
+)
+
+
+GOF_FIGURE: JSCode = read_file(Path(__file__).parent.resolve() / "js/gof_figure.js")
+"""Draw the goodness-of-fit plots for the selected distribution from the stored
+goodness-of-fit data."""
+
+for _select_id, _store_id, _graph_id in [
+    (ID_SELECT_PAEDS_FIT, ID_STORE_PAEDS_GOF, ID_GRAPH_PAEDS_GOF),
+    (ID_SELECT_ADULT_FIT, ID_STORE_ADULT_GOF, ID_GRAPH_ADULT_GOF),
+    (ID_SELECT_SENIOR_FIT, ID_STORE_SENIOR_GOF, ID_GRAPH_SENIOR_GOF),
+]:
+    clientside_callback(
+        GOF_FIGURE,
+        Output(_graph_id, 'figure', allow_duplicate=True),
+        Input(_select_id, 'value'),
+        State(_store_id, 'data'),
+        State(_graph_id, 'figure'),
+        prevent_initial_call=True
+    )
+
+
 @callback(
     Output(ID_GRAPH_PAEDS, 'figure', allow_duplicate=True),
     Output(ID_GRAPH_ADULT, 'figure', allow_duplicate=True),
     Output(ID_GRAPH_SENIOR, 'figure', allow_duplicate=True),
+    Output(ID_STORE_AGE_DIST, 'data'),
     Input(ID_STEPPER, 'active'),
-    State(ID_STORE_APPDATA, 'data'),
+    State(ID_STORE_LOS_DATA, 'data'),
     prevent_initial_call=True
 )
-def render_patient_arr_graph(active_step, app_data: dict):
-    """Render the LoS graphs for the three age groups."""
+def render_patient_arr_graph(active_step, los_data: dict):
+    """Render the LoS graphs for the three age groups, and store the age distribution of the
+    patients for the Step 3 output."""
 
     if active_step != 2:  # Step 3
         return dash.no_update
 
-    los_data = app_data['step_1']['los_data']
     los_df = load_los(los_data)
 
     # See: https://dash.plotly.com/partial-properties#using-patches-on-multiple-outputs
@@ -254,23 +331,12 @@ def render_patient_arr_graph(active_step, app_data: dict):
     adults_figure = Patch()
     seniors_figure = Patch()
 
-    paeds_figure['data'] = []
-    adults_figure['data'] = []
-    seniors_figure['data'] = []
+    for fig, group in [(paeds_figure, 'paeds'), (adults_figure, 'adult'),
+                       (seniors_figure, 'senior')]:
+        fig['data'] = violin_traces(get_group(los_df, group))
+        fig['layout']['yaxis'].update(VIOLIN_YAXIS)
 
-    paeds_figure['data'].append(
-        go.Violin(x=los_df.loc[los_df.Age < 16, 'LOS_Total'], **GO_OPTS)
-    )
-
-    adults_figure['data'].append(
-        go.Violin(x=los_df.loc[(los_df.Age >= 16) & (los_df.Age < 65), 'LOS_Total'], **GO_OPTS)
-    )
-
-    seniors_figure['data'].append(
-        go.Violin(x=los_df.loc[los_df.Age >= 65, 'LOS_Total'], **GO_OPTS)
-    )
-
-    return paeds_figure, adults_figure, seniors_figure
+    return paeds_figure, adults_figure, seniors_figure, age_distribution(los_df)
 
 
 @callback(
@@ -279,20 +345,27 @@ def render_patient_arr_graph(active_step, app_data: dict):
     Output(ID_SELECT_PAEDS_FIT, 'value'),
     Output(ID_OVERLAY_PAEDS_FIT, 'visible'),
     Output(ID_STORE_PAEDS_FIT, 'data'),
+    Output(ID_STORE_PAEDS_GOF, 'data'),
     Input(ID_STEPPER, 'active'),
-    State(ID_STORE_APPDATA, 'data'),
+    State(ID_STORE_LOS_DATA, 'data'),
     prevent_initial_call=True,
     background=True,
-    manager=bg_manager
+    manager=bg_manager,
+    progress=[
+        Output(ID_PROGRESS_BAR_PAEDS_FIT, 'value'),
+        Output(ID_PROGRESS_TEXT_PAEDS_FIT, 'children')
+    ],
+    running=[(Output(ID_PROGRESS_PAEDS_FIT, 'display'), 'flex', 'none')],
+    cancel=CANCEL_INPUTS
 )
-def fit_los_paeds(active_step, app_data: dict):
+def fit_los_paeds(set_progress, active_step, los_data: dict):
     """Fit LoS distributions to the paeds patient data."""
     if active_step != 2:  # Step 3
-        return dash.no_update, dash.no_update, dash.no_update, True, dash.no_update
+        return (dash.no_update, dash.no_update, dash.no_update, True, dash.no_update,
+                dash.no_update)
 
-    los_data = app_data['step_1']['los_data']
-    los_stats, dists = fit_los(los_data, 'paeds')
-    return los_stats, [x[0] for x in los_stats['body']], None, False, dists
+    los_stats, dists, gof = fit_los(los_data, 'paeds', progress=fit_progress(set_progress))
+    return los_stats, [x[0] for x in los_stats['body']], None, False, dists, gof
 
 
 @callback(
@@ -301,20 +374,27 @@ def fit_los_paeds(active_step, app_data: dict):
     Output(ID_SELECT_ADULT_FIT, 'value'),
     Output(ID_OVERLAY_ADULT_FIT, 'visible'),
     Output(ID_STORE_ADULT_FIT, 'data'),
+    Output(ID_STORE_ADULT_GOF, 'data'),
     Input(ID_STEPPER, 'active'),
-    State(ID_STORE_APPDATA, 'data'),
+    State(ID_STORE_LOS_DATA, 'data'),
     prevent_initial_call=True,
     background=True,
-    manager=bg_manager
+    manager=bg_manager,
+    progress=[
+        Output(ID_PROGRESS_BAR_ADULT_FIT, 'value'),
+        Output(ID_PROGRESS_TEXT_ADULT_FIT, 'children')
+    ],
+    running=[(Output(ID_PROGRESS_ADULT_FIT, 'display'), 'flex', 'none')],
+    cancel=CANCEL_INPUTS
 )
-def fit_los_adult(active_step, app_data: dict):
+def fit_los_adult(set_progress, active_step, los_data: dict):
     """Fit LoS distributions to the adult (non-senior) patient data."""
     if active_step != 2:  # Step 3
-        return dash.no_update, dash.no_update, dash.no_update, True, dash.no_update
+        return (dash.no_update, dash.no_update, dash.no_update, True, dash.no_update,
+                dash.no_update)
 
-    los_data = app_data['step_1']['los_data']
-    los_stats, dists = fit_los(los_data, 'adult')
-    return los_stats, [x[0] for x in los_stats['body']], None, False, dists
+    los_stats, dists, gof = fit_los(los_data, 'adult', progress=fit_progress(set_progress))
+    return los_stats, [x[0] for x in los_stats['body']], None, False, dists, gof
 
 
 @callback(
@@ -323,20 +403,96 @@ def fit_los_adult(active_step, app_data: dict):
     Output(ID_SELECT_SENIOR_FIT, 'value'),
     Output(ID_OVERLAY_SENIOR_FIT, 'visible'),
     Output(ID_STORE_SENIOR_FIT, 'data'),
+    Output(ID_STORE_SENIOR_GOF, 'data'),
     Input(ID_STEPPER, 'active'),
-    State(ID_STORE_APPDATA, 'data'),
+    State(ID_STORE_LOS_DATA, 'data'),
     prevent_initial_call=True,
     background=True,
-    manager=bg_manager
+    manager=bg_manager,
+    progress=[
+        Output(ID_PROGRESS_BAR_SENIOR_FIT, 'value'),
+        Output(ID_PROGRESS_TEXT_SENIOR_FIT, 'children')
+    ],
+    running=[(Output(ID_PROGRESS_SENIOR_FIT, 'display'), 'flex', 'none')],
+    cancel=CANCEL_INPUTS
 )
-def fit_los_senior(active_step, app_data: dict):
+def fit_los_senior(set_progress, active_step, los_data: dict):
     """Fit LoS distributions to the senior patient data."""
     if active_step != 2:  # Step 3
-        return dash.no_update, dash.no_update, dash.no_update, True, dash.no_update
+        return (dash.no_update, dash.no_update, dash.no_update, True, dash.no_update,
+                dash.no_update)
 
-    los_data = app_data['step_1']['los_data']
-    los_stats, dists = fit_los(los_data, 'senior')
-    return los_stats, [x[0] for x in los_stats['body']], None, False, dists
+    los_stats, dists, gof = fit_los(los_data, 'senior', progress=fit_progress(set_progress))
+    return los_stats, [x[0] for x in los_stats['body']], None, False, dists, gof
+
+
+@callback(
+    Output(ID_TABLE_BOOTSTRAP, 'data'),
+    Output(ID_STORE_BOOTSTRAP, 'data'),
+    Input(ID_BOOTSTRAP_BTN, 'n_clicks'),
+    State(ID_BOOTSTRAP_N, 'value'),
+    State(ID_STORE_LOS_DATA, 'data'),
+    State(ID_SELECT_PAEDS_FIT, 'value'),
+    State(ID_SELECT_ADULT_FIT, 'value'),
+    State(ID_SELECT_SENIOR_FIT, 'value'),
+    State(ID_STORE_PAEDS_FIT, 'data'),
+    State(ID_STORE_ADULT_FIT, 'data'),
+    State(ID_STORE_SENIOR_FIT, 'data'),
+    prevent_initial_call=True,
+    background=True,
+    manager=bg_manager,
+    progress=[
+        Output(ID_PROGRESS_BAR_BOOTSTRAP, 'value'),
+        Output(ID_PROGRESS_TEXT_BOOTSTRAP, 'children')
+    ],
+    running=[
+        (Output(ID_PROGRESS_BOOTSTRAP, 'display'), 'flex', 'none'),
+        (Output(ID_BOOTSTRAP_BTN, 'loading'), True, False)
+    ],
+    cancel=CANCEL_INPUTS
+)
+def run_bootstrap(set_progress, _, n_boot, los_data: dict,
+                  selected_dist_paeds, selected_dist_adult, selected_dist_senior,
+                  dists_paeds, dists_adult, dists_senior):
+    """Bootstrap the selected LoS distributions for the three age groups."""
+    try:
+        n_boot = int(n_boot)
+        if n_boot <= 0:
+            return dash.no_update, dash.no_update
+    except (TypeError, ValueError):
+        return dash.no_update, dash.no_update
+
+    los_df = load_los(los_data)
+    groups = {
+        'paeds': ('0-15', selected_dist_paeds, dists_paeds),
+        'adult': ('16-64', selected_dist_adult, dists_adult),
+        'senior': ('65+', selected_dist_senior, dists_senior),
+    }
+
+    summaries = []
+    bootstrap_data = {}
+    for i, (group, (label, name, dists)) in enumerate(groups.items()):
+        def progress(n_done, n_total, i=i, label=label):
+            set_progress((
+                100 * (i * n_total + n_done) / (len(groups) * n_total),
+                f'{label}: refitted {n_done}/{n_total} resamples'
+            ))
+
+        los = remove_outliers(get_group(los_df, group))
+        param_sets = bootstrap(name, los, n_boot, guess=dists[name], progress=progress)
+        bootstrap_data[group] = {'dist': name, 'estimate': dists[name], 'params': param_sets}
+
+        summary = bootstrap_summary(name, dists[name], param_sets)
+        summary.insert(0, 'Age group', label)
+        summary.insert(1, 'Distribution', name)
+        summaries.append(summary)
+
+    summary = pd.concat(summaries).round(4)
+    table_data = {
+        'head': summary.columns.to_list(),
+        'body': summary.astype(object).where(summary.notna(), None).to_numpy().tolist()
+    }
+    return table_data, bootstrap_data
 #
 # endregion
 
@@ -361,58 +517,85 @@ def load_los(los_data):
     return los_df
 
 
-def get_params(dist_name):
-    """Get the parameter names for a given distribution."""
-    # Inspired by the code for Fitter.get_best()
-    d = getattr(stats, dist_name)
-    return (d.shapes + ", loc, scale").split(", ") if d.shapes else ["loc", "scale"]
+def get_group(los_df: pd.DataFrame, group: str) -> pd.Series:
+    """Select the total LoS values for an age group from the output of `load_los`."""
+    if group == 'paeds':
+        return los_df.loc[los_df.Age < 16, 'LOS_Total']
+    if group == 'adult':
+        return los_df.loc[(los_df.Age >= 16) & (los_df.Age < 65), 'LOS_Total']
+    if group == 'senior':
+        return los_df.loc[los_df.Age >= 65, 'LOS_Total']
+    raise ValueError(f'Unexpected value for LoS group: {group}')
+
+
+def age_distribution(los_df: pd.DataFrame) -> dict[str, float]:
+    """Fraction of patients in each age group, from the output of `load_los`."""
+    return {
+        'paeds': np.mean(los_df.Age < 16),
+        'adult': np.mean((los_df.Age >= 16) & (los_df.Age < 65)),
+        'senior': np.mean(los_df.Age >= 65),
+    }
 
 
-def fit_los(los_data, group: str):
-    """Fit an LoS distribution."""
+def remove_outliers(los: pd.Series) -> pd.Series:
+    """Remove LoS values more than 3 standard deviations from the mean."""
+    return los[np.abs(zscore(los)) < 3]
 
-    # Load data and select age group
-    los_df = load_los(los_data)
-    if group == 'paeds':
-        los = los_df.loc[los_df.Age < 16, 'LOS_Total']
-    elif group == 'adult':
-        los = los_df.loc[(los_df.Age >= 16) & (los_df.Age < 65), 'LOS_Total']
-    elif group == 'senior':
-        los = los_df.loc[los_df.Age >= 65, 'LOS_Total']
-    else:
-        raise ValueError(f'Unexpected value for LoS group: {group}')
 
-    # Remove outliers
-    los = los[np.abs(zscore(los)) < 3]
+def fit_progress(set_progress):
+    """Wrap a background callback's `set_progress` function for use with `fit_los`."""
+    def _progress(n_done: int, n_total: int):
+        set_progress((100 * n_done / n_total, f'Tried {n_done}/{n_total} distributions'))
+    return _progress
 
-    # Fit distributions
-    f = Fitter(los, timeout=10)
-    f.fit()
+
+def fit_los(los_data, group: str, progress: Callable[[int, int], None] | None = None):
+    """Fit an LoS distribution.
+
+    Returns the table of the top 5 distributions (plus the empirical distributions), their
+    parameters, and the data for their goodness-of-fit plots (see `goodness_of_fit`).
+
+    If given, `progress(n_done, n_total)` is called as each candidate distribution has been
+    fitted."""
+
+    # Load data and select age group
+    los = remove_outliers(get_group(load_los(los_data), group))
+
+    # Fit distributions in parallel (see `fit_families`). The three age groups are fitted at
+    # the same time by separate callbacks, so each gets a third of the available workers
+    n_workers = max(1, max_workers() // 3)
+    df_errors, fitted_param = fit_families(los, get_distributions(), n_workers=n_workers,
+                                           progress=progress)
 
     # Distribution statistics sorted by sum of squared errors
-    fit_df = f.df_errors.loc[
-        np.isfinite(f.df_errors.sumsquare_error),
+    fit_df = df_errors.loc[
+        np.isfinite(df_errors.sumsquare_error),
         ['sumsquare_error', 'aic', 'bic', 'ks_pvalue']
     ].sort_values(
         'sumsquare_error'
-    ).assign(
-        dist_mean=np.nan,
-        dist_std=np.nan
     )
 
+    # Empirical distributions need no fitting, and are always offered alongside the fitted
+    # families. The moments and goodness of fit of all candidates are computed in one pass
+    dists = {n: dict(zip(get_params(n), fitted_param[n])) for n in fit_df.index}
+    for n in EMPIRICAL_DISTS:
+        dists[n] = empirical_params(los, smooth=n == EMPIRICAL_SMOOTH)
+    gof = goodness_of_fit(los, dists, n_workers=n_workers)
+    dist_mean, dist_std = pd.Series(gof.pop('mean')), pd.Series(gof.pop('std'))
+
     # Filter results by standard deviation
     s = np.std(los)
 
-    for dist_name in fit_df.index:
-        dist = getattr(stats, dist_name)(*f.fitted_param[dist_name])
-        fit_df.loc[dist_name, 'dist_mean'] = dist.mean()
-        fit_df.loc[dist_name, 'dist_std'] = dist.std()
+    fit_df = fit_df.assign(dist_mean=dist_mean, dist_std=dist_std)
     fit_df = fit_df.loc[
         (fit_df.dist_mean > 0) & (fit_df.dist_std > 0.75 * s) & (fit_df.dist_std < 1.5 * s)
     ]
 
     # Keep top 5 only
-    fit_df = fit_df[:5].reset_index(names='Distribution')
+    fit_df = fit_df[:5]
+    for n in EMPIRICAL_DISTS:
+        fit_df.loc[n] = [np.nan, np.nan, np.nan, np.nan, dist_mean[n], dist_std[n]]
+    fit_df = fit_df.reset_index(names='Distribution')
 
     fit_df.sumsquare_error = fit_df.sumsquare_error.round(6)
     fit_df.aic = fit_df.aic.round(3)
@@ -434,12 +617,26 @@ def fit_los(los_data, group: str):
 
     data = {
         'head': fit_df.columns.to_list(),
-        'body': fit_df.to_numpy().tolist()
+        'body': fit_df.astype(object).where(fit_df.notna(), None).to_numpy().tolist()
     }
-    dists = {
-        n: dict(zip(get_params(n), f.fitted_param[n]))
-        for n in fit_df.Distribution
+    names = fit_df.Distribution.to_list()
+    gof = {
+        k: {n: v[n] for n in names if n in v} if isinstance(v, dict) else v
+        for k, v in gof.items()
     }
-    return data, dists
+    return data, {n: dists[n] for n in names}, gof_data(gof)
+
+
+def gof_data(gof: dict) -> dict:
+    """Store data for the goodness-of-fit plots drawn by `GOF_FIGURE`, from the output of
+    `goodness_of_fit`, with each array as a typed array (see `typed_array`), in which missing
+    values are NaN. `qq_max` is the largest sample quantile, for the diagonal of the QQ plot."""
+    def encode(values):
+        return typed_array(np.asarray(values, dtype=float))
+
+    return {
+        k: {n: encode(row) for n, row in v.items()} if isinstance(v, dict) else encode(v)
+        for k, v in gof.items()
+    } | {'qq_max': float(np.nanmax(np.asarray(gof['qq_data'], dtype=float)))}
 #
 # endregion
@@ -1,23 +1,57 @@
 """Module for the Daily Arrivals tab of Step 3: Patient Length-of-Stay Modelling"""
 
 import json
-from copy import deepcopy
-from math import isnan
+from uuid import uuid4
 
 import dash
 import dash_mantine_components as dmc
 import pandas as pd
-import salabim as sim
-from dash import Input, Output, State, callback, clientside_callback, dcc
+from dash import Input, Output, Patch, State, callback, clientside_callback, dcc
 from dash_compose import composition
-from numpy.random import normal
 from plotly import graph_objects as go
-from scipy import stats
+from plotly.subplots import make_subplots
 
 from cuh_resp_model.components.ids import *
 
-from ..cache import bg_manager
+from ..analytic import expected_occupancy
+from ..cache import bg_manager, results_cache, series_cache
 from ..components.back_next import back_next
+from ..figures import MAX_POINTS, band_traces, downsample, scatter, typed_array, x_range
+from ..sensitivity import OUTPUTS, PARAMETERS, tornado
+from ..simulation import (ENGINE_SALABIM, ENGINES, N_REPS, scenario_from_config, scenario_key,
+                          simulate, summarise)
+
+FIGURE_TITLES = {
+    'total': 'Total beds',
+    'adult': 'Adult beds',
+    'paeds': 'Paeds beds'
+}
+
+GRAPH_IDS = {
+    'total': ID_GRAPH_SIM_TOTAL,
+    'adult': ID_GRAPH_SIM_ADULT,
+    'paeds': ID_GRAPH_SIM_PAEDS
+}
+
+STORE_IDS = {
+    'total': ID_STORE_SIM_TOTAL,
+    'adult': ID_STORE_SIM_ADULT,
+    'paeds': ID_STORE_SIM_PAEDS
+}
+
+PREVIEW_SUMMARY = 'Showing the analytic approximation while the simulation runs.'
+
+GO_LAYOUT = {
+    'width': 1000,
+    'height': 300,
+    'legend_y': 0.5,
+    'legend_font_size': 14,
+    'title_font_size': 20,
+    'xaxis': {'tickfont': {'size': 14}},
+    'yaxis': {'tickfont': {'size': 14}},
+    'title_font_weight': 900,
+    'uirevision': 'sim'  # Keep the zoom when the traces are redrawn
+}
 
 
 @composition
@@ -34,15 +68,77 @@ def stepper_step():
                     with dmc.Group(gap='sm'):
                         yield dmc.Button(id=ID_CONFIG_DOWNLOAD_BTN, children="Download config")
                         yield dcc.Download(id=ID_CONFIG_DOWNLOAD)
+                    with dmc.Group(gap='md', align='flex-end'):
+                        yield dmc.Select(
+                            id=ID_SIM_ENGINE,
+                            label='Simulation engine',
+                            description='Both engines simulate the same model; the vectorized '
+                            'engine is much faster',
+                            data=[{'value': k, 'label': v} for k, v in ENGINES.items()],
+                            value=ENGINE_SALABIM,
+                            allowDeselect=False,
+                            w=400
+                        )
+                        yield dmc.NumberInput(
+                            id=ID_SIM_TOLERANCE,
+                            label='Quantile precision [beds]',
+                            description='Width of the 95% CI of each plotted quantile',
+                            value=4,
+                            min=0,
+                            allowNegative=False,
+                            debounce=True,
+                            w=250
+                        )
+                        yield dmc.NumberInput(
+                            id=ID_SIM_MAX_REPS,
+                            label='Maximum replications',
+                            value=500,
+                            min=N_REPS,
+                            max=10000,
+                            allowNegative=False,
+                            allowDecimal=False,
+                            debounce=True,
+                            w=200
+                        )
                 with dmc.Stack(gap='sm'):
                     yield dmc.Text("Simulation Results", size='xl')
-                    with dmc.Stack(id=ID_SIM_RESULTS, pos="relative"):
-                        yield dmc.LoadingOverlay(
-                            id=ID_OVERLAY_SIM_RESULTS,
-                            visible=True,
-                            overlayProps={"radius": "sm", "blur": 2}
+                    with dmc.Group(id=ID_PROGRESS_SIM_RESULTS, display='none', gap='md'):
+                        yield dmc.Progress(id=ID_PROGRESS_BAR_SIM_RESULTS, value=0, w=300,
+                                           animated=True)
+                        yield dmc.Text(id=ID_PROGRESS_TEXT_SIM_RESULTS, size='sm')
+                        yield dmc.Button('Stop', id=ID_SIM_STOP_BTN, size='xs', variant='outline')
+                    yield dmc.Text(id=ID_SIM_SUMMARY, size='sm')
+                    with dmc.Stack(id=ID_SIM_RESULTS):
+                        for store_id in STORE_IDS.values():
+                            yield dcc.Store(id=store_id)
+                        for group, title in FIGURE_TITLES.items():
+                            yield dcc.Graph(
+                                id=GRAPH_IDS[group],
+                                figure=go.Figure(layout=GO_LAYOUT | {'title': title})
+                            )
+                with dmc.Stack(gap='sm'):
+                    yield dmc.Text("Sensitivity Analysis", size='xl')
+                    yield dmc.Text(
+                        'Vary each of the peak date, peak height and horizontal scale of the '
+                        'arrival curve, the share of patients aged 65+, and the LoS, with the '
+                        'others fixed, to see which assumptions the forecasts depend on most.',
+                        size='sm'
+                    )
+                    with dmc.Group(gap='md', align='flex-end'):
+                        yield dmc.NumberInput(
+                            id=ID_SENS_THRESHOLD,
+                            label='Occupancy threshold [beds]',
+                            description='Default: 80% of the peak',
+                            min=0,
+                            allowNegative=False,
+                            w=250
                         )
-                        yield dmc.Stack(h=600)
+                        yield dmc.Button('Run sensitivity analysis', id=ID_SENS_BTN)
+                    yield dmc.Text(id=ID_SENS_TEXT, size='sm')
+                    yield dcc.Graph(
+                        id=ID_GRAPH_SENS,
+                        figure=go.Figure(layout=GO_LAYOUT | {'title': 'Sensitivity'})
+                    )
                 yield back_next(ID_STEPPER_BTN_4_TO_3, None)
     return ret
 
@@ -64,247 +160,270 @@ clientside_callback(
     Output(ID_CONFIG_DOWNLOAD, 'data'),
     Input(ID_CONFIG_DOWNLOAD_BTN, 'n_clicks'),
     State(ID_STORE_APPDATA, 'data'),
+    State(ID_STORE_STEP_2, 'data'),
+    State(ID_STORE_STEP_3, 'data'),
     prevent_initial_call=True
 )
-def download_config(_, data):
-    """Send the simulation config when the Download button is pressed."""
-    ret = deepcopy(data)
-    del ret['step_1']['los_data']  # not needed to run simulation or plot results
+def download_config(_, data, step_2, step_3):
+    """Send the simulation config when the Download button is pressed. The uploaded LoS data
+    is not needed to run simulation or plot results, and is kept in a separate store."""
+    ret = data | {'step_2': step_2, 'step_3': step_3}
     return dcc.send_string(
         json.dumps(ret, sort_keys=False),
         filename='config.json'
     )
 
 
+# Draw the fan chart traces from the stores, keeping the layout (and theme) of each graph. The
+# background callback resends the latest traces with every progress update, so each set of
+# traces is tagged with a version, to skip redrawing the graph when unchanged.
+for _store_id, _graph_id in zip(STORE_IDS.values(), GRAPH_IDS.values()):
+    clientside_callback(
+        """(traces, figure) => {
+            const version = traces && traces.version;
+            if (!version || (figure.layout.meta && figure.layout.meta.version === version)) {
+                return window.dash_clientside.no_update;
+            }
+            return {...figure, data: traces.data, layout: {...figure.layout, meta: {version}}};
+        }""",
+        Output(_graph_id, 'figure', allow_duplicate=True),
+        Input(_store_id, 'data'),
+        State(_graph_id, 'figure'),
+        prevent_initial_call=True
+    )
+
+
+def zoom_fan_chart(relayout_data, data: dict | None):
+    """Redraw a fan chart for the visible range when it is zoomed or panned, if its series
+    were downsampled."""
+    bounds = x_range(relayout_data)
+    if bounds is None or not data or (series_key := data.get('series')) is None \
+            or (series := series_cache.get(series_key)) is None:
+        return dash.no_update
+    return fan_chart_data(*series, bounds=bounds, series_key=series_key)
+
+
+for _store_id, _graph_id in zip(STORE_IDS.values(), GRAPH_IDS.values()):
+    callback(
+        Output(_store_id, 'data', allow_duplicate=True),
+        Input(_graph_id, 'relayoutData'),
+        State(_store_id, 'data'),
+        prevent_initial_call=True
+    )(zoom_fan_chart)
+
+
 @callback(
-    Output(ID_SIM_RESULTS, 'children', allow_duplicate=True),
+    *[Output(store_id, 'data', allow_duplicate=True) for store_id in STORE_IDS.values()],
+    Output(ID_SIM_SUMMARY, 'children', allow_duplicate=True),
     Input(ID_STEPPER, 'active'),
-    State(ID_STORE_APPDATA, 'data'),
+    State(ID_SIM_ENGINE, 'value'),
+    State(ID_SIM_TOLERANCE, 'value'),
+    State(ID_SIM_MAX_REPS, 'value'),
+    State(ID_STORE_STEP_2, 'data'),
+    State(ID_STORE_STEP_3, 'data'),
+    prevent_initial_call=True
+)
+def gen_preview(active_step, engine: str, tolerance, max_reps, step_2: dict, step_3: dict):
+    """Render the analytic approximation of the bed forecasts, to be replaced by the
+    simulation results as they arrive.
+
+    Nothing is rendered if the results are already cached, since `gen_bed_forecasts` then
+    renders them straight away, and the preview could otherwise overwrite them."""
+    if active_step != 3:  # Step 4
+        return dash.no_update
+
+    config = {'step_2': step_2, 'step_3': step_3}
+    if scenario_key(config, **sim_options(engine, tolerance, max_reps)) in results_cache:
+        return dash.no_update
+
+    expected = expected_occupancy(**scenario_from_config(config))
+    return *[
+        fan_chart_data(expected[group], expected[group]['mean']) for group in STORE_IDS
+    ], PREVIEW_SUMMARY
+
+
+@callback(
+    *[Output(store_id, 'data', allow_duplicate=True) for store_id in STORE_IDS.values()],
+    Output(ID_SIM_SUMMARY, 'children', allow_duplicate=True),
+    Input(ID_STEPPER, 'active'),
+    Input(ID_SIM_ENGINE, 'value'),
+    Input(ID_SIM_TOLERANCE, 'value'),
+    Input(ID_SIM_MAX_REPS, 'value'),
+    State(ID_STORE_STEP_2, 'data'),
+    State(ID_STORE_STEP_3, 'data'),
     prevent_initial_call=True,
     background=True,
-    manager=bg_manager
+    manager=bg_manager,
+    progress=[
+        Output(ID_PROGRESS_BAR_SIM_RESULTS, 'value'),
+        Output(ID_PROGRESS_TEXT_SIM_RESULTS, 'children'),
+        *[Output(store_id, 'data') for store_id in STORE_IDS.values()],
+        Output(ID_SIM_SUMMARY, 'children')
+    ],
+    running=[(Output(ID_PROGRESS_SIM_RESULTS, 'display'), 'flex', 'none')],
+    cancel=[Input(ID_STEPPER_BTN_4_TO_3, 'n_clicks'), Input(ID_SIM_STOP_BTN, 'n_clicks')]
 )
-def gen_bed_forecasts(active_step, app_data: dict):
-    """Render the LoS graphs for the three age groups."""
+def gen_bed_forecasts(set_progress, active_step, engine: str, tolerance, max_reps,
+                      step_2: dict, step_3: dict):
+    """Render the LoS graphs for the three age groups.
+
+    Replications are run until the quantiles in the graphs are known to within `tolerance`
+    beds, or `max_reps` replications have been run. The graphs are updated after each batch
+    of replications, so the simulation can be stopped early once they look stable."""
 
     if active_step != 3:  # Step 4
         return dash.no_update
 
-    df_arr = pd.DataFrame({
-        'date': app_data['step_2']['xs'],
-        'n_arr': app_data['step_2']['ys']
-    })
-    df_arr
-
-    # Get the simulation end, i.e. midnight one day after the last day in `df_arr`
-    sim_end = pd.Timestamp(list(df_arr.date)[-1]) + pd.Timedelta(days=1)
-
-    def get_dist(group: str):
-        n = app_data['step_3']['selected_dists']['paeds']
-        params = app_data['step_3']['dists']['paeds'][n]
-        return getattr(stats, n)(**params)
-    
-    dist_paeds = get_dist('paeds')
-    dist_adult = get_dist('adult')
-    dist_senior = get_dist('senior')
-    age_dist = app_data['step_3']['age_dist']
-
-    patient_params = {
-        'dist_paeds': dist_paeds,
-        'dist_adult': dist_adult,
-        'dist_senior': dist_senior,
-        'age_dist': age_dist 
-    }
+    options = sim_options(engine, tolerance, max_reps)
+    config = {'step_2': step_2, 'step_3': step_3}
+    key = scenario_key(config, **options)
+    if (cached := results_cache.get(key)) is not None:
+        summary, expected = cached
+        return fan_charts(summary, expected, final=True)
 
-    df_total, df_adult, df_paeds = simulate(
-        df_arr,
-        until=sim_end,
-        patient_params=patient_params
-    )
+    scenario = scenario_from_config(config)
+    start = scenario['df_arr'].date[0]
+    expected = expected_occupancy(**scenario)
 
-    fig_total = gen_figure(df_total, title='Total beds')
-    fig_adult = gen_figure(df_adult, title='Adult beds')
-    fig_paeds = gen_figure(df_paeds, title='Paeds beds')
+    # Progress is reported once per batch of replications, with the quantile traces of the
+    # results so far, so each update costs the same however many replications have been run
+    def on_batch(results):
+        set_progress((
+            100 * len(results) / options['n_reps'], f'Completed {len(results)} replications',
+            *fan_charts(summarise(results, start), expected, final=False)
+        ))
 
-    return [
-        dcc.Graph(figure=fig_total),
-        dcc.Graph(figure=fig_adult),
-        dcc.Graph(figure=fig_paeds),
-    ]
+    results = simulate(**scenario, **options, on_batch=on_batch)
+    summary = summarise(results, start)
+    results_cache.set(key, (summary, expected))
+    return fan_charts(summary, expected, final=True)
+
+
+@callback(
+    Output(ID_GRAPH_SENS, 'figure', allow_duplicate=True),
+    Output(ID_SENS_TEXT, 'children'),
+    Input(ID_SENS_BTN, 'n_clicks'),
+    State(ID_SENS_THRESHOLD, 'value'),
+    State(ID_STORE_STEP_2, 'data'),
+    State(ID_STORE_STEP_3, 'data'),
+    prevent_initial_call=True,
+    background=True,
+    manager=bg_manager,
+    running=[(Output(ID_SENS_BTN, 'loading'), True, False)],
+    cancel=[Input(ID_STEPPER_BTN_4_TO_3, 'n_clicks')]
+)
+def run_sensitivity(_, threshold, step_2: dict, step_3: dict):
+    """Draw a tornado chart of the sensitivity of the peak occupancy and the days above the
+    occupancy threshold to each scenario parameter (see `sensitivity.tornado`)."""
+    df = tornado({'step_2': step_2, 'step_3': step_3},
+                 threshold=threshold if threshold not in (None, '') else None)
+    fig = tornado_figure(df)
+    patched = Patch()  # Keep the theme
+    patched['data'] = fig.to_plotly_json()['data']
+    patched['layout'].update({
+        k: v for k, v in fig.to_plotly_json()['layout'].items() if k != 'template'
+    })
+    return patched, f'Occupancy threshold: {df.attrs["threshold"]:g} beds.'
 #
 # endregion
 
 
 # region helper functions
 #
-def simulate(
-        df_arr: pd.DataFrame,
-        until: pd.Timedelta,
-        patient_params: dict
-):
-    """Run the simulation multiple times and concatenate the results."""
-    dfs = []
-    dfs_adult = []
-    dfs_paeds = []
-
-    for _ in range(30):
-        result = simulate_once(
-            df_arr,
-            until=until,
-            patient_params=patient_params
-        )
-        dfs.append(result['total'])
-        dfs_paeds.append(result['paeds'])
-        dfs_adult.append(result['adult'])
-
-        df = pd.concat(dfs, axis=1)
-        df_adult = pd.concat(dfs_adult, axis=1)
-        df_paeds = pd.concat(dfs_paeds, axis=1)
-
-    return df, df_adult, df_paeds
-
-
-def simulate_once(
-    df_arr: pd.DataFrame,
-    until: pd.Timestamp,
-    patient_params: dict
-):
-    """The respirator disease model simulation."""
-    env = Environment(time_unit='days', datetime0=df_arr.date[0], random_seed='*')
-    DailyArrivals(env=env, n_arr = df_arr.n_arr, patient_params=patient_params)
-
-    env.run(env.datetime_to_t(until))
-
-    beds_df = env.beds.claimed_quantity.as_dataframe().set_index('t')
-    beds_paeds_df = env.beds_paeds.claimed_quantity.as_dataframe().set_index('t')
-    beds_adult_df = env.beds_adult.claimed_quantity.as_dataframe().set_index('t')
-
-    beds_df.index = beds_df.index.map(env.t_to_datetime)
-    beds_paeds_df.index = beds_paeds_df.index.map(env.t_to_datetime)
-    beds_adult_df.index = beds_adult_df.index.map(env.t_to_datetime)
-
-    beds_df = beds_df.resample('1D').max().ffill()
-    beds_paeds_df = beds_paeds_df.resample('1D').max().ffill()
-    beds_adult_df = beds_adult_df.resample('1D').max().ffill()
-
+def sim_options(engine: str, tolerance, max_reps) -> dict:
+    """Options of `simulate` for the values of the Step 4 simulation inputs."""
     return {
-        'total': beds_df, 'paeds': beds_paeds_df, 'adult': beds_adult_df
+        'engine': engine,
+        'n_reps': max(N_REPS, int(max_reps or N_REPS)),
+        'tolerance': tolerance if tolerance not in (None, '') else None
     }
 
 
-class Environment(sim.Environment):
-    """The simulation environment"""
-    beds: sim.Resource
-
-    # Use virtual resources as counters for different types of bed occupancies
-    beds_adult: sim.Resource
-    beds_paeds: sim.Resource
-
-    def setup(self):
-        self.beds = sim.Resource('beds', capacity=sim.inf, env=self)
-        self.beds_adult = sim.Resource('beds', capacity=sim.inf, env=self)
-        self.beds_paeds = sim.Resource('beds', capacity=sim.inf, env=self)
-
-
-class DailyArrivals(sim.Component):
-    """Daily Arrival generator."""
-
-    n_arr: list[float]
-    patient_params: dict
-
-    def setup(self, n_arr, patient_params):
-        self.n_arr = n_arr
-        self.patient_params = patient_params
-
-    def process(self):
-        """Generate patients. Patients are batch-generated each day; each Patient instance
-        is responsible for entering the system at the correct time-of-day using
-        `Patient.hold()`."""
-        JITTER = 0.05 # Add 5% jitter to simulation arrivals
-
-        for n_cases in self.n_arr:
-            n = round(n_cases * normal(1.0, JITTER))
-            for _ in range(n):
-                Patient(**self.patient_params)
-            self.hold(self.env.days(1.0))
-
-
-class Patient(sim.Component):
-    """A patient in the respiratory disease model."""
-
-    def process(self, dist_paeds, dist_adult, dist_senior, age_dist):
-        """Model a patient journey through the ward."""
-        self.env: Environment
-        u01 = sim.Uniform(0, 1)
-
-        # Arrivals are generated at midnight but released to the system at a random time of day
-        self.hold(self.env.days(u01))
-
-        is_paeds = False
-        if (r := u01()) < age_dist['paeds']:
-            is_paeds = True
-            los = dist_paeds.rvs()
-        elif r < age_dist['paeds'] + age_dist['adult']:
-            los = dist_adult.rvs()
-        else:
-            los = dist_senior.rvs()
-        
-        assert not isnan(los), 'LOS is nan'
-        los = max(0, los)  # Clip to bounds
-
-        self.request(self.env.beds)  # 1 hold
-        self.request(self.env.beds_paeds if is_paeds else self.env.beds_adult)  # 2 holds
-        self.hold(los)
-        self.release(self.env.beds_paeds if is_paeds else self.env.beds_adult)  # 1 holds
-        self.release(self.env.beds)  # 0 holds
-
-
-def gen_figure(df: pd.DataFrame, title: str):
-    """Plot simulation results."""
-    go_layout = {
-        'width': 1000,
-        'height': 300,
-        'title': title,
-        'legend_y': 0.5,
-        'legend_font_size': 14,
-        'title_font_size': 20,
-        'xaxis': {'tickfont': {'size': 14}},
-        'yaxis': {'tickfont': {'size': 14}},
-        'title_font_weight': 900
+def fan_charts(summary: dict, expected: dict[str, pd.DataFrame], final: bool) -> list:
+    """Store data for the Step 4 graphs, plus the summary text, for simulation results
+    summarised by `summarise`.
+
+    `expected` is the output of `expected_occupancy` for the same scenario."""
+    text = (
+        f'Results from {len(summary["results"])} replications{"" if final else " so far"}. '
+        f'The 95% confidence intervals of the plotted quantiles are at most '
+        f'{summary["ci_width"]:g} beds wide.'
+    )
+    return [
+        *[
+            fan_chart_data(summary['quantiles'][group], expected[group]['mean'])
+            for group in STORE_IDS
+        ],
+        text
+    ]
+
+
+def fan_chart_data(quantiles: pd.DataFrame, expected: pd.Series | None = None,
+                   bounds: tuple = (None, None), series_key: str | None = None) -> dict:
+    """Store data for drawing a fan chart on a Step 4 graph (see `fan_traces`).
+
+    If the series are longer than `MAX_POINTS`, they are kept in the `series_cache` under
+    `series_key` (a new key by default), for redrawing when the graph is zoomed."""
+    if series_key is None and len(quantiles) > MAX_POINTS:
+        series_key = uuid4().hex
+        series_cache.set(series_key, (quantiles, expected))
+    return {
+        'version': uuid4().hex,
+        'series': series_key,
+        'data': [trace.to_plotly_json() for trace in fan_traces(quantiles, expected, bounds)]
     }
 
-    x = list(df.index)
-
-    y_lo = list(df.quantile(0.1, axis=1))
-    y_hi = list(df.quantile(0.9, axis=1))
-    fig = go.Figure(layout=go_layout)
-    fig.add_trace(go.Scatter(
-        x=x+x[::-1],
-        y=y_hi+y_lo[::-1],
-        fill='toself',
-        fillcolor='rgba(231,107,243,0.3)',
-        line_color='rgba(255,255,255,0)',
-        name='lower/upper deciles',
-    ))
-
-
-    y_lo = list(df.quantile(0.25, axis=1))
-    y_hi = list(df.quantile(0.75, axis=1))
-    fig.add_trace(go.Scatter(
-        x=x+x[::-1],
-        y=y_hi+y_lo[::-1],
-        fill='toself',
-        fillcolor='rgba(231,107,243,0.5)',
-        line_color='rgba(255,255,255,0)',
-        name='lower/upper quartiles',
-    ))
-
-    fig.add_trace(go.Scatter(
-        x=x, y=list(df.quantile(0.5, axis=1)),
-        line_color='rgb(80,0,80)',
-        name='Median'
-    ))
 
+def fan_traces(quantiles: pd.DataFrame, expected: pd.Series | None = None,
+               bounds: tuple = (None, None)) -> list[go.Scattergl]:
+    """Traces for a fan chart of bed occupancy from a DataFrame indexed by date with a column
+    for each of the `QUANTILES`, downsampled (see `downsample`) for an x-axis spanning
+    `bounds`.
+
+    If given, `expected` is plotted as the expected occupancy from the analytic model."""
+    x, q = downsample(quantiles.index, {level: quantiles[level] for level in quantiles}, bounds)
+    traces = [
+        *band_traces(x, q[0.1], q[0.9], 'lower/upper deciles', 'rgba(231,107,243,0.3)'),
+        *band_traces(x, q[0.25], q[0.75], 'lower/upper quartiles', 'rgba(231,107,243,0.5)'),
+        scatter(x, q[0.5], line_color='rgb(80,0,80)', name='Median')
+    ]
+
+    if expected is not None:
+        x, y = downsample(expected.index, {'mean': expected}, bounds)
+        traces.append(scatter(
+            x, y['mean'],
+            line={'color': 'rgb(80,80,80)', 'dash': 'dash'},
+            name='Expected (analytic)'
+        ))
+
+    return traces
+
+
+def tornado_figure(df: pd.DataFrame) -> go.Figure:
+    """Tornado chart of the output of `sensitivity.tornado`, with a panel for each output.
+    The bars span the outputs from the low to the high end of each parameter's range, with the
+    parameter with the largest effect at the top."""
+    fig = make_subplots(rows=1, cols=len(OUTPUTS), subplot_titles=OUTPUTS,
+                        horizontal_spacing=0.25)
+    for col, output in enumerate(OUTPUTS, 1):
+        rows = df.loc[output].iloc[::-1]
+        labels = [PARAMETERS[name] for name in rows.index]
+        baseline = rows['baseline'].iloc[0]
+        for end, color in (('low', 'rgb(80,120,200)'), ('high', 'rgb(200,80,80)')):
+            fig.add_trace(go.Bar(
+                y=labels,
+                x=typed_array(rows[f'at {end}'] - baseline),
+                base=baseline,
+                orientation='h',
+                marker_color=color,
+                name=f'{end} value',
+                legendgroup=end,
+                showlegend=col == 1,
+                customdata=typed_array(rows[[end, f'at {end}']].to_numpy()),
+                hovertemplate='%{customdata[0]:.3g}: %{customdata[1]:.1f}<extra></extra>'
+            ), row=1, col=col)
+        fig.add_vline(x=baseline, line_dash='dash', line_color='rgb(80,80,80)', row=1, col=col)
+    fig.update_layout(GO_LAYOUT | {'title': 'Sensitivity', 'barmode': 'overlay'})
     return fig
 #
-# endregion
\ No newline at end of file
+# endregion
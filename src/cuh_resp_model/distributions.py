@@ -0,0 +1,423 @@
+"""Length-of-stay distributions used by the simulation.
+
+The distributions chosen in Step 3 are stored in the app data as a name and a dict of
+parameters. Names of `scipy.stats` distributions refer to the fitted parametric families; the
+names in `EMPIRICAL_DISTS` refer to an `EmpiricalDist` built directly from the observed stays.
+"""
+
+import warnings
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from scipy.special import expit, logit
+
+from .utils import max_workers
+
+EMPIRICAL = 'empirical'
+"""Resample the observed stays."""
+
+EMPIRICAL_SMOOTH = 'empirical (smoothed)'
+"""Sample from the observed stays, linearly interpolating between them."""
+
+EMPIRICAL_DISTS = (EMPIRICAL, EMPIRICAL_SMOOTH)
+
+EMPIRICAL_MAX_KNOTS = 512
+"""Maximum size of the lookup table of an `EmpiricalDist`. Larger samples are summarised by
+their quantiles."""
+
+FIT_TIMEOUT = 10
+"""Time limit for fitting each candidate family in `fit_families`, in seconds."""
+
+GOF_TAIL_RANGE = 1000
+"""The grid of `goodness_of_fit` extends to this multiple of the longest stay either side of
+zero, with geometrically-spaced points from this fraction of it, so that the moments of the
+candidates can be computed from their CDFs."""
+
+GOF_TAIL_POINTS = 1500
+"""Number of geometrically-spaced points either side of zero on the grid of
+`goodness_of_fit`."""
+
+GOF_MOMENT_TAIL = 1e-6
+"""Maximum probability beyond the grid of `goodness_of_fit` for which the moments of a
+candidate are computed."""
+
+
+class EmpiricalDist:
+    """Distribution defined by an inverse-CDF lookup table.
+
+    `knots` is a sorted array of values. If `smooth` is False, each knot is drawn with equal
+    probability; otherwise the inverse CDF is the piecewise-linear function passing through the
+    knots at the increasing probabilities `probs`, by default evenly spaced from 0 to 1. Values
+    below the first or above the last of `probs` are drawn as the first or last knot.
+
+    Implements the subset of the frozen `scipy.stats` distribution interface used by the app.
+    Sampling is a single table lookup per value, and is vectorised over `size`.
+    """
+
+    def __init__(self, knots, smooth: bool = False, probs=None):
+        self.knots = np.sort(np.asarray(knots, dtype=float))
+        self.smooth = smooth
+        self.probs = None if probs is None else np.asarray(probs, dtype=float)
+        if len(self.knots) == 0:
+            raise ValueError('EmpiricalDist requires at least one knot')
+        if self.probs is not None and (not smooth or len(self.probs) != len(self.knots)):
+            raise ValueError('EmpiricalDist probs require smooth=True and one per knot')
+
+    def _probs(self) -> np.ndarray:
+        """Probabilities of the knots of a smooth distribution."""
+        return np.linspace(0, 1, len(self.knots)) if self.probs is None else self.probs
+
+    def scaled(self, factor: float) -> 'EmpiricalDist':
+        """The distribution of the values multiplied by `factor`."""
+        return EmpiricalDist(self.knots * factor, self.smooth, self.probs)
+
+    def ppf(self, q):
+        """Percent point function (inverse CDF)."""
+        q = np.asarray(q, dtype=float)
+        n = len(self.knots)
+        if self.smooth and self.probs is not None:
+            return np.interp(q, self.probs, self.knots)
+        if self.smooth:
+            return np.interp(q * (n - 1), np.arange(n), self.knots)
+        return self.knots[np.minimum((q * n).astype(int), n - 1)]
+
+    def cdf(self, x):
+        """Cumulative distribution function."""
+        x = np.asarray(x, dtype=float)
+        n = len(self.knots)
+        if self.smooth and n > 1:
+            return np.interp(x, self.knots, self._probs(), left=0, right=1)
+        return np.searchsorted(self.knots, x, side='right') / n
+
+    def sf(self, x):
+        """Survival function."""
+        return 1 - self.cdf(x)
+
+    def rvs(self, size=None, random_state=None):
+        """Draw random values, using `random_state` (None, an int seed, or a numpy
+        `Generator` or `RandomState`) in the same way as `scipy.stats`."""
+        if random_state is None:
+            u = np.random.random_sample(size)
+        elif isinstance(random_state, np.random.RandomState):
+            u = random_state.random_sample(size)
+        else:
+            u = np.random.default_rng(random_state).random(size)
+        ret = self.ppf(u)
+        return float(ret) if size is None else ret
+
+    def mean(self) -> float:
+        """Mean of the distribution."""
+        if self.smooth and len(self.knots) > 1:
+            p, a, b = self._probs(), self.knots[:-1], self.knots[1:]
+            return float(np.sum(np.diff(p) * (a + b) / 2) + p[0] * a[0] + (1 - p[-1]) * b[-1])
+        return float(np.mean(self.knots))
+
+    def var(self) -> float:
+        """Variance of the distribution."""
+        if self.smooth and len(self.knots) > 1:
+            p, a, b = self._probs(), self.knots[:-1], self.knots[1:]
+            m2 = np.sum(np.diff(p) * (a * a + a * b + b * b) / 3) \
+                + p[0] * a[0] ** 2 + (1 - p[-1]) * b[-1] ** 2
+            return float(m2 - self.mean() ** 2)
+        return float(np.var(self.knots))
+
+    def std(self) -> float:
+        """Standard deviation of the distribution."""
+        return float(np.sqrt(max(self.var(), 0)))
+
+
+def empirical_params(los, smooth: bool = False, max_knots: int = EMPIRICAL_MAX_KNOTS) -> dict:
+    """Build the stored parameters of an `EmpiricalDist` from observed stays `los`.
+
+    Samples larger than `max_knots` are reduced to `max_knots` evenly-spaced quantiles.
+    """
+    los = np.sort(np.maximum(np.asarray(los, dtype=float), 0))
+    los = los[np.isfinite(los)]
+    if len(los) > max_knots:
+        if smooth:
+            q = np.linspace(0, 1, max_knots)
+        else:
+            q = (np.arange(max_knots) + 0.5) / max_knots
+        los = np.quantile(los, q)
+    return {'knots': [round(float(x), 4) for x in los], 'smooth': smooth}
+
+
+def make_dist(name: str, params: dict):
+    """Create a frozen distribution from a name and parameter dict stored in the app data."""
+    if name in EMPIRICAL_DISTS:
+        return EmpiricalDist(**params)
+    return getattr(stats, name)(**params)
+
+
+def tabulate_ppf(dist, n_knots: int = EMPIRICAL_MAX_KNOTS, tail: float = 1e-6) -> EmpiricalDist:
+    """Approximate a frozen distribution by the piecewise-linear interpolation of its inverse
+    CDF at `n_knots` probabilities from `tail` to `1 - tail`.
+
+    Useful for sampling by inversion, since `ppf` is slow for `scipy.stats` distributions
+    whose CDF is computed numerically. The probabilities are evenly spaced in logit(q), so that
+    the knots follow the tails closely: with evenly-spaced probabilities, the last piece would
+    join a high quantile to the extreme one, overstating the mean of long-tailed LoS
+    distributions. The CDF is evaluated on a grid and inverted by interpolation in logit(q),
+    in which exponential-like tails are close to linear, rather than calling `ppf` at each
+    knot."""
+    if isinstance(dist, EmpiricalDist):
+        return dist
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        lo, hi = dist.ppf([tail, 1 - tail])
+        # Evenly spaced, plus points concentrated near the lower bound where the CDF of
+        # short stays rises steeply
+        u = np.linspace(0, 1, 2 * n_knots)
+        x = lo + (hi - lo) * np.unique(np.concatenate([u, u ** 2]))
+        cdf = np.maximum.accumulate(np.nan_to_num(dist.cdf(x)))
+        logit_cdf = logit(np.clip(cdf, tail / 10, 1 - tail / 10))
+    logit_q = np.linspace(logit(tail), logit(1 - tail), n_knots)
+    return EmpiricalDist(np.interp(logit_q, logit_cdf, x), smooth=True, probs=expit(logit_q))
+
+
+def get_params(dist_name):
+    """Get the parameter names for a given distribution."""
+    # Inspired by the code for Fitter.get_best()
+    d = getattr(stats, dist_name)
+    return (d.shapes + ", loc, scale").split(", ") if d.shapes else ["loc", "scale"]
+
+
+def fit_params(name: str, los, guess: dict | None = None) -> dict:
+    """Fit the named distribution to the stays `los`, returning its parameter dict.
+
+    For the parametric families, `guess` is an optional parameter dict used as the starting
+    point of the maximum-likelihood fit."""
+    if name in EMPIRICAL_DISTS:
+        return empirical_params(los, smooth=name == EMPIRICAL_SMOOTH)
+    param_names = get_params(name)
+    if guess:
+        args = [guess[k] for k in param_names[:-2]]
+        kwds = {'loc': guess['loc'], 'scale': guess['scale']}
+    else:
+        args, kwds = [], {}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return dict(zip(param_names, getattr(stats, name).fit(los, *args, **kwds)))
+
+
+def _fit_family(name: str, los: np.ndarray, timeout: float) -> tuple[pd.DataFrame, dict]:
+    """Fit one named family to `los` with `Fitter`, returning its row of `Fitter.df_errors`
+    and its `Fitter.fitted_param` (empty if the fit failed or timed out)."""
+    # Imported here since fitter also loads matplotlib, which the CLI and the simulation
+    # worker processes importing this module do not need
+    from fitter import Fitter  # pylint: disable=import-outside-toplevel
+    f = Fitter(los, distributions=[name], timeout=timeout)
+    f.fit(max_workers=1)
+    return f.df_errors, f.fitted_param
+
+
+def fit_families(los, names: list[str], timeout: float = FIT_TIMEOUT,
+                 n_workers: int | None = None,
+                 progress: Callable[[int, int], None] | None = None) -> tuple[pd.DataFrame, dict]:
+    """Fit each of the named `scipy.stats` families to the stays `los` with `Fitter`, one family
+    per task in parallel, so that a slow family only holds up one worker.
+
+    Returns the combined `df_errors` of the families, indexed by name, and a dict of the fitted
+    parameters of those which could be fitted. If given, `progress(n_done, len(names))` is
+    called as each family finishes."""
+    los = np.asarray(los, dtype=float)
+    df_errors = []
+    fitted_param = {}
+    with ProcessPoolExecutor(n_workers or max_workers()) as executor:
+        futures = [executor.submit(_fit_family, name, los, timeout) for name in names]
+        for n_done, future in enumerate(as_completed(futures), 1):
+            errors, params = future.result()
+            df_errors.append(errors)
+            fitted_param.update(params)
+            if progress:
+                progress(n_done, len(names))
+    return pd.concat(df_errors).loc[list(names)], fitted_param
+
+
+def _bootstrap_once(name: str, los: np.ndarray, guess: dict | None,
+                    seed: np.random.SeedSequence) -> dict | None:
+    """Refit the named distribution to one resample of `los`. Returns None if the fit fails."""
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(los, size=len(los), replace=True)
+    try:
+        params = fit_params(name, sample, guess)
+    except Exception:
+        return None
+    if name not in EMPIRICAL_DISTS and not np.all(np.isfinite(list(params.values()))):
+        return None
+    return params
+
+
+def bootstrap(name: str, los, n_boot: int, guess: dict | None = None, seed=None,
+              n_workers: int | None = None,
+              progress: Callable[[int, int], None] | None = None) -> list[dict]:
+    """Refit the named distribution to `n_boot` resamples of the stays `los`, in parallel.
+
+    Each resample uses an independent random stream spawned from `seed`, so the results are
+    reproducible for a given seed regardless of the number of worker processes. Failed fits
+    are dropped, so fewer than `n_boot` parameter dicts may be returned.
+
+    If given, `progress(n_done, n_boot)` is called as each refit finishes."""
+    los = np.asarray(los, dtype=float)
+    seeds = np.random.SeedSequence(seed).spawn(n_boot)
+    results: list[dict | None] = [None] * n_boot
+    with ProcessPoolExecutor(n_workers or max_workers()) as executor:
+        futures = {
+            executor.submit(_bootstrap_once, name, los, guess, s): i
+            for i, s in enumerate(seeds)
+        }
+        for n_done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            if progress:
+                progress(n_done, n_boot)
+    return [r for r in results if r is not None]
+
+
+def bootstrap_summary(name: str, estimate: dict, param_sets: list[dict],
+                      level: float = 0.95) -> pd.DataFrame:
+    """Percentile bootstrap confidence intervals for the parameters and mean LoS of the named
+    distribution, given the point `estimate` and the bootstrap `param_sets`.
+
+    Empirical distributions have no parameters, so only the mean LoS is reported for them."""
+    alpha = (1 - level) / 2
+    rows = {}
+    if name not in EMPIRICAL_DISTS:
+        for k in estimate:
+            rows[k] = (estimate[k], [p[k] for p in param_sets])
+    rows['Mean LoS'] = (
+        make_dist(name, estimate).mean(),
+        [make_dist(name, p).mean() for p in param_sets]
+    )
+    return pd.DataFrame(
+        [
+            [k, est, *np.nanquantile(np.asarray(values, dtype=float), [alpha, 1 - alpha])]
+            if values else [k, est, np.nan, np.nan]
+            for k, (est, values) in rows.items()
+        ],
+        columns=['Quantity', 'Estimate', f'{alpha:.1%}', f'{1 - alpha:.1%}']
+    )
+
+
+def _cdf_row(name: str, params: dict, x: np.ndarray) -> np.ndarray:
+    """CDF of the named distribution at `x`, or NaNs if it cannot be evaluated."""
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return np.asarray(make_dist(name, params).cdf(x), dtype=float)
+    except Exception:
+        return np.full(len(x), np.nan)
+
+
+def invert_cdfs(x: np.ndarray, cdf: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """Quantiles at the probabilities `q` of each row of `cdf`, a non-decreasing CDF with values
+    in [0, 1] at the sorted points `x`, by linear interpolation. Quantiles outside `x` are NaN.
+
+    All rows are inverted by one search of the concatenated rows, each offset by twice its
+    index so that they are sorted as a whole."""
+    n_rows, n = cdf.shape
+    rows = np.arange(n_rows)[:, None]
+    j = np.searchsorted((cdf + 2 * rows).ravel(), (q + 2 * rows).ravel()).reshape(n_rows, -1)
+    j -= n * rows  # index of the first point with cdf >= q in each row
+    inside = (j > 0) & (j < n)
+    j = np.clip(j, 1, n - 1)
+    f0, f1 = cdf[rows, j - 1], cdf[rows, j]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ret = x[j - 1] + (x[j] - x[j - 1]) * np.where(f1 > f0, (q - f0) / (f1 - f0), 1)
+    return np.where(inside, ret, np.nan)
+
+
+def cdf_moments(x: np.ndarray, cdf: np.ndarray, tail: float = GOF_MOMENT_TAIL,
+                rtol: float = 0.01) -> tuple[np.ndarray, np.ndarray]:
+    """Mean and standard deviation of each row of `cdf` (as in `invert_cdfs`), with the
+    probability between consecutive points spread evenly between them.
+
+    They are NaN for rows with more than `tail` probability outside `x`, or whose standard
+    deviation changes by more than `rtol` (relative) if `x` is cut to a tenth of its range,
+    i.e. whose tails are too heavy for the moments to be found this way (or infinite)."""
+    def moments(x, cdf):
+        p = np.diff(cdf, axis=1)
+        a, b = x[:-1], x[1:]
+        mean = p @ ((a + b) / 2)
+        return mean, np.sqrt(np.maximum(p @ ((a * a + a * b + b * b) / 3) - mean ** 2, 0))
+
+    mean, std = moments(x, cdf)
+    inner = np.abs(x) <= np.abs(x).max() / 10
+    _, std_inner = moments(x[inner], cdf[:, inner])
+    valid = (cdf[:, 0] <= tail) & (cdf[:, -1] >= 1 - tail) \
+        & (np.abs(std_inner - std) <= rtol * std)
+    return np.where(valid, mean, np.nan), np.where(valid, std, np.nan)
+
+
+def goodness_of_fit(los, dists: dict[str, dict], n_grid: int = 100, n_qq: int = 100,
+                    n_workers: int | None = None) -> dict:
+    """Evaluate candidate distributions against the stays `los` for goodness-of-fit plots and
+    the table of candidates.
+
+    The CDF of each candidate in `dists` (a dict of names to parameter dicts) is evaluated once,
+    in parallel, on one shared grid spanning the data and extending far into both tails. All
+    other quantities are then computed from these CDFs at once, as arrays with one row per
+    candidate, so that plots for any candidate can later be drawn without further computation.
+    Returns a dict containing:
+
+    - `x`: the centres of `n_grid` histogram bins spanning the data;
+    - `hist`: the density histogram of the data in these bins;
+    - `pdf`, `cdf`: dicts of each candidate's mean density in each bin and CDF at its centre (no
+      density is given for empirical distributions);
+    - `ecdf`: the empirical CDF at the bin centres;
+    - `qq_data`: `n_qq` sample quantiles of the data, at evenly-spaced probabilities;
+    - `qq`: dict of each candidate's quantiles at the same probabilities, found by inverting
+      its CDF on the grid, since `ppf` is slow, and can fail, for distributions whose CDF is
+      computed numerically;
+    - `mean`, `std`: dicts of each candidate's mean and standard deviation, computed from its
+      CDF on the grid.
+
+    Values which cannot be computed, e.g. quantiles outside the grid, the moments of candidates
+    with heavy tails (see `cdf_moments`), or all values of a candidate whose CDF cannot be
+    evaluated, are None.
+    """
+    los = np.sort(np.asarray(los, dtype=float))
+    counts, edges = np.histogram(los, bins=n_grid, range=(0, max(los.max(), 1e-9)))
+    x = (edges[:-1] + edges[1:]) / 2
+    p = (np.arange(n_qq) + 0.5) / n_qq
+    qq_data = np.quantile(los, p)
+    tail = edges[-1] * np.geomspace(1 / GOF_TAIL_RANGE, GOF_TAIL_RANGE, GOF_TAIL_POINTS)
+    grid, inverse = np.unique(np.concatenate([edges, x, -tail, [0], tail]), return_inverse=True)
+    i_edges, i_x = inverse[:n_grid + 1], inverse[n_grid + 1:2 * n_grid + 1]
+
+    names = list(dists)
+    with ProcessPoolExecutor(n_workers or max_workers()) as executor:
+        cdf = np.array(list(executor.map(
+            _cdf_row, names, [dists[name] for name in names], repeat(grid)
+        ))).reshape(len(names), len(grid))
+    # Numerically computed CDFs can have missing or out-of-range values far into the tails
+    failed = ~np.isfinite(cdf).any(axis=1)
+    cdf = np.maximum.accumulate(np.clip(np.nan_to_num(cdf), 0, 1), axis=1)
+
+    pdf = np.diff(cdf[:, i_edges], axis=1) / np.diff(edges)
+    cdf_x = cdf[:, i_x]
+    qq = invert_cdfs(grid, cdf, p)
+    mean, std = cdf_moments(grid, cdf)
+    for a in (pdf, cdf_x, qq, mean, std):
+        a[failed] = np.nan
+
+    def to_list(a):
+        return [None if not np.isfinite(v) else float(f'{v:.5g}') for v in a]
+
+    def to_float(v):
+        return float(v) if np.isfinite(v) else None
+
+    return {
+        'x': to_list(x),
+        'hist': to_list(counts / (len(los) * (edges[1] - edges[0]))),
+        'pdf': {n: to_list(row) for n, row in zip(names, pdf) if n not in EMPIRICAL_DISTS},
+        'cdf': {n: to_list(row) for n, row in zip(names, cdf_x)},
+        'ecdf': to_list(np.searchsorted(los, x, side='right') / len(los)),
+        'qq_data': to_list(qq_data),
+        'qq': {n: to_list(row) for n, row in zip(names, qq)},
+        'mean': {n: to_float(v) for n, v in zip(names, mean)},
+        'std': {n: to_float(v) for n, v in zip(names, std)},
+    }
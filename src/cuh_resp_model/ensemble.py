@@ -0,0 +1,207 @@
+"""On-disk storage of large simulation ensembles.
+
+An ensemble is the daily bed occupancy of every replication of one or more scenarios, stored as
+a memory-mapped NumPy array of shape `(n_scenarios, n_reps, n_days, len(GROUPS))` in a `.npy`
+file, with a JSON sidecar file describing the scenarios. Worker processes write their
+replications directly into the file, and summaries are computed in chunks, so that memory use
+does not grow with the size of the ensemble.
+"""
+
+import json
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .simulation import (ENGINE_SALABIM, ENGINE_VECTORIZED, ENGINES, GROUPS, N_REPS, QUANTILES,
+                         child_seed, n_days, quantile_ci_width, quantile_summary, rep_params,
+                         simulate_once, simulate_vectorized, tabulate_dists)
+from .utils import max_workers
+
+STORE_DTYPE = np.float32
+"""Data type of the stored occupancy values, which are exact for counts below 2**24."""
+
+CHUNK_BYTES = 2**26
+"""Approximate size of the chunks of an ensemble read into memory at a time."""
+
+
+class EnsembleStore:
+    """A simulation ensemble on disk. Use `EnsembleStore.create` to create a new ensemble, and
+    `EnsembleStore(path)` to open an existing one; `mode` is passed to `np.load` as the
+    `mmap_mode`.
+
+    `meta` contains the scenario `names`, the `start` date and number of `days` of each
+    scenario (shorter scenarios are padded with zeros), and the `seeds` (entropy and spawn key)
+    used to simulate each scenario."""
+
+    def __init__(self, path, mode: str = 'r'):
+        self.path = Path(path)
+        with open(self.meta_path(self.path), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.data = np.load(self.path, mmap_mode=mode)
+
+    @staticmethod
+    def meta_path(path: Path) -> Path:
+        """Path of the sidecar file describing the ensemble at `path`."""
+        return path.with_name(path.name + '.json')
+
+    @classmethod
+    def create(cls, path, names: list[str], starts: list, days: list[int],
+               n_reps: int) -> 'EnsembleStore':
+        """Create an empty ensemble of `n_reps` replications of the named scenarios, with the
+        given start dates and numbers of days, overwriting any existing ensemble at `path`."""
+        path = Path(path)
+        shape = (len(names), n_reps, max(days), len(GROUPS))
+        data = np.lib.format.open_memmap(path, mode='w+', dtype=STORE_DTYPE, shape=shape)
+        del data  # The file is sparse until written to
+        meta = {
+            'names': list(names),
+            'start': [str(pd.Timestamp(start).date()) for start in starts],
+            'days': [int(d) for d in days],
+            'seeds': [None] * len(names)
+        }
+        with open(cls.meta_path(path), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        return cls(path, mode='r+')
+
+    @property
+    def n_reps(self) -> int:
+        """Number of replications of each scenario."""
+        return self.data.shape[1]
+
+    def index(self, scenario: int | str) -> int:
+        """Index of a scenario given by its index or name."""
+        return self.meta['names'].index(scenario) if isinstance(scenario, str) else scenario
+
+    def results(self, scenario: int | str) -> np.ndarray:
+        """Memory-mapped view of the results of a scenario, in the format returned by
+        `simulate`. Nothing is read from disk until the view is indexed."""
+        s = self.index(scenario)
+        return self.data[s, :, :self.meta['days'][s]]
+
+    def day_chunks(self, scenario: int | str, chunk_bytes: int = CHUNK_BYTES):
+        """Iterate over the results of a scenario in chunks of consecutive days, loaded in
+        memory, yielding the slice of days and an array of shape
+        `(n_reps, chunk_days, len(GROUPS))`."""
+        results = self.results(scenario)
+        step = max(1, chunk_bytes // (self.n_reps * len(GROUPS) * results.itemsize))
+        for d in range(0, results.shape[1], step):
+            days = slice(d, min(d + step, results.shape[1]))
+            yield days, np.asarray(results[:, days])
+
+    def quantiles(self, scenario: int | str, quantiles=QUANTILES,
+                  chunk_bytes: int = CHUNK_BYTES) -> np.ndarray:
+        """Quantiles of daily bed occupancy over the replications of a scenario, as an array of
+        shape `(len(quantiles), n_days, len(GROUPS))`, computed over chunks of days."""
+        results = self.results(scenario)
+        ret = np.empty((len(quantiles), *results.shape[1:]))
+        for days, chunk in self.day_chunks(scenario, chunk_bytes):
+            ret[:, days] = np.quantile(chunk, quantiles, axis=0)
+        return ret
+
+    def peaks(self, scenario: int | str, chunk_bytes: int = CHUNK_BYTES) -> np.ndarray:
+        """Peak daily occupancy of each replication of a scenario, as an array of shape
+        `(n_reps, len(GROUPS))`, computed over chunks of replications."""
+        results = self.results(scenario)
+        step = max(1, chunk_bytes // (results.shape[1] * len(GROUPS) * results.itemsize))
+        return np.concatenate([
+            results[r:r + step].max(axis=1) for r in range(0, self.n_reps, step)
+        ]).astype(float)
+
+    def summarise(self, scenario: int | str, quantiles=QUANTILES,
+                  chunk_bytes: int = CHUNK_BYTES) -> dict:
+        """Summary of a scenario in the format returned by `simulation.summarise`, computed
+        over chunks of days. The `results` are the memory-mapped view from `results`."""
+        s = self.index(scenario)
+        results = self.results(s)
+        q = np.empty((len(quantiles), *results.shape[1:]))
+        ci_width = 0.0
+        for days, chunk in self.day_chunks(s, chunk_bytes):
+            chunk = np.sort(chunk, axis=0)
+            q[:, days] = np.quantile(chunk, quantiles, axis=0)
+            ci_width = max(ci_width,
+                           float(quantile_ci_width(chunk, quantiles, is_sorted=True).max()))
+        return quantile_summary(results, q, self.meta['start'][s], quantiles, ci_width)
+
+
+def _simulate_into(path: Path, s: int, reps: range, scenario: dict, engine: str,
+                   seed: np.random.SeedSequence, crn: bool) -> int:
+    """Simulate replications `reps` of a scenario and write them into scenario `s` of the
+    ensemble at `path`. Returns the number of replications simulated."""
+    if engine == ENGINE_VECTORIZED:
+        results = simulate_vectorized(**scenario, n_reps=len(reps), seed=seed,
+                                      first_rep=reps.start, crn=crn)
+    else:
+        i = reps.start
+        results = simulate_once(
+            scenario['df_arr'], scenario['until'],
+            rep_params(scenario['patient_params'], scenario['dist_samples'], i),
+            seed=seed, crn_rep=i if crn else None
+        )[None]
+    data = np.load(path, mmap_mode='r+')
+    data[s, reps.start:reps.stop, :results.shape[1]] = results
+    data.flush()
+    return len(reps)
+
+
+def simulate_ensemble(
+        path,
+        scenarios: dict[str, dict],
+        n_reps: int = N_REPS,
+        seed=None,
+        n_workers: int | None = None,
+        progress: Callable[[int, int], None] | None = None,
+        engine: str = ENGINE_SALABIM,
+        batch_size: int = N_REPS,
+        crn: bool = False
+) -> EnsembleStore:
+    """Simulate `n_reps` replications of each of the named `scenarios` (dicts of keyword
+    arguments from `scenario_from_config`) into a new `EnsembleStore` at `path`.
+
+    Tasks are run in parallel in `n_workers` processes, each writing its results directly into
+    the store: one replication per task with the salabim engine, or `batch_size` replications
+    per task with the vectorized engine. Scenario `s` uses the `s`-th child of `seed`, giving
+    the same results as `simulate` with that seed; if `crn` is True, all scenarios use `seed`
+    itself, with common random numbers (see `simulate`).
+
+    If given, `progress(n_done, n_total)` is called as replications finish."""
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown simulation engine: {engine}')
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+
+    store = EnsembleStore.create(
+        path, list(scenarios), [sc['df_arr'].date[0] for sc in scenarios.values()],
+        [n_days(sc['df_arr'], sc['until']) for sc in scenarios.values()], n_reps
+    )
+    step = batch_size if engine == ENGINE_VECTORIZED else 1
+    tasks = []
+    for s, scenario in enumerate(scenarios.values()):
+        scenario_seed = seed if crn else child_seed(seed, s)
+        store.meta['seeds'][s] = [str(scenario_seed.entropy), list(scenario_seed.spawn_key)]
+        scenario = {'dist_samples': None} | scenario
+        if crn:
+            scenario['patient_params'], scenario['dist_samples'] = tabulate_dists(
+                scenario['patient_params'], scenario['dist_samples'], n_reps
+            )
+        for r in range(0, n_reps, step):
+            # Vectorized tasks choose each replication's stream from the scenario seed
+            task_seed = scenario_seed if crn or engine == ENGINE_VECTORIZED \
+                else child_seed(scenario_seed, r)
+            tasks.append((s, range(r, min(r + step, n_reps)), scenario, task_seed))
+    with open(store.meta_path(store.path), 'w', encoding='utf-8') as f:
+        json.dump(store.meta, f)
+
+    n_done, n_total = 0, n_reps * len(scenarios)
+    with ProcessPoolExecutor(n_workers or max_workers()) as executor:
+        futures = [
+            executor.submit(_simulate_into, store.path, s, reps, scenario, engine, task_seed, crn)
+            for s, reps, scenario, task_seed in tasks
+        ]
+        for future in as_completed(futures):
+            n_done += future.result()
+            if progress:
+                progress(n_done, n_total)
+    return EnsembleStore(store.path)
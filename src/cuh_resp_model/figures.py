@@ -0,0 +1,248 @@
+"""Helper functions for building Plotly figures on the server side.
+
+Trace data is sent to the browser as typed arrays (base64-encoded binary data, see
+`typed_array`), and evenly spaced x coordinates, e.g. daily dates, as a start and step, which
+are much smaller than JSON lists of numbers or date strings and faster to encode and decode.
+
+Time series are drawn with WebGL traces (see `scatter`). Series longer than `MAX_POINTS` are
+downsampled to the minimum and maximum of each bucket of points (see `downsample`), and can be
+redrawn at a higher resolution for the visible range when the chart is zoomed (see `x_range`).
+"""
+
+import base64
+
+import numpy as np
+import pandas as pd
+from plotly import graph_objects as go
+from scipy.ndimage import gaussian_filter1d
+
+DAY_MS = 24 * 60 * 60 * 1000
+"""Length of a day in milliseconds, the unit of numeric values on a date axis."""
+
+TYPED_ARRAY_DTYPES = {
+    'int8': 'i1', 'uint8': 'u1', 'int16': 'i2', 'uint16': 'u2', 'int32': 'i4', 'uint32': 'u4',
+    'float32': 'f4', 'float64': 'f8'
+}
+"""Plotly.js names of the NumPy data types which can be sent as typed arrays."""
+
+MAX_POINTS = 2000
+"""Maximum number of points per trace of a time-series chart, about two per pixel of a
+1000-pixel-wide graph. Longer series are downsampled by `downsample`."""
+
+VIOLIN_GRID_SIZE = 256
+"""Number of points on the density curve of a violin plot."""
+
+VIOLIN_MAX_POINTS = 500
+"""Maximum number of individual data points drawn on a violin plot."""
+
+VIOLIN_YAXIS = {
+    'tickvals': [0],
+    'ticktext': ['LoS [days]'],
+    'range': [-0.6, 0.6],
+    'zeroline': False,
+    'showgrid': False
+}
+"""Y-axis settings for figures containing the traces from `violin_traces`."""
+
+
+def typed_array(values, dtype=np.float32) -> dict:
+    """Plotly.js typed array spec of `values` converted to `dtype`, for use as trace data.
+
+    The default `float32` is exact for bed counts and LoS values in days to well below the
+    resolution of any plot, and takes half the space of `float64`. Arrays with more than one
+    dimension, e.g. `customdata`, are sent with their shape."""
+    a = np.ascontiguousarray(values, dtype=dtype)
+    spec = {'dtype': TYPED_ARRAY_DTYPES[a.dtype.name], 'bdata': base64.b64encode(a).decode()}
+    if a.ndim > 1:
+        spec['shape'] = ','.join(map(str, a.shape))
+    return spec
+
+
+def x_coords(x) -> dict:
+    """Trace keyword arguments for the x coordinates `x`: `x0` and `dx` if they are evenly
+    spaced, otherwise a typed array. Dates are given by the first date and a step in
+    milliseconds, or as milliseconds since the epoch, which a date axis accepts."""
+    if isinstance(x, pd.DatetimeIndex) or pd.api.types.is_datetime64_any_dtype(x):
+        x = pd.DatetimeIndex(x)
+        values = x.as_unit('ms').asi8.astype(float)
+        steps = np.diff(values)
+        if len(x) == 1 or (steps.size > 0 and (steps == steps[0]).all()):
+            return {'x0': x[0].isoformat(), 'dx': steps[0] if steps.size > 0 else DAY_MS}
+        return {'x': typed_array(values, np.float64)}
+    values = np.asarray(x, dtype=float)
+    steps = np.diff(values)
+    if steps.size > 0 and (steps == steps[0]).all():
+        return {'x0': values[0], 'dx': steps[0]}
+    return {'x': typed_array(values, np.float64)}
+
+
+def scatter(x, y, **kwargs) -> go.Scattergl:
+    """WebGL scatter trace of the values `y` at `x`, in the compact form given by `x_coords`
+    and `typed_array`. Other keyword arguments are passed to `go.Scattergl`."""
+    return go.Scattergl(**x_coords(x), y=typed_array(y), **kwargs)
+
+
+def band_traces(x, lower, upper, name: str, fillcolor: str, **kwargs) -> list[go.Scattergl]:
+    """Two `scatter` traces, the second filled down to the first, shading the band between
+    `lower` and `upper`. Unlike a single closed trace with `fill='toself'`, the x coordinates
+    are not reversed, so that dates can be sent as a start and step."""
+    line = {'color': 'rgba(255,255,255,0)'}
+    return [
+        scatter(x, lower, name=name, line=line, legendgroup=name, showlegend=False, **kwargs),
+        scatter(x, upper, name=name, line=line, legendgroup=name, fill='tonexty',
+                fillcolor=fillcolor, **kwargs)
+    ]
+
+
+def x_range(relayout_data: dict | None) -> tuple | None:
+    """The x-axis range set by zooming or panning a graph, from its `relayoutData`: a pair of
+    bounds, `(None, None)` if the axis was reset to autorange, or None if the event did not
+    change the x-axis."""
+    if not relayout_data:
+        return None
+    if relayout_data.get('xaxis.autorange'):
+        return None, None
+    if 'xaxis.range' in relayout_data:
+        return tuple(relayout_data['xaxis.range'])
+    if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        return relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    return None
+
+
+def downsample(x, ys: dict, bounds: tuple = (None, None),
+               max_points: int = MAX_POINTS) -> tuple:
+    """Subset of the series `ys`, a dict of arrays sharing the sorted x coordinates `x`, for
+    drawing a chart whose x-axis spans `bounds` (either of which may be None).
+
+    The points within the bounds, and one either side so that lines reach the edges of the
+    plot, are all kept if there are at most `max_points`. Otherwise, they are split into
+    buckets of consecutive points, and the points with the smallest and largest value of each
+    series in each bucket are kept, so that peaks and troughs are drawn at any zoom level.
+    Returns the x coordinates and a dict of the y values of the points kept."""
+    is_date = isinstance(x, pd.DatetimeIndex) or pd.api.types.is_datetime64_any_dtype(x)
+    x = pd.DatetimeIndex(x) if is_date else np.asarray(x, dtype=float)
+    convert = pd.Timestamp if is_date else float
+    lo, hi = bounds
+    start = 0 if lo is None else max(int(x.searchsorted(convert(lo), 'right')) - 1, 0)
+    stop = len(x) if hi is None else min(int(x.searchsorted(convert(hi), 'left')) + 1, len(x))
+    ys = {name: np.asarray(y, dtype=float) for name, y in ys.items()}
+    idx = np.arange(start, max(start, stop))
+    if len(idx) > max_points:
+        values = np.column_stack([y[start:stop] for y in ys.values()])
+        idx = start + minmax_indices(values, max(max_points // (2 * values.shape[1]), 1))
+    return x[idx], {name: y[idx] for name, y in ys.items()}
+
+
+def minmax_indices(values: np.ndarray, n_buckets: int) -> np.ndarray:
+    """Sorted indices of the rows of `values` (one column per series) holding the minimum and
+    maximum of each column in each of `n_buckets` buckets of consecutive rows, and of the first
+    and last rows. NaN values are ignored."""
+    n = len(values)
+    edges = np.linspace(0, n, n_buckets + 1).astype(int)
+    # Pad the buckets to the same length, so that they are reduced in one operation
+    pos = edges[:-1, None] + np.arange(np.diff(edges).max())  # (n_buckets, width)
+    padded = values[np.minimum(pos, n - 1)]  # (n_buckets, width, n_series)
+    valid = (pos < edges[1:, None])[:, :, None] & ~np.isnan(padded)
+    lo = np.where(valid, padded, np.inf).argmin(axis=1)
+    hi = np.where(valid, padded, -np.inf).argmax(axis=1)
+    idx = edges[:-1, None] + np.concatenate([lo, hi], axis=1)
+    return np.unique(np.concatenate([[0, n - 1], idx.ravel()]))
+
+
+def violin_traces(x, n_grid: int = VIOLIN_GRID_SIZE, max_points: int = VIOLIN_MAX_POINTS,
+                  seed: int = 0) -> list[go.Scatter | go.Box]:
+    """Build a horizontal violin plot of the values `x`, centred on y=0.
+
+    Unlike `go.Violin`, the kernel density estimate and box statistics are computed here rather
+    than in the browser, so only a fixed-size density curve, five box statistics, and a
+    stratified subsample of at most `max_points` points are sent to the client.
+    """
+    x = np.sort(np.asarray(x, dtype=float))
+    x = x[np.isfinite(x)]
+    if len(x) == 0:
+        return []
+
+    grid, density = kde(x, n_grid)
+    half_width = 0.45 * density / density.max() if density.max() > 0 else density
+
+    q1, median, q3 = np.quantile(x, [0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    lower_fence = x[x >= q1 - 1.5 * iqr][0]
+    upper_fence = x[x <= q3 + 1.5 * iqr][-1]
+    mean = x.mean()
+    mean_half_width = np.interp(mean, grid, half_width)
+
+    points = stratified_subsample(x, max_points, seed)
+    rng = np.random.default_rng(seed)
+    points_y = rng.uniform(-1, 1, len(points)) * np.interp(points, grid, half_width)
+
+    return [
+        go.Scatter(
+            x=typed_array(np.concatenate([grid, grid[::-1]])),
+            y=typed_array(np.concatenate([half_width, -half_width[::-1]])),
+            fill='toself',
+            fillcolor='rgba(99,110,250,0.5)',
+            line={'color': '#636efa', 'width': 1},
+            hoverinfo='skip',
+            showlegend=False
+        ),
+        go.Scatter(
+            x=typed_array(points),
+            y=typed_array(points_y),
+            mode='markers',
+            marker={'size': 2, 'opacity': 0.5, 'color': '#444'},
+            hoverinfo='skip',
+            showlegend=False
+        ),
+        go.Box(
+            q1=[q1], median=[median], q3=[q3],
+            lowerfence=[lower_fence], upperfence=[upper_fence],
+            y=[0],
+            orientation='h',
+            width=0.1,
+            fillcolor='#aa55aa',
+            line_color='#aa00aa',
+            hoverinfo='skip',
+            showlegend=False
+        ),
+        go.Scatter(
+            x=[mean, mean],
+            y=[-mean_half_width, mean_half_width],
+            mode='lines',
+            line={'color': 'red'},
+            hoverinfo='skip',
+            showlegend=False
+        )
+    ]
+
+
+def kde(x: np.ndarray, n_grid: int) -> tuple[np.ndarray, np.ndarray]:
+    """Gaussian kernel density estimate of `x` on `n_grid` evenly-spaced points spanning the
+    data range, using Scott's rule for the bandwidth.
+
+    The data is binned onto the grid first, so the cost is linear in `len(x)` rather than
+    proportional to `len(x) * n_grid`.
+    """
+    lo, hi = x.min(), x.max()
+    if hi <= lo:
+        return np.array([lo, hi]), np.ones(2)
+    counts, edges = np.histogram(x, bins=n_grid, range=(lo, hi))
+    grid = (edges[:-1] + edges[1:]) / 2
+    bandwidth = x.std() * len(x) ** (-1 / 5) if len(x) > 1 else 0
+    sigma = bandwidth / (edges[1] - edges[0])
+    density = gaussian_filter1d(counts.astype(float), sigma, mode='constant') if sigma > 0 \
+        else counts.astype(float)
+    return grid, density / (len(x) * (edges[1] - edges[0]))
+
+
+def stratified_subsample(x: np.ndarray, max_points: int, seed: int = 0) -> np.ndarray:
+    """Sample at most `max_points` values from the sorted array `x`, one from each of
+    `max_points` equal-count strata, so that the subsample follows the shape of the data.
+    The minimum and maximum values are always kept."""
+    if len(x) <= max_points:
+        return x
+    rng = np.random.default_rng(seed)
+    edges = np.linspace(0, len(x), max_points + 1).astype(int)
+    idx = edges[:-1] + (rng.random(max_points) * np.diff(edges)).astype(int)
+    idx[0], idx[-1] = 0, len(x) - 1
+    return x[idx]
@@ -27,5 +27,8 @@ def layout():
             yield step3.stepper_step()
             yield step4.stepper_step()
         yield dcc.Store(id=ID_STORE_APPDATA)
+        yield dcc.Store(id=ID_STORE_LOS_DATA)
+        yield dcc.Store(id=ID_STORE_STEP_2)
+        yield dcc.Store(id=ID_STORE_STEP_3)
     return ret
 # endregion
@@ -0,0 +1,292 @@
+"""Sensitivity of the bed occupancy forecasts to the scenario and LoS assumptions.
+
+The scenario in the app data (or a downloaded config file) is perturbed by varying the
+`PARAMETERS`: the date, height and width of the arrival curve, the share of senior patients, and
+a factor scaling all LoS values. Each parameter set is evaluated by the vectorized simulation
+engine, and summarised by the `OUTPUTS`: the mean peak total occupancy, and the mean number of
+days on which total occupancy exceeds a threshold. Parameter sets are evaluated in batches in
+parallel worker processes.
+
+`tornado` varies one parameter at a time between the ends of its range, and `sobol_indices`
+estimates global (variance-based) sensitivity indices over all parameters at once. This module
+has no dependency on the Dash app.
+"""
+
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from scipy.stats import qmc
+
+from .arrivals import norm_curve2
+from .distributions import tabulate_ppf
+from .simulation import AGE_BANDS, N_REPS, scenario_from_config, simulate_vectorized
+from .utils import max_workers
+
+PARAMETERS = {
+    'peak_shift': 'Peak date shift [days]',
+    'peak': 'Peak daily arrivals',
+    'x_scale': 'Horizontal scale [days]',
+    'senior_share': 'Share of patients aged 65+',
+    'los_scale': 'LoS scale factor',
+}
+"""Parameters varied in the sensitivity analysis, with their display names."""
+
+OUTPUTS = ('peak occupancy', 'days above threshold')
+"""Summaries of total bed occupancy whose sensitivity is reported."""
+
+THRESHOLD_FRACTION = 0.8
+"""Default occupancy threshold, as a fraction of the peak occupancy of the baseline scenario."""
+
+BATCH_SIZE = 16
+"""Number of parameter sets evaluated per worker task."""
+
+
+def baseline(config: dict) -> dict:
+    """Inputs for evaluating perturbations of the scenario in `config`, including the baseline
+    value of each of the `PARAMETERS`. The LoS distributions are tabulated (see
+    `tabulate_ppf`) so that they can be rescaled; bootstrapped LoS distributions are not used,
+    since LoS uncertainty is represented by `los_scale`."""
+    scenario = scenario_from_config(config)
+    step_2 = config['step_2']
+    peak_date = pd.Timestamp(step_2['peak_date'])
+    age_dist = scenario['patient_params']['age_dist']
+    return {
+        'dates': pd.to_datetime(scenario['df_arr'].date),
+        't': (pd.to_datetime(scenario['df_arr'].date) - peak_date) / pd.Timedelta(days=1),
+        'until': scenario['until'],
+        'min': float(step_2['min_value']),
+        'paeds_share': float(age_dist['paeds']),
+        'dists': {
+            band: tabulate_ppf(scenario['patient_params'][f'dist_{band}'])
+            for band in AGE_BANDS
+        },
+        'values': {
+            'peak_shift': 0.0,
+            'peak': float(step_2['peak_value']),
+            'x_scale': float(step_2['x_scale']),
+            'senior_share': float(age_dist['senior']),
+            'los_scale': 1.0,
+        }
+    }
+
+
+def default_ranges(base: dict) -> dict[str, tuple[float, float]]:
+    """Default range of each of the `PARAMETERS` around its baseline value: two weeks either
+    side for the peak date, 25% either side for the peak and horizontal scale, 10 percentage
+    points either side for the senior share, and 20% shorter or 25% longer stays."""
+    values = base['values']
+    max_senior = 1 - base['paeds_share']
+    return {
+        'peak_shift': (-14.0, 14.0),
+        'peak': (0.75 * values['peak'], 1.25 * values['peak']),
+        'x_scale': (0.75 * values['x_scale'], 1.25 * values['x_scale']),
+        'senior_share': (max(values['senior_share'] - 0.1, 0.0),
+                         min(values['senior_share'] + 0.1, max_senior)),
+        'los_scale': (0.8, 1.25),
+    }
+
+
+def evaluate(base: dict, params: np.ndarray, threshold: float, n_reps: int = N_REPS,
+             seed=None) -> np.ndarray:
+    """Evaluate the `OUTPUTS` for each row of `params`, an array with one column per item of
+    `PARAMETERS`, returning an array of shape `(len(params), len(OUTPUTS))`.
+
+    Each row is simulated for `n_reps` replications with the same `seed`, so that differences
+    between rows are less affected by sampling noise."""
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    ret = np.empty((len(params), len(OUTPUTS)))
+    for i, (peak_shift, peak, x_scale, senior_share, los_scale) in enumerate(params):
+        df_arr = pd.DataFrame({
+            'date': base['dates'],
+            'n_arr': np.maximum(norm_curve2(base['t'] - peak_shift, x_scale, peak, base['min']),
+                                0)
+        })
+        patient_params = {
+            f'dist_{band}': dist.scaled(los_scale)
+            for band, dist in base['dists'].items()
+        } | {
+            'age_dist': {
+                'paeds': base['paeds_share'],
+                'adult': 1 - base['paeds_share'] - senior_share,
+                'senior': senior_share
+            }
+        }
+        total = simulate_vectorized(df_arr, base['until'], patient_params, n_reps=n_reps,
+                                    seed=seed)[:, :, 0]
+        ret[i] = total.max(axis=1).mean(), (total > threshold).sum(axis=1).mean()
+    return ret
+
+
+def evaluate_parallel(base: dict, params: np.ndarray, threshold: float, n_reps: int = N_REPS,
+                      seed=None, n_workers: int | None = None,
+                      progress: Callable[[int, int], None] | None = None) -> np.ndarray:
+    """`evaluate` in batches of `BATCH_SIZE` rows, in parallel in `n_workers` processes. If
+    given, `progress(n_done, n_total)` is called as each batch finishes."""
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    ret = np.empty((len(params), len(OUTPUTS)))
+    with ProcessPoolExecutor(n_workers or max_workers()) as executor:
+        futures = {
+            executor.submit(evaluate, base, params[i:i + BATCH_SIZE], threshold, n_reps, seed): i
+            for i in range(0, len(params), BATCH_SIZE)
+        }
+        n_done = 0
+        for future in as_completed(futures):
+            i = futures[future]
+            result = future.result()
+            ret[i:i + len(result)] = result
+            n_done += len(result)
+            if progress:
+                progress(n_done, len(params))
+    return ret
+
+
+def default_threshold(base: dict, n_reps: int = N_REPS, seed=None) -> float:
+    """`THRESHOLD_FRACTION` of the mean peak occupancy of the baseline scenario."""
+    params = np.array([list(base['values'].values())])
+    return round(THRESHOLD_FRACTION * evaluate(base, params, np.inf, n_reps, seed)[0, 0])
+
+
+def tornado(
+        config: dict,
+        threshold: float | None = None,
+        ranges: dict[str, tuple[float, float]] | None = None,
+        n_reps: int = 200,
+        seed=None,
+        n_workers: int | None = None,
+        progress: Callable[[int, int], None] | None = None
+) -> pd.DataFrame:
+    """One-at-a-time sensitivity analysis of the scenario in `config`, for a tornado chart.
+
+    Each parameter is set to each end of its range (by default, `default_ranges`) with the
+    others at their baseline values. Returns a DataFrame indexed by output and parameter, with
+    the `low` and `high` parameter values, the outputs at the `baseline` and at the low and high
+    values (`at low`, `at high`), and the `swing` between them, sorted by decreasing swing for
+    each output. `threshold` defaults to `default_threshold`, and is stored in the `attrs` of
+    the DataFrame."""
+    base = baseline(config)
+    ranges = default_ranges(base) | (ranges or {})
+    if threshold is None:
+        threshold = default_threshold(base, n_reps, seed)
+
+    values = np.array(list(base['values'].values()))
+    params = [values]
+    for j, name in enumerate(PARAMETERS):
+        for end in ranges[name]:
+            row = values.copy()
+            row[j] = end
+            params.append(row)
+    outputs = evaluate_parallel(base, np.array(params), threshold, n_reps, seed, n_workers,
+                                progress)
+
+    rows = []
+    for k, output in enumerate(OUTPUTS):
+        for j, name in enumerate(PARAMETERS):
+            at_low, at_high = outputs[1 + 2 * j, k], outputs[2 + 2 * j, k]
+            rows.append({
+                'output': output,
+                'parameter': name,
+                'low': ranges[name][0],
+                'high': ranges[name][1],
+                'baseline': outputs[0, k],
+                'at low': at_low,
+                'at high': at_high,
+                'swing': abs(at_high - at_low)
+            })
+    df = pd.DataFrame(rows).sort_values(['output', 'swing'], ascending=[True, False]) \
+        .set_index(['output', 'parameter'])
+    df.attrs['threshold'] = threshold
+    return df
+
+
+def sobol_indices(
+        config: dict,
+        threshold: float | None = None,
+        ranges: dict[str, tuple[float, float]] | None = None,
+        n_base: int = 256,
+        n_reps: int = 10,
+        n_boot: int = 200,
+        seed=None,
+        n_workers: int | None = None,
+        progress: Callable[[int, int], None] | None = None
+) -> pd.DataFrame:
+    """Variance-based global sensitivity analysis of the scenario in `config`, with all
+    parameters uniformly distributed over their ranges (by default, `default_ranges`).
+
+    Uses Saltelli's sampling scheme from a scrambled Sobol sequence, with `n_base` base samples
+    (a power of 2), i.e. `n_base * (len(PARAMETERS) + 2)` parameter sets, each simulated for
+    `n_reps` replications. Returns a DataFrame indexed by output and parameter with the
+    first-order index `S1` (Saltelli 2010) and total-order index `ST` (Jansen 1999) of each
+    parameter, and their 95% bootstrap confidence intervals from `n_boot` resamples.
+    `threshold` defaults to `default_threshold`, and is stored in the `attrs` of the
+    DataFrame."""
+    base = baseline(config)
+    ranges = default_ranges(base) | (ranges or {})
+    if threshold is None:
+        threshold = default_threshold(base, n_reps * 10, seed)
+
+    k = len(PARAMETERS)
+    lower, upper = np.array([ranges[name] for name in PARAMETERS]).T
+    a, b, ab = saltelli_sample(lower, upper, n_base, seed)
+
+    outputs = evaluate_parallel(base, np.concatenate([a, b, *ab]), threshold, n_reps, seed,
+                                n_workers, progress)
+    f_a = outputs[:n_base]
+    f_b = outputs[n_base:2 * n_base]
+    f_ab = outputs[2 * n_base:].reshape(k, n_base, len(OUTPUTS))
+
+    s1, st = sobol_estimates(f_a, f_b, f_ab)
+    rng = np.random.default_rng(seed)
+    boot = []
+    for _ in range(n_boot):
+        rows = rng.integers(0, n_base, n_base)
+        boot.append(sobol_estimates(f_a[rows], f_b[rows], f_ab[:, rows]))
+    s1_lo, s1_hi = np.nanquantile([s for s, _ in boot], [0.025, 0.975], axis=0)
+    st_lo, st_hi = np.nanquantile([s for _, s in boot], [0.025, 0.975], axis=0)
+
+    df = pd.DataFrame([
+        {
+            'output': output,
+            'parameter': name,
+            'S1': s1[j, m], 'S1 2.5%': s1_lo[j, m], 'S1 97.5%': s1_hi[j, m],
+            'ST': st[j, m], 'ST 2.5%': st_lo[j, m], 'ST 97.5%': st_hi[j, m],
+        }
+        for m, output in enumerate(OUTPUTS)
+        for j, name in enumerate(PARAMETERS)
+    ]).set_index(['output', 'parameter'])
+    df.attrs['threshold'] = threshold
+    return df
+
+
+def saltelli_sample(lower: np.ndarray, upper: np.ndarray, n_base: int,
+                    seed=None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Saltelli's sampling scheme for parameters uniformly distributed between `lower` and
+    `upper`, from a scrambled Sobol sequence: the base samples `A` and `B`, each of shape
+    `(n_base, k)`, and `AB` of shape `(k, n_base, k)`, where `AB[j]` is `A` with column `j`
+    from `B`."""
+    k = len(lower)
+    sample = qmc.Sobol(2 * k, seed=np.random.default_rng(seed)).random(n_base)
+    a = qmc.scale(sample[:, :k], lower, upper)
+    b = qmc.scale(sample[:, k:], lower, upper)
+    ab = np.repeat(a[None], k, axis=0)
+    for j in range(k):
+        ab[j, :, j] = b[:, j]
+    return a, b, ab
+
+
+def sobol_estimates(f_a: np.ndarray, f_b: np.ndarray,
+                    f_ab: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """First-order (Saltelli 2010) and total-order (Jansen 1999) Sobol indices, each of shape
+    `(k, n_outputs)`, from the outputs at the samples of `saltelli_sample`: `f_a` and `f_b` of
+    shape `(n_base, n_outputs)`, and `f_ab` of shape `(k, n_base, n_outputs)`. Outputs with no
+    variance have NaN indices."""
+    f = np.concatenate([f_a, f_b])
+    var = np.var(f, axis=0)
+    var = np.where(var > 0, var, np.nan)
+    # Centring the outputs reduces the variance of the first-order estimator
+    s1 = np.mean((f_b - f.mean(axis=0)) * (f_ab - f_a), axis=1) / var
+    st = 0.5 * np.mean((f_a - f_ab) ** 2, axis=1) / var
+    return s1, st
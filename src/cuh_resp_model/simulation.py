@@ -0,0 +1,691 @@
+"""The respiratory disease model simulation, run in Step 4.
+
+This module has no dependency on the Dash app, so it can be used from worker processes.
+"""
+
+import hashlib
+import json
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import salabim as sim
+from scipy import stats
+
+from .distributions import make_dist, tabulate_ppf
+from .utils import max_workers
+
+N_REPS = 30
+"""Default number of simulation replications."""
+
+JITTER = 0.05
+"""Relative standard deviation of the daily number of arrivals around the Step 2 curve."""
+
+SAMPLE_BLOCK_SIZE = 1024
+"""Number of LoS values drawn at a time for each age band in the salabim engine."""
+
+SEED_BLOCK_SIZE = N_REPS
+"""Number of replications sampled together from each random stream by the vectorized engine
+(see `vectorized_patients`)."""
+
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+"""Quantiles of daily bed occupancy shown in the Step 4 forecasts."""
+
+GROUPS = ('total', 'adult', 'paeds')
+"""Bed groups, in the order of the last axis of the simulation results."""
+
+AGE_BANDS = ('paeds', 'adult', 'senior')
+"""Patient age bands, each with its own LoS distribution."""
+
+ENGINE_SALABIM = 'salabim'
+ENGINE_VECTORIZED = 'vectorized'
+ENGINES = {
+    ENGINE_SALABIM: 'Discrete-event (salabim)',
+    ENGINE_VECTORIZED: 'Vectorized (M/G/\u221e)',
+}
+"""Simulation engines accepted by `simulate`, with their display names.
+
+Both engines implement the same model. Since bed capacity is unlimited, occupancy at any time
+is just the number of stays in progress, which the vectorized engine computes directly from
+arrays of arrival times and LoS values rather than by stepping through a discrete-event
+simulation. See `capacity` for a limited number of beds."""
+
+
+def scenario_from_config(config: dict) -> dict:
+    """Get the simulation inputs from the app data (or a downloaded config file) as keyword
+    arguments for `simulate`."""
+    df_arr = pd.DataFrame({
+        'date': config['step_2']['xs'],
+        'n_arr': config['step_2']['ys']
+    })
+
+    # Get the simulation end, i.e. midnight one day after the last day in `df_arr`
+    until = pd.Timestamp(list(df_arr.date)[-1]) + pd.Timedelta(days=1)
+
+    def get_dist(group: str):
+        n = config['step_3']['selected_dists'][group]
+        params = config['step_3']['dists'][group][n]
+        return make_dist(n, params)
+
+    patient_params = {
+        'dist_paeds': get_dist('paeds'),
+        'dist_adult': get_dist('adult'),
+        'dist_senior': get_dist('senior'),
+        'age_dist': config['step_3']['age_dist']
+    }
+
+    # LoS parameter sets from the Step 3 bootstrap, if any
+    dist_samples = {
+        f'dist_{group}': [make_dist(b['dist'], params) for params in b['params']]
+        for group, b in config['step_3'].get('bootstrap', {}).items()
+        if b['params']
+    }
+
+    return {
+        'df_arr': df_arr,
+        'until': until,
+        'patient_params': patient_params,
+        'dist_samples': dist_samples
+    }
+
+
+def scenario_key(config: dict, **options) -> str:
+    """Key identifying the results of simulating the scenario in the app data (or a downloaded
+    config file) with the keyword arguments `options` to `simulate`, e.g. the engine, number
+    of replications and seed.
+
+    The key is a SHA-256 hash of the canonical JSON of all inputs to the simulation."""
+    step_3 = config['step_3']
+    inputs = {
+        'arrivals': [config['step_2']['xs'], config['step_2']['ys']],
+        'los': {
+            group: [name, step_3['dists'][group][name]]
+            for group, name in step_3['selected_dists'].items()
+        },
+        'bootstrap': step_3.get('bootstrap', {}),
+        'age_dist': step_3['age_dist'],
+        'jitter': JITTER,
+        'options': options
+    }
+    canonical = json.dumps(inputs, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def simulate(
+        df_arr: pd.DataFrame,
+        until: pd.Timestamp,
+        patient_params: dict,
+        dist_samples: dict[str, list] | None = None,
+        n_reps: int = N_REPS,
+        seed=None,
+        n_workers: int | None = None,
+        progress: Callable[[int, int], None] | None = None,
+        engine: str = ENGINE_SALABIM,
+        tolerance: float | None = None,
+        batch_size: int = N_REPS,
+        on_batch: Callable[[np.ndarray], None] | None = None,
+        crn: bool = False
+) -> np.ndarray:
+    """Run the simulation multiple times, using one of the `ENGINES`.
+
+    Returns an array of shape `(n_reps, n_days, len(GROUPS))` containing the maximum bed
+    occupancy of each bed group on each day of each replication. Use `results_to_frames` to
+    convert this to labelled DataFrames.
+
+    `dist_samples` optionally maps some of the LoS distribution keys of `patient_params`
+    (e.g. `'dist_paeds'`) to lists of alternative distributions, e.g. from a bootstrap, to
+    carry parameter uncertainty into the results. Replication `i` uses item `i` of each list
+    (cycling if the list is shorter than the number of replications).
+
+    Replication `i` uses the `i`-th child of `seed` (see `child_seed`) as its random stream, or
+    with the vectorized engine shares the stream of its block of `SEED_BLOCK_SIZE`
+    replications, so the results are reproducible for a given seed regardless of the number of
+    worker processes, the batches the replications are run in, or when a `tolerance` stops
+    them. The salabim engine runs replications in parallel in `n_workers` processes; the
+    vectorized engine runs them all at once in the calling process.
+
+    If `tolerance` is given, replications are run in batches of `batch_size`, stopping once the
+    confidence intervals of all `QUANTILES` on every day and for every bed group are narrower
+    than `tolerance` beds (see `quantile_ci_width`), or after `n_reps` replications. The number
+    of replications run is then given by the length of the returned array.
+
+    If given, `progress(n_done, n_total)` is called as each replication finishes, and
+    `on_batch(results)` is called with the results so far after each batch. Replications are
+    run in batches if either `tolerance` or `on_batch` is given.
+
+    If `crn` is True, common random numbers are used (see `crn_patients`): replication `i` of
+    any two scenarios simulated with the same `seed` and engine then shares its random draws
+    as far as possible, so that the scenarios can be compared with `paired_differences`. The
+    LoS distributions are replaced by tabulated inverse CDFs (see `tabulate_ppf`) for sampling
+    by inversion."""
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown simulation engine: {engine}')
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    if crn:
+        patient_params, dist_samples = tabulate_dists(patient_params, dist_samples, n_reps)
+
+    step = n_reps if tolerance is None and on_batch is None else batch_size
+    results = np.empty((n_reps, n_days(df_arr, until), len(GROUPS)))
+    n_done = 0
+    # Worker processes are started on the first submitted task, i.e. only by the salabim engine
+    with ProcessPoolExecutor(n_workers or max_workers()) as executor:
+        while n_done < n_reps:
+            batch = range(n_done, min(n_done + step, n_reps))
+            if engine == ENGINE_VECTORIZED:
+                results[batch.start:batch.stop] = simulate_vectorized(
+                    df_arr, until, patient_params, dist_samples,
+                    n_reps=len(batch), seed=seed, first_rep=batch.start, crn=crn
+                )
+                n_done = batch.stop
+                if progress:
+                    progress(n_done, n_reps)
+            else:
+                futures = {
+                    executor.submit(
+                        simulate_once,
+                        df_arr,
+                        until=until,
+                        patient_params=rep_params(patient_params, dist_samples, i),
+                        seed=seed if crn else child_seed(seed, i),
+                        crn_rep=i if crn else None
+                    ): i
+                    for i in batch
+                }
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+                    n_done += 1
+                    if progress:
+                        progress(n_done, n_reps)
+
+            if on_batch:
+                on_batch(results[:n_done])
+            if tolerance is not None and quantile_ci_width(results[:n_done]).max() <= tolerance:
+                break
+    return results[:n_done]
+
+
+def child_seed(seed: np.random.SeedSequence, i: int) -> np.random.SeedSequence:
+    """The `i`-th child of `seed`, i.e. item `i` of `seed.spawn(n)` for a new `seed`."""
+    return np.random.SeedSequence(seed.entropy, spawn_key=(*seed.spawn_key, i),
+                                  pool_size=seed.pool_size)
+
+
+def rep_params(patient_params: dict, dist_samples: dict[str, list] | None, rep: int) -> dict:
+    """The patient parameters for replication `rep`, with the LoS distributions chosen from
+    `dist_samples` as described in `simulate`."""
+    return patient_params | {
+        k: dists[rep % len(dists)] for k, dists in (dist_samples or {}).items()
+    }
+
+
+def tabulate_dists(patient_params: dict, dist_samples: dict[str, list] | None,
+                   n_reps: int) -> tuple[dict, dict[str, list]]:
+    """Replace the LoS distributions in the inputs of `simulate` by tabulated inverse CDFs
+    (see `tabulate_ppf`) for sampling with common random numbers, keeping only the first
+    `n_reps` items of `dist_samples` as the rest are never used."""
+    patient_params = patient_params | {
+        f'dist_{band}': tabulate_ppf(patient_params[f'dist_{band}']) for band in AGE_BANDS
+    }
+    dist_samples = {
+        k: [tabulate_ppf(d) for d in dists[:n_reps]]
+        for k, dists in (dist_samples or {}).items()
+    }
+    return patient_params, dist_samples
+
+
+def quantile_ci_width(results: np.ndarray, quantiles=QUANTILES, level: float = 0.95,
+                      is_sorted: bool = False) -> np.ndarray:
+    """Width of the confidence intervals for the `quantiles` of the output of `simulate`, for
+    each quantile, day and bed group. Pass `is_sorted=True` if `results` is already sorted
+    along the replications.
+
+    Uses distribution-free intervals between order statistics of the replications, whose ranks
+    are chosen from the binomial distribution of the number of replications below each
+    quantile."""
+    n = len(results)
+    x = results if is_sorted else np.sort(results, axis=0)
+    q = np.asarray(quantiles)
+    alpha = 1 - level
+    lo = np.clip(stats.binom.ppf(alpha / 2, n, q).astype(int) - 1, 0, n - 1)
+    hi = np.clip(stats.binom.ppf(1 - alpha / 2, n, q).astype(int), 0, n - 1)
+    return x[hi] - x[lo]
+
+
+def paired_differences(results_a: np.ndarray, results_b: np.ndarray,
+                       level: float = 0.95) -> pd.DataFrame:
+    """Compare two scenarios from the outputs of `simulate` with `crn=True` and the same
+    seed, so that replication `i` of each scenario is paired.
+
+    Returns a DataFrame indexed by bed group and measure (the peak daily occupancy, and the
+    total bed-days as the sum of the daily maxima), with the mean of the paired differences
+    `b - a` over the replications, its t confidence interval, and its standard error. The
+    standard error that the same number of independent (unpaired) replications would give is
+    also shown, for the variance reduction from the common random numbers."""
+    if results_a.shape != results_b.shape:
+        raise ValueError('Scenarios must have the same number of replications and days')
+    n = len(results_a)
+    alpha = 1 - level
+    t = stats.t.ppf(1 - alpha / 2, n - 1) if n > 1 else np.nan
+    rows = {}
+    for measure, f in (('peak', np.max), ('bed-days', np.sum)):
+        a, b = f(results_a, axis=1), f(results_b, axis=1)  # (n_reps, len(GROUPS))
+        d = b - a
+        se = d.std(axis=0, ddof=1) / np.sqrt(n)
+        se_unpaired = np.sqrt((a.var(axis=0, ddof=1) + b.var(axis=0, ddof=1)) / n)
+        for j, group in enumerate(GROUPS):
+            mean = d[:, j].mean()
+            rows[group, measure] = {
+                'a': a[:, j].mean(),
+                'b': b[:, j].mean(),
+                'mean': mean,
+                f'{alpha / 2:.1%}': mean - t * se[j],
+                f'{1 - alpha / 2:.1%}': mean + t * se[j],
+                'se': se[j],
+                'se (unpaired)': se_unpaired[j]
+            }
+    return pd.DataFrame.from_dict(rows, orient='index').rename_axis(['group', 'measure'])
+
+
+def crn_patients(seed: np.random.SeedSequence, rep: int, day: int, n_cases: float,
+                 age_cdf: np.ndarray, dists: list) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Patients arriving on one day of one replication, using common random numbers.
+
+    Returns the time of day, age band (an index into `AGE_BANDS`) and LoS of each patient,
+    where `n_cases` is the expected number of arrivals, `age_cdf` the cumulative probabilities
+    of the first two age bands, and `dists` the LoS distribution of each band.
+
+    All draws come from a stream determined only by `seed`, `rep` and `day`, and the `j`-th
+    patient of the day always uses the same three uniform draws, with the LoS found by
+    inversion of its band's distribution. Scenarios with different inputs therefore differ
+    only where their inputs do, e.g. a longer LoS distribution lengthens each stay rather than
+    resampling it."""
+    rng = np.random.default_rng(
+        np.random.SeedSequence(seed.entropy, spawn_key=(*seed.spawn_key, rep, day))
+    )
+    n = max(0, round(n_cases * rng.normal(1.0, JITTER)))
+    u = rng.random((n, 3))
+    bands = np.searchsorted(age_cdf, u[:, 1], side='right')
+    los = np.empty(n)
+    for band, dist in enumerate(dists):
+        mask = bands == band
+        los[mask] = dist.ppf(u[mask, 2])
+    assert not np.isnan(los).any(), 'LOS is nan'
+    return u[:, 0], bands, np.maximum(los, 0)  # Clip to bounds
+
+
+def simulate_once(
+    df_arr: pd.DataFrame,
+    until: pd.Timestamp,
+    patient_params: dict,
+    seed: np.random.SeedSequence | int | None = None,
+    crn_rep: int | None = None
+) -> np.ndarray:
+    """The respirator disease model simulation.
+
+    Returns an array of shape `(n_days, len(GROUPS))` containing the maximum bed occupancy of
+    each bed group on each day.
+
+    `seed` seeds both salabim's random stream and the numpy generator used for arrival jitter
+    and LoS sampling. If `crn_rep` is given, patients are instead generated by `crn_patients`
+    as replication `crn_rep` of `seed`."""
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    days = n_days(df_arr, until)
+    env = Environment(
+        time_unit='days', datetime0=df_arr.date[0],
+        random_seed=int(seed.generate_state(1)[0]), rng=np.random.default_rng(seed), days=days
+    )
+    DailyArrivals(env=env, n_arr=df_arr.n_arr, patient_params=patient_params,
+                  crn=None if crn_rep is None else (seed, crn_rep))
+
+    env.run(env.datetime_to_t(until))
+
+    return np.stack([
+        env.beds.daily_max(),
+        env.beds_adult.daily_max(),
+        env.beds_paeds.daily_max(),
+    ], axis=-1)
+
+
+def n_days(df_arr: pd.DataFrame, until: pd.Timestamp) -> int:
+    """Number of days simulated, from the first day of `df_arr` up to `until`."""
+    duration = pd.Timestamp(until) - pd.Timestamp(df_arr.date[0])
+    return int(np.ceil(duration / pd.Timedelta(days=1)))
+
+
+def simulate_vectorized(
+        df_arr: pd.DataFrame,
+        until: pd.Timestamp,
+        patient_params: dict,
+        dist_samples: dict[str, list] | None = None,
+        n_reps: int = N_REPS,
+        seed=None,
+        first_rep: int = 0,
+        crn: bool = False
+) -> np.ndarray:
+    """Vectorized equivalent of `simulate` with the salabim engine.
+
+    The arrival times, age groups and LoS values of all patients in all replications are
+    sampled as arrays, and occupancy is computed by `occupancy` rather than by simulating each
+    patient. `first_rep` is the index of the first replication, for choosing its random stream
+    (see `simulate`) and items from `dist_samples` when running a batch of replications.
+
+    If `crn` is True, patients are generated by `crn_patients`, with replication `first_rep`
+    onwards of `seed`."""
+    days = n_days(df_arr, until)
+    rep, t_arr, group, los = vectorized_patients(df_arr, patient_params, dist_samples, n_reps,
+                                                 seed, first_rep, crn)
+
+    is_paeds = group == 0
+    return np.stack([
+        occupancy(rep, t_arr, los, n_reps, days),
+        occupancy(rep[~is_paeds], t_arr[~is_paeds], los[~is_paeds], n_reps, days),
+        occupancy(rep[is_paeds], t_arr[is_paeds], los[is_paeds], n_reps, days),
+    ], axis=-1)
+
+
+def vectorized_patients(df_arr: pd.DataFrame, patient_params: dict,
+                        dist_samples: dict[str, list] | None = None, n_reps: int = N_REPS,
+                        seed=None, first_rep: int = 0, crn: bool = False):
+    """The replication index, arrival time, age band and LoS of all patients in all
+    replications for `simulate_vectorized`, as arrays: from `crn_patients` if `crn` is True,
+    otherwise from `sample_patients`.
+
+    In the latter case, replications are sampled in blocks of `SEED_BLOCK_SIZE`, counted from
+    replication 0, with block `b` drawn from the `b`-th child of `seed`. The replications
+    `first_rep` to `first_rep + n_reps - 1` are kept from the blocks they fall in, so that they
+    are the same however the replications are split into batches, while the LoS of each block
+    are still sampled with one call per distribution."""
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    n_arr = np.asarray(df_arr.n_arr, dtype=float)
+
+    if crn:
+        age_dist = patient_params['age_dist']
+        age_cdf = np.cumsum([age_dist['paeds'], age_dist['adult']])
+        patients = []
+        for r in range(n_reps):
+            params = rep_params(patient_params, dist_samples, first_rep + r)
+            dists = [params[f'dist_{band}'] for band in AGE_BANDS]
+            patients += [
+                (r, day, *crn_patients(seed, first_rep + r, day, n_cases, age_cdf, dists))
+                for day, n_cases in enumerate(n_arr)
+            ]
+        rep = np.concatenate([np.full(len(p[2]), p[0]) for p in patients]).astype(int)
+        t_arr = np.concatenate([p[1] + p[2] for p in patients])
+        group = np.concatenate([p[3] for p in patients]).astype(int)
+        los = np.concatenate([p[4] for p in patients])
+        return rep, t_arr, group, los
+    patients = []
+    for b in range(first_rep // SEED_BLOCK_SIZE, -(-(first_rep + n_reps) // SEED_BLOCK_SIZE)):
+        rep, *rest = sample_patients(np.random.default_rng(child_seed(seed, b)), n_arr,
+                                     SEED_BLOCK_SIZE, patient_params, dist_samples,
+                                     b * SEED_BLOCK_SIZE)
+        rep += b * SEED_BLOCK_SIZE - first_rep
+        keep = (rep >= 0) & (rep < n_reps)
+        patients.append([a[keep] for a in (rep, *rest)])
+    return tuple(np.concatenate(a) for a in zip(*patients))
+
+
+def sample_patients(rng: np.random.Generator, n_arr: np.ndarray, n_reps: int,
+                    patient_params: dict, dist_samples: dict[str, list] | None = None,
+                    first_rep: int = 0):
+    """Sample the replication index, arrival time, age band and LoS of all patients in all
+    replications for `simulate_vectorized`, as arrays."""
+    # Patients are generated in daily batches, then arrive at a random time of day
+    counts = np.round(n_arr * rng.normal(1.0, JITTER, (n_reps, len(n_arr))))
+    counts = np.maximum(counts, 0).astype(int).ravel()
+    rep = np.repeat(np.repeat(np.arange(n_reps), len(n_arr)), counts)
+    t_arr = np.repeat(np.tile(np.arange(len(n_arr)), n_reps), counts) + rng.random(len(rep))
+
+    # Age group (0: paeds, 1: adult, 2: senior) and LoS
+    age_dist = patient_params['age_dist']
+    u = rng.random(len(rep))
+    group = (u >= age_dist['paeds']).astype(int) \
+        + (u >= age_dist['paeds'] + age_dist['adult']).astype(int)
+    los = np.empty(len(rep))
+    for g, band in enumerate(AGE_BANDS):
+        dists = (dist_samples or {}).get(f'dist_{band}') or [patient_params[f'dist_{band}']]
+        which = np.where(group == g, (first_rep + rep) % len(dists), -1)
+        for k in np.unique(which[which >= 0]):
+            mask = which == k
+            los[mask] = dists[k].rvs(size=mask.sum(), random_state=rng)
+    assert not np.isnan(los).any(), 'LOS is nan'
+    return rep, t_arr, group, np.maximum(los, 0)  # Clip to bounds
+
+
+def occupancy(rep: np.ndarray, t_arr: np.ndarray, los: np.ndarray,
+              n_reps: int, days: int, late: np.ndarray | None = None) -> np.ndarray:
+    """Maximum number of stays in progress on each day of each replication.
+
+    `rep`, `t_arr` and `los` give the replication index, arrival time and LoS of each stay.
+    Returns an array of shape `(n_reps, days)`, with the same definition of the daily maximum
+    as `DailyCounter`. Where an arrival and a departure are at the same time, the arrival
+    comes first, as for a zero-length stay in the simulation, except for the stays in the
+    optional boolean mask `late`, e.g. patients taking over a bed as it is freed."""
+    # +1 and -1 events at each arrival and departure, sorted by replication then time, using
+    # a single key (as t < days), which is much faster than a lexsort. The sort is stable, so
+    # the order of the arrays decides ties.
+    if late is None:
+        t = np.concatenate([t_arr, t_arr + los])
+        delta = np.concatenate([np.ones(len(t_arr)), -np.ones(len(t_arr))])
+        r = np.concatenate([rep, rep])
+    else:
+        t = np.concatenate([t_arr[~late], t_arr + los, t_arr[late]])
+        delta = np.concatenate([np.ones((~late).sum()), -np.ones(len(t_arr)), np.ones(late.sum())])
+        r = np.concatenate([rep[~late], rep, rep[late]])
+    keep = t < days
+    t, delta, r = t[keep], delta[keep], r[keep]
+    if t.size == 0:
+        return np.zeros((n_reps, days))
+    key = r * days + t
+    order = np.argsort(key, kind='stable')
+    t, delta, r, key = t[order], delta[order], r[order], key[order]
+
+    # Running level within each replication
+    level = np.cumsum(delta)
+    level -= np.concatenate([[0], level])[np.searchsorted(r, np.arange(n_reps))][r]
+
+    # Level carried over into each day, i.e. after the last event before midnight. Events at
+    # midnight count towards the maximum of the new day.
+    cells = np.arange(n_reps * days)
+    idx = np.searchsorted(key, cells, side='left') - 1
+    valid = (idx >= 0) & (r[np.maximum(idx, 0)] == cells // days)
+    ret = np.where(valid, level[np.maximum(idx, 0)], 0).reshape(n_reps, days)
+
+    # Maximum level during each day, reduced over runs of events on the same day first, since
+    # np.maximum.at is slow for many events
+    cell = r * days + t.astype(int)
+    first = np.flatnonzero(np.concatenate([[True], cell[1:] != cell[:-1]]))
+    np.maximum.at(ret.reshape(-1), cell[first], np.maximum.reduceat(level, first))
+    return ret
+
+
+def results_to_frames(results: np.ndarray, start) -> dict[str, pd.DataFrame]:
+    """Convert the output of `simulate` to a DataFrame per bed group, indexed by date, with one
+    column per replication."""
+    index = pd.date_range(pd.Timestamp(start), periods=results.shape[1], freq='D', name='t')
+    return {
+        group: pd.DataFrame(results[:, :, j].T, index=index)
+        for j, group in enumerate(GROUPS)
+    }
+
+
+def summarise(results: np.ndarray, start, quantiles=QUANTILES) -> dict:
+    """Summarise the output of `simulate` for plotting and export, at the given `quantiles`
+    levels.
+
+    Returns a dict containing the `results`; their quantiles over the replications, both as an
+    array `quantile_values` of shape `(len(quantiles), n_days, len(GROUPS))` and as
+    `quantiles`, a DataFrame per bed group indexed by date with a column per quantile; and
+    `ci_width`, the largest width of the confidence intervals of the quantiles (see
+    `quantile_ci_width`).
+
+    The replications are sorted once, for all quantiles, days and bed groups together."""
+    x = np.sort(results, axis=0)
+    return quantile_summary(results, np.quantile(x, quantiles, axis=0), start, quantiles,
+                            float(quantile_ci_width(x, quantiles, is_sorted=True).max()))
+
+
+def quantile_summary(results: np.ndarray, values: np.ndarray, start, quantiles,
+                     ci_width: float) -> dict:
+    """The dict returned by `summarise`, from the quantile `values` already computed."""
+    index = pd.date_range(pd.Timestamp(start), periods=values.shape[1], freq='D', name='t')
+    return {
+        'results': results,
+        'quantile_values': values,
+        'quantiles': {
+            group: pd.DataFrame(values[:, :, j].T, index=index, columns=list(quantiles))
+            for j, group in enumerate(GROUPS)
+        },
+        'ci_width': ci_width
+    }
+
+
+class DailyCounter:
+    """Counter of occupied beds, recording the maximum count on each day of the simulation.
+
+    Used instead of an infinite-capacity `sim.Resource` with a level monitor, so that memory
+    use is proportional to the number of days rather than the number of events. The daily
+    maximum includes the count carried over from the previous day."""
+
+    def __init__(self, env: sim.Environment, days: int):
+        self.env = env
+        self.level = 0
+        self.day = 0
+        self.max = [0] * days
+
+    def add(self, n: int):
+        """Change the count by `n` at the current simulation time."""
+        day = int(self.env.now())
+        if day > self.day:
+            # Carry the count over any days since the last change
+            for d in range(self.day + 1, min(day + 1, len(self.max))):
+                self.max[d] = self.level
+            self.day = day
+        self.level += n
+        if day < len(self.max) and self.level > self.max[day]:
+            self.max[day] = self.level
+
+    def daily_max(self) -> np.ndarray:
+        """Maximum count on each day, to be called at the end of the simulation."""
+        for d in range(self.day + 1, len(self.max)):
+            self.max[d] = self.level
+        self.day = len(self.max)
+        return np.array(self.max, dtype=float)
+
+
+class Environment(sim.Environment):
+    """The simulation environment"""
+    beds: DailyCounter
+
+    # Counters for different types of bed occupancies
+    beds_adult: DailyCounter
+    beds_paeds: DailyCounter
+
+    rng: np.random.Generator
+    """Random number generator for numpy and scipy draws, seeded per replication."""
+
+    def setup(self, days: int, rng: np.random.Generator | None = None):
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.beds = DailyCounter(self, days)
+        self.beds_adult = DailyCounter(self, days)
+        self.beds_paeds = DailyCounter(self, days)
+
+
+class BlockSampler:
+    """Hands out values one at a time from vectorized draws of `block_size` values, drawing
+    a new block whenever the current one runs out.
+
+    `draw(n)` should return an array of `n` values."""
+
+    def __init__(self, draw: Callable[[int], np.ndarray], block_size: int = SAMPLE_BLOCK_SIZE):
+        self.draw = draw
+        self.block_size = block_size
+        self.block: list[float] = []
+        self.i = 0
+
+    def __call__(self) -> float:
+        if self.i == len(self.block):
+            self.block = self.draw(self.block_size).tolist()
+            self.i = 0
+        self.i += 1
+        return self.block[self.i - 1]
+
+
+def los_sampler(dist, rng: np.random.Generator,
+                block_size: int = SAMPLE_BLOCK_SIZE) -> BlockSampler:
+    """`BlockSampler` of LoS values from a frozen distribution, clipped at zero."""
+    def draw(n: int) -> np.ndarray:
+        los = dist.rvs(size=n, random_state=rng)
+        assert not np.isnan(los).any(), 'LOS is nan'
+        return np.maximum(los, 0)  # Clip to bounds
+    return BlockSampler(draw, block_size)
+
+
+class DailyArrivals(sim.Component):
+    """Daily Arrival generator."""
+
+    n_arr: list[float]
+    age_cdf: np.ndarray
+    los: dict[str, BlockSampler]
+    dists: list
+    crn: tuple[np.random.SeedSequence, int] | None
+
+    def setup(self, n_arr, patient_params, crn=None):
+        self.env: Environment
+        self.n_arr = n_arr
+        age_dist = patient_params['age_dist']
+        self.age_cdf = np.cumsum([age_dist['paeds'], age_dist['adult']])
+        self.los = {
+            band: los_sampler(patient_params[f'dist_{band}'], self.env.rng)
+            for band in AGE_BANDS
+        }
+        self.dists = [patient_params[f'dist_{band}'] for band in AGE_BANDS]
+        self.crn = crn
+
+    def process(self):
+        """Generate patients. Patients are batch-generated each day; each Patient instance
+        is responsible for entering the system at the correct time-of-day using
+        `Patient.hold()`.
+
+        The times of day and age bands of each day's patients are drawn in one go, and LoS
+        values are taken from each band's `BlockSampler`. If `crn` is a seed and replication
+        index, each day's patients are instead generated by `crn_patients`."""
+        self.env: Environment
+        rng = self.env.rng
+        for day, n_cases in enumerate(self.n_arr):
+            if self.crn:
+                times, bands, los = (
+                    a.tolist() for a in crn_patients(*self.crn, day, n_cases, self.age_cdf,
+                                                     self.dists)
+                )
+            else:
+                n = max(0, round(n_cases * rng.normal(1.0, JITTER)))
+                times = rng.random(n).tolist()
+                bands = np.searchsorted(self.age_cdf, rng.random(n), side='right').tolist()
+                los = [self.los[AGE_BANDS[band]]() for band in bands]
+            for time_of_day, band, los_ in zip(times, bands, los):
+                Patient(time_of_day=time_of_day, los=los_, is_paeds=band == 0)
+            self.hold(self.env.days(1.0))
+
+
+class Patient(sim.Component):
+    """A patient in the respiratory disease model."""
+
+    def process(self, time_of_day: float, los: float, is_paeds: bool):
+        """Model a patient journey through the ward.
+
+        Arrivals are generated at midnight but released to the system at `time_of_day`, as a
+        fraction of a day."""
+        self.env: Environment
+        self.hold(self.env.days(time_of_day))
+
+        beds = self.env.beds_paeds if is_paeds else self.env.beds_adult
+        self.env.beds.add(1)
+        beds.add(1)
+        self.hold(los)
+        beds.add(-1)
+        self.env.beds.add(-1)
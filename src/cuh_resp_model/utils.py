@@ -1,5 +1,6 @@
 """Utility funtions."""
 
+import os
 from os import PathLike
 
 JSCode = str
@@ -20,3 +21,14 @@ def drop_none(d: dict) -> dict:
     """Drop None values from a dict. Useful for supplying keyword arguments to a function
     only if certain conditions are met, using the ** operator."""
     return {k: v for k, v in d.items() if v is not None}
+
+
+def max_workers() -> int:
+    """Number of worker processes to use for parallel computations.
+
+    Set the environment variable `CUH_RESP_MAX_WORKERS` to limit this on a shared server;
+    otherwise, all CPUs are used."""
+    try:
+        return max(1, int(os.environ['CUH_RESP_MAX_WORKERS']))
+    except (KeyError, ValueError):
+        return os.cpu_count() or 1
@@ -0,0 +1,72 @@
+"""Tests of the occupancy backtest."""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cuh_resp_model.arrivals import norm_curve2
+from cuh_resp_model.backtest import backtest, backtest_summary, crps_ensemble
+from cuh_resp_model.simulation import occupancy, scenario_from_config, vectorized_patients
+
+CONFIG = Path(__file__).parent / 'config.json'
+
+
+N_REALISATIONS = 4
+"""Synthetic data sets, since the forecast errors of one data set are strongly correlated
+between nearby origins."""
+
+
+def synthetic_config(seed: int) -> dict:
+    """`config.json` with its arrivals and occupancy data replaced by one replication of the
+    model itself, for a wave of arrivals following the arrival curve, so that the model is
+    correctly specified."""
+    config = json.loads(CONFIG.read_text(encoding='utf-8'))
+    patient_params = scenario_from_config(config)['patient_params']
+    dates = pd.date_range('2023-01-01', periods=300)
+    df_arr = pd.DataFrame({
+        'date': dates,
+        'n_arr': norm_curve2(np.arange(len(dates)) - 150.0, 30, 20, 2)
+    })
+    rep, t_arr, _, los = vectorized_patients(df_arr, patient_params, n_reps=1, seed=seed)
+    arr = pd.DataFrame({'Count': np.bincount(t_arr.astype(int), minlength=len(dates))},
+                       index=dates)
+    arr['7 day avg.'] = arr.Count.rolling(7, min_periods=1).mean()
+    occ = pd.DataFrame({
+        'Critical Care': occupancy(rep, t_arr, los, 1, len(dates))[0],
+        'Non Critical Care': 0.0
+    }, index=dates)
+    config['step_1'] |= {'arr_data': arr.to_dict('tight'), 'occupancy_data': occ.to_dict('tight')}
+    return config
+
+
+def test_coverage_correctly_specified():
+    # Origins from the peak of the wave, so that the lookback window includes its rise and the
+    # arrival curve can be identified
+    scores = pd.concat([
+        backtest(synthetic_config(seed), start='2023-05-11', every=6, n_reps=50, seed=seed,
+                 n_workers=1)
+        for seed in range(N_REALISATIONS)
+    ])
+    summary = backtest_summary(scores)
+    # Occupancy is discrete, so intervals including their ends cover a little more than their
+    # nominal level. Only the first week is checked, since the intervals do not allow for the
+    # uncertainty of the fitted arrival curve, and are too narrow at longer lead times
+    assert summary.loc['week 1', 'coverage 50%'] == pytest.approx(0.5, abs=0.12)
+    assert summary.loc['week 1', 'coverage 80%'] == pytest.approx(0.8, abs=0.12)
+    assert abs(summary.loc['all', 'bias']) < 0.05 * scores.observed.mean()
+    assert summary.loc['all', 'skill'] > 0
+
+
+def test_crps_ensemble():
+    observed = np.array([3.0, 7.0, 10.0])
+    # A degenerate ensemble scores the absolute error
+    np.testing.assert_allclose(crps_ensemble(np.full((20, 3), 7.0), observed), [4, 0, 3],
+                               atol=1e-12)
+    # Otherwise, E|X - y| - E|X - X'| / 2 over all pairs of members
+    ensemble = np.random.default_rng(0).normal(7, 2, (50, 3))
+    expected = np.abs(ensemble - observed).mean(axis=0) \
+        - np.abs(ensemble[:, None] - ensemble[None]).mean(axis=(0, 1)) / 2
+    np.testing.assert_allclose(crps_ensemble(ensemble, observed), expected)
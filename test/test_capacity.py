@@ -0,0 +1,46 @@
+"""Tests of the finite-capacity simulation."""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from cuh_resp_model.capacity import simulate_capacity
+from cuh_resp_model.simulation import ENGINE_VECTORIZED, GROUPS, scenario_from_config, simulate
+
+CONFIG = Path(__file__).parent / 'config.json'
+
+N_REPS = 50
+"""Replications of each simulation."""
+
+
+@pytest.fixture(scope='module')
+def scenario() -> dict:
+    """The scenario in `config.json`."""
+    return scenario_from_config(json.loads(CONFIG.read_text(encoding='utf-8')))
+
+
+@pytest.fixture(scope='module')
+def demand(scenario) -> np.ndarray:
+    """Occupancy from the vectorized engine with unlimited beds."""
+    return simulate(**scenario, n_reps=N_REPS, seed=1, engine=ENGINE_VECTORIZED)
+
+
+def test_ample_capacity_matches_vectorized(scenario, demand):
+    peak = demand.max(axis=(0, 1))
+    capacity = {group: int(peak[GROUPS.index(group)]) for group in ('adult', 'paeds')}
+    results = simulate_capacity(**scenario, capacity=capacity, n_reps=N_REPS, seed=1)
+    np.testing.assert_array_equal(results['occupancy'], demand)
+    assert not results['boarding'].any() and not results['overflow'].any()
+
+
+def test_capacity_respected(scenario, demand):
+    capacity = {'adult': int(0.75 * demand[:, :, GROUPS.index('adult')].max()), 'paeds': 3}
+    results = simulate_capacity(**scenario, capacity=capacity, n_reps=N_REPS, seed=1)
+    for group, beds in capacity.items():
+        j = GROUPS.index(group)
+        assert results['occupancy'][:, :, j].max() <= beds
+        assert results['overflow'][:, :, j].sum() > 0
+    # Every patient who boarded was counted on the day they arrived
+    assert (results['overflow'][:, :, 0] == results['overflow'][:, :, 1:].sum(axis=-1)).all()
@@ -0,0 +1,57 @@
+"""Tests of the LoS distribution helpers."""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+from scipy import stats
+
+from cuh_resp_model.distributions import goodness_of_fit, tabulate_ppf
+from cuh_resp_model.simulation import AGE_BANDS, scenario_from_config
+
+CONFIG = Path(__file__).parent / 'config.json'
+
+
+def config_dists():
+    """The LoS distributions of the scenario in `config.json`."""
+    params = scenario_from_config(json.loads(CONFIG.read_text(encoding='utf-8')))['patient_params']
+    return [params[f'dist_{band}'] for band in AGE_BANDS]
+
+
+@pytest.mark.parametrize('dist', [
+    stats.lognorm(0.8, scale=np.exp(1.5)),
+    stats.gamma(0.7, scale=6),
+    stats.weibull_min(1.3, scale=5),
+    stats.expon(scale=4),
+    *config_dists()
+], ids=lambda dist: dist.dist.name)
+def test_tabulate_ppf_moments(dist):
+    table = tabulate_ppf(dist)
+    assert table.mean() == pytest.approx(dist.mean(), rel=1e-3)
+    assert table.std() == pytest.approx(dist.std(), rel=5e-3)
+
+
+def test_tabulate_ppf_quantiles():
+    dist = stats.lognorm(0.8, scale=np.exp(1.5))
+    table = tabulate_ppf(dist)
+    q = np.array([1e-4, 0.01, 0.1, 0.5, 0.9, 0.99, 0.9999])
+    np.testing.assert_allclose(table.ppf(q), dist.ppf(q), rtol=1e-3)
+    np.testing.assert_allclose(table.cdf(dist.ppf(q)), q, rtol=1e-3)
+    np.testing.assert_allclose(table.scaled(2).ppf(q), 2 * table.ppf(q))
+
+
+def test_goodness_of_fit_moments():
+    los = stats.lognorm(0.8, scale=np.exp(1.5)).rvs(500, random_state=0)
+    dists = {
+        'lognorm': {'s': 0.8, 'loc': 0, 'scale': np.exp(1.5)},
+        'gamma': {'a': 0.7, 'loc': 0, 'scale': 6},
+        'cauchy': {'loc': 5, 'scale': 2},
+    }
+    gof = goodness_of_fit(los, dists, n_workers=1)
+    for name in ('lognorm', 'gamma'):
+        dist = getattr(stats, name)(**dists[name])
+        assert gof['mean'][name] == pytest.approx(dist.mean(), rel=1e-3)
+        assert gof['std'][name] == pytest.approx(dist.std(), rel=1e-2)
+    # Infinite moments are not reported
+    assert gof['mean']['cauchy'] is None and gof['std']['cauchy'] is None
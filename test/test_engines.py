@@ -0,0 +1,72 @@
+"""Cross-validation of the simulation engines.
+
+The salabim and vectorized engines implement the same model, so for the scenario in
+`config.json` their daily occupancy should have the same mean and standard deviation, up to
+sampling error. The seeds are fixed, so the test is deterministic.
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from cuh_resp_model.simulation import (ENGINE_SALABIM, ENGINE_VECTORIZED, GROUPS,
+                                       scenario_from_config, simulate)
+
+CONFIG = Path(__file__).parent / 'config.json'
+
+N_SALABIM = 40
+"""Replications of the (slow) salabim engine."""
+
+N_VECTORIZED = 400
+"""Replications of the vectorized engine."""
+
+Z = 4.5
+"""Allowed difference in standard errors, for each day and bed group. With several hundred
+comparisons, this keeps the chance of any false failure below 1%."""
+
+ATOL = 0.5
+"""Allowed difference in beds on top of `Z` standard errors, since occupancy is discrete and
+has almost no variance on the first days."""
+
+
+@pytest.fixture(scope='module')
+def results() -> tuple[np.ndarray, np.ndarray]:
+    """Occupancy from both engines for the test scenario."""
+    scenario = scenario_from_config(json.loads(CONFIG.read_text(encoding='utf-8')))
+    return (
+        simulate(**scenario, n_reps=N_SALABIM, seed=1, engine=ENGINE_SALABIM),
+        simulate(**scenario, n_reps=N_VECTORIZED, seed=2, engine=ENGINE_VECTORIZED)
+    )
+
+
+def test_shapes(results):
+    a, b = results
+    assert a.shape[1:] == b.shape[1:]
+    assert a.shape[2] == len(GROUPS)
+
+
+def test_daily_means_agree(results):
+    a, b = results
+    diff = np.abs(a.mean(axis=0) - b.mean(axis=0))
+    se = np.sqrt(a.var(axis=0, ddof=1) / len(a) + b.var(axis=0, ddof=1) / len(b))
+    assert np.all(diff <= Z * se + ATOL), np.argwhere(diff > Z * se + ATOL)
+
+
+def test_daily_sds_agree(results):
+    a, b = results
+    sd_a, sd_b = a.std(axis=0, ddof=1), b.std(axis=0, ddof=1)
+    diff = np.abs(sd_a - sd_b)
+    # Large-sample standard error of a standard deviation
+    se = np.sqrt(sd_a ** 2 / (2 * (len(a) - 1)) + sd_b ** 2 / (2 * (len(b) - 1)))
+    assert np.all(diff <= Z * se + ATOL), np.argwhere(diff > Z * se + ATOL)
+
+
+def test_vectorized_independent_of_batches():
+    scenario = scenario_from_config(json.loads(CONFIG.read_text(encoding='utf-8')))
+    whole = simulate(**scenario, n_reps=50, seed=3, engine=ENGINE_VECTORIZED)
+    for batch_size in (7, 30):
+        batched = simulate(**scenario, n_reps=50, seed=3, engine=ENGINE_VECTORIZED,
+                           batch_size=batch_size, on_batch=lambda results: None)
+        np.testing.assert_array_equal(batched, whole)
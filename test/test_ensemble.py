@@ -0,0 +1,39 @@
+"""Tests of the memory-mapped ensemble store."""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cuh_resp_model.ensemble import EnsembleStore, simulate_ensemble
+from cuh_resp_model.simulation import (ENGINE_VECTORIZED, child_seed, scenario_from_config,
+                                       simulate, summarise)
+
+CONFIG = Path(__file__).parent / 'config.json'
+
+
+def test_store_matches_simulate(tmp_path):
+    scenario = scenario_from_config(json.loads(CONFIG.read_text(encoding='utf-8')))
+    scenarios = {
+        'base': scenario,
+        'short': scenario | {'until': pd.Timestamp(scenario['until']) - pd.Timedelta(days=30)}
+    }
+    seed = np.random.SeedSequence(0)
+    simulate_ensemble(tmp_path / 'ensemble.npy', scenarios, n_reps=40, seed=seed, n_workers=1,
+                      engine=ENGINE_VECTORIZED, batch_size=16)
+
+    store = EnsembleStore(tmp_path / 'ensemble.npy')
+    chunk_bytes = 10 * store.n_reps * 3 * store.data.itemsize  # Several chunks of days
+    for s, (name, sc) in enumerate(scenarios.items()):
+        results = simulate(**sc, n_reps=40, seed=child_seed(seed, s), engine=ENGINE_VECTORIZED)
+        summary = summarise(results, sc['df_arr'].date[0])
+        np.testing.assert_array_equal(store.results(name), results)
+        np.testing.assert_array_equal(store.peaks(name, chunk_bytes), results.max(axis=1))
+        np.testing.assert_allclose(store.quantiles(name, chunk_bytes=chunk_bytes),
+                                   summary['quantile_values'])
+        stored = store.summarise(name, chunk_bytes=chunk_bytes)
+        np.testing.assert_allclose(stored['quantile_values'], summary['quantile_values'])
+        assert stored['ci_width'] == summary['ci_width']
+        for group, df in summary['quantiles'].items():
+            pd.testing.assert_frame_equal(stored['quantiles'][group], df)
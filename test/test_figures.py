@@ -0,0 +1,70 @@
+"""Tests of the Plotly figure helpers."""
+
+import base64
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cuh_resp_model.figures import downsample, minmax_indices, typed_array, x_coords
+
+
+def decode(spec: dict) -> np.ndarray:
+    """The array encoded by `typed_array`, as decoded by Plotly.js."""
+    a = np.frombuffer(base64.b64decode(spec['bdata']), dtype=np.dtype(spec['dtype']))
+    return a.reshape([int(n) for n in spec['shape'].split(',')]) if 'shape' in spec else a
+
+
+@pytest.mark.parametrize('values, dtype', [
+    (np.arange(10.0) / 3, np.float32),
+    (np.arange(10.0) / 3, np.float64),
+    (np.arange(-5, 5), np.int16),
+    (np.arange(12.0).reshape(4, 3), np.float32),
+])
+def test_typed_array_round_trip(values, dtype):
+    decoded = decode(typed_array(values, dtype))
+    assert decoded.shape == values.shape
+    np.testing.assert_array_equal(decoded, np.asarray(values, dtype=dtype))
+
+
+def test_x_coords():
+    dates = pd.date_range('2024-10-01', periods=5)
+    assert x_coords(dates) == {'x0': '2024-10-01T00:00:00', 'dx': 24 * 60 * 60 * 1000}
+    uneven = dates[[0, 1, 3]]
+    np.testing.assert_array_equal(decode(x_coords(uneven)['x']),
+                                  uneven.as_unit('ms').asi8.astype(float))
+    assert x_coords([0.0, 0.5, 1.0]) == {'x0': 0.0, 'dx': 0.5}
+
+
+def test_minmax_indices():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(1000, 2))
+    values[rng.integers(0, 1000, 50), 1] = np.nan
+    n_buckets = 30
+    idx = minmax_indices(values, n_buckets)
+    assert idx[0] == 0 and idx[-1] == len(values) - 1
+    assert len(idx) <= 2 * n_buckets * values.shape[1] + 2
+    edges = np.linspace(0, len(values), n_buckets + 1).astype(int)
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        kept = idx[(idx >= lo) & (idx < hi)]
+        for j in range(values.shape[1]):
+            bucket = values[lo:hi, j]
+            # The extremes of each bucket are kept, ignoring NaN
+            assert np.nanmin(bucket) in values[kept, j]
+            assert np.nanmax(bucket) in values[kept, j]
+
+
+def test_downsample():
+    x = pd.date_range('2024-01-01', periods=5000)
+    y = np.sin(np.arange(5000) / 50)
+    y[1234] = 5
+    xs, ys = downsample(x, {'y': y}, max_points=200)
+    assert len(xs) <= 202 and ys['y'].max() == 5
+    assert xs[0] == x[0] and xs[-1] == x[-1]
+
+    # One point either side of the bounds is kept, so that lines reach the edges of the plot
+    bounds = ('2024-02-10 12:00', '2024-03-01')
+    xs, ys = downsample(x, {'y': y}, bounds, max_points=200)
+    assert xs[0] < pd.Timestamp(bounds[0]) < xs[1]
+    assert xs[-1] == pd.Timestamp(bounds[1])
+    np.testing.assert_array_equal(ys['y'], y[x.get_indexer(xs)])
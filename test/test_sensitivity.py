@@ -0,0 +1,19 @@
+"""Tests of the sensitivity analysis."""
+
+import numpy as np
+
+from cuh_resp_model.sensitivity import saltelli_sample, sobol_estimates
+
+
+def test_sobol_linear_model():
+    # For y = sum(c_j x_j) with independent x_j, both indices of x_j are its share of the
+    # variance, c_j^2 var(x_j) / var(y)
+    lower, upper = np.array([0.0, 0.0, 10.0]), np.array([1.0, 2.0, 11.0])
+    c = np.array([[3.0, 0.0], [1.0, 1.0], [0.0, 2.0]])  # Two outputs
+    a, b, ab = saltelli_sample(lower, upper, 1024, seed=0)
+    s1, st = sobol_estimates(a @ c, b @ c, ab @ c)
+
+    share = c ** 2 * ((upper - lower) ** 2 / 12)[:, None]
+    share /= share.sum(axis=0)
+    np.testing.assert_allclose(s1, share, atol=0.02)
+    np.testing.assert_allclose(st, share, atol=0.02)
@@ -0,0 +1,103 @@
+"""Tests of the simulation building blocks."""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from cuh_resp_model.simulation import (ENGINE_SALABIM, ENGINE_VECTORIZED, GROUPS, QUANTILES,
+                                       DailyCounter, los_sampler, n_days, occupancy,
+                                       paired_differences, quantile_ci_width, results_to_frames,
+                                       scenario_from_config, simulate, summarise)
+
+CONFIG = Path(__file__).parent / 'config.json'
+
+
+@pytest.fixture(scope='module')
+def scenario() -> dict:
+    """The scenario in `config.json`."""
+    return scenario_from_config(json.loads(CONFIG.read_text(encoding='utf-8')))
+
+
+class Clock:
+    """Stand-in for a salabim environment, with a settable time in days."""
+
+    def __init__(self):
+        self.t = 0.0
+
+    def now(self) -> float:
+        return self.t
+
+
+def test_occupancy_matches_daily_counter():
+    rng = np.random.default_rng(0)
+    days, n_reps = 30, 5
+    rep = rng.integers(0, n_reps, 400)
+    t_arr = rng.uniform(0, days + 5, len(rep))
+    los = rng.exponential(4, len(rep))
+    # Zero-length stays and stays ending at midnight, where the order of events matters
+    los[:20] = 0
+    los[20:40] = np.ceil(t_arr[20:40]) - t_arr[20:40]
+
+    expected = []
+    for r in range(n_reps):
+        clock = Clock()
+        counter = DailyCounter(clock, days)
+        m = rep == r
+        # Arrivals come before departures at the same time, as in `occupancy`
+        events = sorted([(t, -1) for t in t_arr[m]] + [(t, 1) for t in t_arr[m] + los[m]])
+        for clock.t, order in events:
+            counter.add(-order)
+        expected.append(counter.daily_max())
+
+    np.testing.assert_array_equal(occupancy(rep, t_arr, los, n_reps, days), expected)
+
+
+def test_results_by_replication(scenario):
+    # Replications finish in any order, but are stored in order of their seeds
+    results = simulate(**scenario, n_reps=3, seed=0, engine=ENGINE_SALABIM, n_workers=2)
+    assert results.shape == (3, n_days(scenario['df_arr'], scenario['until']), len(GROUPS))
+    np.testing.assert_array_equal(
+        results, simulate(**scenario, n_reps=3, seed=0, engine=ENGINE_SALABIM, n_workers=1)
+    )
+
+    frames = results_to_frames(results, scenario['df_arr'].date[0])
+    for j, group in enumerate(GROUPS):
+        assert frames[group].index[0] == pd.Timestamp(scenario['df_arr'].date[0])
+        np.testing.assert_array_equal(frames[group].to_numpy(), results[:, :, j].T)
+
+
+def test_los_sampler_blocks():
+    dist = stats.norm(3, 4)  # Negative values are clipped
+    sampler = los_sampler(dist, np.random.default_rng(0), block_size=8)
+    values = [sampler() for _ in range(20)]
+    rng = np.random.default_rng(0)
+    expected = np.concatenate([dist.rvs(size=8, random_state=rng) for _ in range(3)])[:20]
+    np.testing.assert_array_equal(values, np.maximum(expected, 0))
+
+
+def test_paired_differences_crn(scenario):
+    more = scenario | {'df_arr': scenario['df_arr'].assign(n_arr=1.1 * scenario['df_arr'].n_arr)}
+    a, b = (
+        simulate(**sc, n_reps=30, seed=0, engine=ENGINE_VECTORIZED, crn=True)
+        for sc in (scenario, more)
+    )
+    df = paired_differences(a, b)
+    assert (df['mean'] > 0).all()
+    # Common random numbers make the paired differences much less variable than unpaired ones
+    assert (df['se'] < 0.5 * df['se (unpaired)']).all()
+    assert (paired_differences(a, a)[['mean', 'se']] == 0).all().all()
+
+
+def test_summarise_one_pass():
+    results = np.random.default_rng(0).poisson(20, (50, 40, len(GROUPS))).astype(float)
+    summary = summarise(results, '2024-10-01')
+    for j, group in enumerate(GROUPS):
+        expected = np.quantile(results[:, :, j], QUANTILES, axis=0)
+        np.testing.assert_array_equal(summary['quantile_values'][:, :, j], expected)
+        np.testing.assert_array_equal(summary['quantiles'][group].to_numpy(), expected.T)
+        assert list(summary['quantiles'][group].columns) == list(QUANTILES)
+    assert summary['ci_width'] == quantile_ci_width(results).max()